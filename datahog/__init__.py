@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import
 
-from .api import alias, name, node, prop, relationship
+from .api import (alias, bulk, name, node, partition, prop, purge,
+        relationship)
 from .const import *
 from .pool import *
@@ -10,7 +10,8 @@ from ..const import table, util
 from ..db import query, txn
 
 
-__all__ = ['set', 'lookup', 'list', 'batch', 'set_flags', 'shift', 'remove']
+__all__ = ['set', 'lookup', 'list', 'iter_aliases', 'count', 'batch',
+        'set_flags', 'shift', 'remove']
 
 
 def set(pool, base_id, ctx, value, flags=None, index=None, timeout=None):
@@ -35,8 +36,9 @@ def set(pool, base_id, ctx, value, flags=None, index=None, timeout=None):
         rather than at the end of the list
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether or not the alias was stored. it wouldn't be newly
@@ -83,8 +85,9 @@ def lookup(pool, value, ctx, timeout=None):
     :param int ctx: the alias's context
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         an alias dict (containing ``base_id``, ``ctx``, ``value``, and
@@ -121,8 +124,9 @@ def list(pool, base_id, ctx, limit=100, start=0, timeout=None):
         start the results
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         two-tuple with a list of alias dicts (containing ``base_id``, ``ctx``,
@@ -130,7 +134,7 @@ def list(pool, base_id, ctx, limit=100, start=0, timeout=None):
         used as ``start`` in a subsequent call to page forward from after the
         end of this result list.
     '''
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         results = query.select_aliases(
                 conn.cursor(), base_id, ctx, limit, start)
 
@@ -142,6 +146,69 @@ def list(pool, base_id, ctx, limit=100, start=0, timeout=None):
     return results, pos + 1
 
 
+def iter_aliases(pool, base_id, ctx, start=0, page_size=100, timeout=None):
+    '''iterate over all the aliases associated with a id object for a context
+
+    this pages through :func:`list` with the next page already being fetched
+    while the current one is consumed.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int base_id: the id of the parent object
+
+    :param int ctx: the alias's context
+
+    :param int start:
+        an integer representing the index in the list of aliases from which
+        to start
+
+    :param int page_size: the number of aliases to fetch at a time
+
+    :param timeout:
+        maximum time in seconds that fetching each page is allowed to take;
+        the default of ``None`` means no limit
+
+    :returns:
+        a generator of alias dicts (containing ``base_id``, ``ctx``,
+        ``value``, and ``flags`` keys)
+    '''
+    def fetch(start):
+        return list(pool, base_id, ctx, page_size, start, timeout)
+
+    return (alias for page in txn.pages(pool, fetch, start, page_size)
+            for alias in page)
+
+
+def count(pool, base_id, ctx, timeout=None):
+    '''count the aliases under a id object for a given context
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int base_id: the id of the parent object
+
+    :param int ctx: the aliases' context
+
+    :param timeout:
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
+
+    :returns: the number of aliases
+
+    :raises BadContext:
+        if the ``ctx`` is not a registered context for table.ALIAS
+    '''
+    if util.ctx_tbl(ctx) != table.ALIAS:
+        raise error.BadContext(ctx)
+
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
+        return query.select_list_length(conn.cursor(), base_id, ctx)
+
+
 def batch(pool, bid_ctx_pairs, timeout=None):
     '''perform a batch lookup of aliases under given base_ids
 
@@ -154,8 +221,9 @@ def batch(pool, bid_ctx_pairs, timeout=None):
         for each base_id/ctx will come up in the results
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a list of the same length as bid_ctx_pairs. if there exists one or more
@@ -169,21 +237,18 @@ def batch(pool, bid_ctx_pairs, timeout=None):
     for bid, ctx in bid_ctx_pairs:
         groups.setdefault(pool.shard_by_id(bid), []).append((bid, ctx))
 
-    if timeout is not None:
-        deadline = time.time() + timeout
-
-    aliases = []
-    for shard, group in groups.iteritems():
-        with pool.get_by_shard(shard, timeout=timeout) as conn:
-            aliases.extend(query.select_alias_batch(conn.cursor(), group))
-
-        if timeout is not None:
-            timeout = deadline - time.time()
+    def fetch(shard, group, deadline):
+        aliases = []
+        with pool.get_read_by_shard(shard, timeout=deadline) as conn:
+            for chunk in util.chunks(group, pool.batch_size):
+                aliases.extend(query.select_alias_batch(conn.cursor(), chunk))
+        return aliases
 
     results = [None] * len(bid_ctx_pairs)
-    for al in aliases:
-        al['flags'] = util.int_to_flags(al['ctx'], al['flags'])
-        results[order[(al['base_id'], al['ctx'])]] = al
+    for aliases in pool.fan_out(fetch, groups, timeout).itervalues():
+        for al in aliases:
+            al['flags'] = util.int_to_flags(al['ctx'], al['flags'])
+            results[order[(al['base_id'], al['ctx'])]] = al
 
     return results
 
@@ -206,8 +271,9 @@ def set_flags(pool, base_id, ctx, value, add, clear, timeout=None):
     :param iterable clear: the flags to clear
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the new set of flags, or None if there is no alias for the given
@@ -256,8 +322,9 @@ def shift(pool, base_id, ctx, value, index, timeout=None):
     :param int index: the new index to which to move the alias
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean of whether the move happened or not. it might not happen if
@@ -286,8 +353,9 @@ def remove(pool, base_id, ctx, value, timeout=None):
     :param value: value of the alias
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether the remove was done or not (it would only fail if
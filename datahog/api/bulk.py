@@ -0,0 +1,351 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+from __future__ import absolute_import
+
+import hashlib
+import hmac
+
+import psycopg2
+
+from .. import error
+from ..const import ordering, search, storage, table, util
+from ..db import query
+
+
+__all__ = ['load_nodes', 'load_properties', 'load_aliases', 'load_names']
+
+
+def load_nodes(pool, nodes, chunk_size=None, timeout=None):
+    '''load a stream of new nodes with COPY
+
+    the nodes are taken ``chunk_size`` at a time, and each chunk is split by
+    shard and written to each shard with a single COPY (plus one for the
+    edges), in one transaction per shard. this is for backfilling: it skips
+    the checks :func:`node.create <datahog.api.node.create>` makes that
+    parents exist, and appends to the ends of the parents' lists without
+    guarding against concurrent writers to the same lists.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting database connections
+
+    :param iterable nodes:
+        ``(ctx, value, base_id, flags)`` four-tuples of nodes to create, with
+        the same meanings as the arguments to
+        :func:`node.create <datahog.api.node.create>`. ``base_id`` and
+        ``flags`` may be ``None``.
+
+    :param int chunk_size:
+        how many nodes to load at a time, the default is the pool's
+        ``batch_size``
+
+    :param timeout:
+        maximum time in seconds that loading a chunk into a single shard is
+        allowed to take; the default of ``None`` means no limit
+
+    :returns: a list of the new nodes' ids, in the same order as ``nodes``
+
+    :raises ReadOnly: if the provided pool is read-only
+
+    :raises BadContext:
+        if a ``ctx`` is not a context associated with table.NODE, or doesn't
+        have both ``base_ctx`` and ``storage`` configured
+
+    :raises MissingParent:
+        if a ``ctx`` is configured with a ``base_ctx``, but no ``base_id``
+        was given
+
+    :raises StorageClassError:
+        if a ``value`` doesn't have the right type for the configured
+        ``storage``
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    loaded = []
+    for chunk in util.chunks(nodes, chunk_size or pool.batch_size):
+        groups = {}
+        for i, (ctx, value, base_id, flags) in enumerate(chunk):
+            if (util.ctx_tbl(ctx) != table.NODE
+                    or util.ctx_storage(ctx) is None):
+                raise error.BadContext(ctx)
+
+            if util.ctx_base_ctx(ctx) is not None and base_id is None:
+                raise error.MissingParent()
+
+            if base_id is None:
+                shard = pool.shard_for_root_insert()
+            else:
+                shard = pool.shard_by_id(base_id)
+
+            groups.setdefault(shard, []).append((i, (
+                ctx, util.storage_wrap(ctx, value), base_id,
+                util.flags_to_int(ctx, flags or []))))
+
+        ids = [None] * len(chunk)
+        for shard, group in groups.iteritems():
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                cursor = conn.cursor()
+                nids = query.reserve_node_ids(cursor, len(group))
+
+                rows, edges = [], []
+                for nid, (i, node) in zip(nids, group):
+                    ctx, value, base_id, flags = node
+                    ids[i] = nid
+                    if util.ctx_storage(ctx) == storage.INT:
+                        rows.append((nid, ctx, flags, value, None))
+                    else:
+                        rows.append((nid, ctx, flags, None, value))
+                    if base_id is not None:
+                        edges.append((base_id, ctx, nid))
+
+                query.copy_rows(cursor, 'node',
+                        ('id', 'ctx', 'flags', 'num', 'value'), rows)
+                if edges:
+                    query.copy_rows(cursor, 'edge',
+                            ('base_id', 'ctx', 'child_id', 'pos'),
+                            _positioned(cursor, 'edge', edges))
+
+        loaded.extend(ids)
+
+    return loaded
+
+
+def load_properties(pool, props, chunk_size=None, timeout=None):
+    '''load a stream of new properties with COPY
+
+    properties are grouped by their parent's shard ``chunk_size`` at a time
+    and COPYed in. none of them may already exist (an existing
+    ``base_id/ctx`` property fails the COPY to that shard), and the parents
+    aren't checked for.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting database connections
+
+    :param iterable props:
+        ``(base_id, ctx, value, flags)`` four-tuples, with the meanings of the
+        arguments to :func:`prop.set <datahog.api.prop.set>`. ``flags`` may
+        be ``None``.
+
+    :param int chunk_size:
+        how many properties to load at a time, the default is the pool's
+        ``batch_size``
+
+    :param timeout:
+        maximum time in seconds that loading a chunk into a single shard is
+        allowed to take; the default of ``None`` means no limit
+
+    :returns: the number of properties loaded
+
+    :raises ReadOnly: if given a read-only db pool
+
+    :raises BadContext:
+        if a ``ctx`` is not a context associated with ``table.PROPERTY``, or
+        it doesn't have both a ``base_ctx`` and ``storage`` configured.
+
+    :raises StorageClassError:
+        if a ``value`` doesn't have the right type for the configured
+        ``storage``
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    count = 0
+    for chunk in util.chunks(props, chunk_size or pool.batch_size):
+        groups = {}
+        for base_id, ctx, value, flags in chunk:
+            if (util.ctx_tbl(ctx) != table.PROPERTY
+                    or util.ctx_base_ctx(ctx) is None
+                    or util.ctx_storage(ctx) is None):
+                raise error.BadContext(ctx)
+
+            value = util.storage_wrap(ctx, value)
+            flags = util.flags_to_int(ctx, flags or [])
+            if util.ctx_storage(ctx) == storage.INT:
+                row = (base_id, ctx, flags, value, None)
+            else:
+                row = (base_id, ctx, flags, None, value)
+            groups.setdefault(pool.shard_by_id(base_id), []).append(row)
+
+        for shard, rows in groups.iteritems():
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                query.copy_rows(conn.cursor(), 'property',
+                        ('base_id', 'ctx', 'flags', 'num', 'value'), rows)
+
+        count += len(chunk)
+
+    return count
+
+
+def load_aliases(pool, aliases, chunk_size=None, timeout=None):
+    '''load a stream of new aliases with COPY
+
+    each chunk of ``chunk_size`` aliases is COPYed into the alias_lookup
+    tables of the shards the aliases hash to, and then into the alias tables
+    of the parents' shards. unlike :func:`alias.set <datahog.api.alias.set>`
+    there is no two-phase commit between the two, and aliases already in use
+    are only caught if their alias_lookup is on the shard being written to
+    (which fails the COPY to that shard).
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting database connections
+
+    :param iterable aliases:
+        ``(base_id, ctx, value, flags)`` four-tuples with the meanings of the
+        arguments to :func:`alias.set <datahog.api.alias.set>`. ``flags`` may
+        be ``None``.
+
+    :param int chunk_size:
+        how many aliases to load at a time, the default is the pool's
+        ``batch_size``
+
+    :param timeout:
+        maximum time in seconds that loading a chunk into a single shard is
+        allowed to take; the default of ``None`` means no limit
+
+    :returns: the number of aliases loaded
+
+    :raises ReadOnly: if given a read-only ``pool``
+
+    :raises BadContext:
+        if a ``ctx`` is not a registered context associated with table.ALIAS
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    count = 0
+    for chunk in util.chunks(aliases, chunk_size or pool.batch_size):
+        lookups, groups = {}, {}
+        for base_id, ctx, value, flags in chunk:
+            if util.ctx_tbl(ctx) != table.ALIAS:
+                raise error.BadContext(ctx)
+
+            flags = util.flags_to_int(ctx, flags or [])
+            digest = hmac.new(pool.digestkey, value.encode('utf8'),
+                    hashlib.sha1).digest()
+
+            lookups.setdefault(pool.shard_for_alias_write(digest), []).append(
+                    (psycopg2.Binary(digest), ctx, base_id, flags))
+            groups.setdefault(pool.shard_by_id(base_id), []).append(
+                    (base_id, ctx, value, flags))
+
+        for shard, rows in lookups.iteritems():
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                query.copy_rows(conn.cursor(), 'alias_lookup',
+                        ('hash', 'ctx', 'base_id', 'flags'), rows)
+
+        for shard, rows in groups.iteritems():
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                cursor = conn.cursor()
+                query.copy_rows(cursor, 'alias',
+                        ('base_id', 'ctx', 'value', 'flags', 'pos'),
+                        _positioned(cursor, 'alias', rows))
+
+        count += len(chunk)
+
+    return count
+
+
+def load_names(pool, names, chunk_size=None, timeout=None):
+    '''load a stream of new names with COPY
+
+    names are COPYed ``chunk_size`` at a time into the name tables of their
+    parents' shards, and the matching prefix or phonetic lookups into the
+    shards those are routed to. as with the other loaders there is no
+    two-phase commit, and parents aren't checked for.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting database connections
+
+    :param iterable names:
+        ``(base_id, ctx, value, flags)`` four-tuples with the meanings of the
+        arguments to :func:`name.create <datahog.api.name.create>`. ``flags``
+        may be ``None``.
+
+    :param int chunk_size:
+        how many names to load at a time, the default is the pool's
+        ``batch_size``
+
+    :param timeout:
+        maximum time in seconds that loading a chunk into a single shard is
+        allowed to take; the default of ``None`` means no limit
+
+    :returns: the number of names loaded
+
+    :raises ReadOnly: if given a read-only ``pool``
+
+    :raises BadContext:
+        if a ``ctx`` is not a valid context configured for ``table.NAME``
+        with a search class
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    count = 0
+    for chunk in util.chunks(names, chunk_size or pool.batch_size):
+        prefixes, phonetics, groups = {}, {}, {}
+        for base_id, ctx, value, flags in chunk:
+            if util.ctx_tbl(ctx) != table.NAME:
+                raise error.BadContext(ctx)
+
+            flags = util.flags_to_int(ctx, flags or [])
+            sclass = util.ctx_search(ctx)
+            if sclass == search.PREFIX:
+                shard = pool.shard_for_prefix_write(value.encode('utf8'))
+                prefixes.setdefault(shard, []).append(
+                        (value, flags, ctx, base_id))
+            elif sclass == search.PHONETIC:
+                dm, dmalt = util.dmetaphone(value)
+                codes = [dm]
+                if dmalt is not None and util.ctx_phonetic_loose(ctx):
+                    codes.append(dmalt)
+                for code in codes:
+                    shard = pool.shard_for_phonetic_write(code)
+                    phonetics.setdefault(shard, []).append(
+                            (value, code, flags, ctx, base_id))
+            else:
+                raise error.BadContext(ctx)
+
+            groups.setdefault(pool.shard_by_id(base_id), []).append(
+                    (base_id, ctx, value, flags))
+
+        for shard, rows in groups.iteritems():
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                cursor = conn.cursor()
+                query.copy_rows(cursor, 'name',
+                        ('base_id', 'ctx', 'value', 'flags', 'pos'),
+                        _positioned(cursor, 'name', rows))
+
+        for shard in set(prefixes) | set(phonetics):
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                cursor = conn.cursor()
+                if shard in prefixes:
+                    query.copy_rows(cursor, 'prefix_lookup',
+                            ('value', 'flags', 'ctx', 'base_id'),
+                            prefixes[shard])
+                if shard in phonetics:
+                    query.copy_rows(cursor, 'phonetic_lookup',
+                            ('value', 'code', 'flags', 'ctx', 'base_id'),
+                            phonetics[shard])
+
+        count += len(chunk)
+
+    return count
+
+
+def _positioned(cursor, tbl, rows):
+    # append to each (base_id, ctx, ...) row the next position at the end of
+    # its list, numbering the way the single inserts do
+    last = query.select_last_positions(
+            cursor, tbl, set(row[:2] for row in rows))
+    for row in rows:
+        if util.ctx_ordering(row[1]) == ordering.SPARSE:
+            step = query.SPARSE_GAP
+        else:
+            step = 1
+        pos = last.get(row[:2], 0) + step
+        last[row[:2]] = pos
+        yield row + (pos,)
@@ -7,7 +7,8 @@ from ..const import search as searchconst, table, util
 from ..db import query, txn
 
 
-__all__ = ['create', 'search', 'list', 'set_flags', 'shift', 'remove']
+__all__ = ['create', 'search', 'list', 'iter_names', 'count', 'set_flags',
+        'shift', 'remove']
 
 
 def create(pool, base_id, ctx, value, flags=None, index=None, timeout=None):
@@ -31,8 +32,9 @@ def create(pool, base_id, ctx, value, flags=None, index=None, timeout=None):
         it onto the end).
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean of whether or not the name was stored. it might come back
@@ -79,8 +81,9 @@ def search(pool, value, ctx, limit=100, start=None, timeout=None):
         can be used to pick up paging from where that search left off
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a two-tuple with a list of name dicts (each containing ``base_id``,
@@ -118,8 +121,9 @@ def list(pool, base_id, ctx, limit=100, start=0, timeout=None):
         to start the results
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a two-tuple with a list of name dicts (each containing ``base_id``,
@@ -127,7 +131,7 @@ def list(pool, base_id, ctx, limit=100, start=0, timeout=None):
         be used as the value of ``start`` in subsequent calls, to continue
         paging from the end of this result list
     '''
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         results = query.select_names(conn.cursor(), base_id, ctx, limit, start)
 
     pos = -1
@@ -138,6 +142,69 @@ def list(pool, base_id, ctx, limit=100, start=0, timeout=None):
     return results, pos + 1
 
 
+def iter_names(pool, base_id, ctx, start=0, page_size=100, timeout=None):
+    '''iterate over all the names associated with a id object for a context
+
+    like :func:`list`, but runs to the end of the names. pages are fetched in
+    the background ahead of when they're needed.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int base_id: the id of the parent object
+
+    :param int ctx: the name's context
+
+    :param int start:
+        an integer representing the index in the list of names from which
+        to start
+
+    :param int page_size: the number of names to fetch at a time
+
+    :param timeout:
+        maximum time in seconds that fetching each page is allowed to take;
+        the default of ``None`` means no limit
+
+    :returns:
+        a generator of name dicts (containing ``base_id``, ``ctx``,
+        ``value``, and ``flags`` keys)
+    '''
+    def fetch(start):
+        return list(pool, base_id, ctx, page_size, start, timeout)
+
+    return (name for page in txn.pages(pool, fetch, start, page_size)
+            for name in page)
+
+
+def count(pool, base_id, ctx, timeout=None):
+    '''count the names under a id object for a given context
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int base_id: the id of the parent object
+
+    :param int ctx: the names' context
+
+    :param timeout:
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
+
+    :returns: the number of names
+
+    :raises BadContext:
+        if the ``ctx`` is not a registered context for table.NAME
+    '''
+    if util.ctx_tbl(ctx) != table.NAME:
+        raise error.BadContext(ctx)
+
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
+        return query.select_list_length(conn.cursor(), base_id, ctx)
+
+
 def set_flags(pool, base_id, ctx, value, add, clear, timeout=None):
     '''remove flags from an existing name
 
@@ -156,8 +223,9 @@ def set_flags(pool, base_id, ctx, value, add, clear, timeout=None):
     :param iterable clear: the flags to clear
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the new set of flags, or None if there is no alias for the given
@@ -205,8 +273,9 @@ def shift(pool, base_id, ctx, value, index, timeout=None):
     :param int index: the new zero-index position to which to move the name
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean of whether the move happened or not. it might not happen if
@@ -234,8 +303,9 @@ def remove(pool, base_id, ctx, value, timeout=None):
     :param unicode value: value of the name
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether the remove was done or not (it would only fail if
@@ -2,16 +2,15 @@
 
 from __future__ import absolute_import
 
-import time
-
 from .. import error
 from ..const import context, storage, table, util
 from ..db import query, txn
+from ..pool import Deadline
 
 
 __all__ = ['create', 'get', 'batch_get', 'child_of', 'list_children',
-        'get_children', 'update', 'increment', 'set_flags', 'move',
-        'shift', 'remove']
+        'get_children', 'iter_children', 'count_children', 'update',
+        'increment', 'set_flags', 'move', 'shift', 'remove']
 
 
 _missing = object()
@@ -39,8 +38,9 @@ def create(pool, ctx, value, base_id=None, index=None, flags=None, timeout=None)
     :param iterable flags: any flags to set on the new node
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a node dict, containing keys ``id``, ``ctx``, ``value``, ``flags``
@@ -97,8 +97,9 @@ def get(pool, node_id, ctx, timeout=None):
     :param int ctx: the node's context
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a node dict (contains ``id``, ``ctx``, ``value``, and ``flags``
@@ -113,7 +114,7 @@ def get(pool, node_id, ctx, timeout=None):
             or util.ctx_storage(ctx) is None):
         raise error.BadContext(ctx)
 
-    with pool.get_by_id(node_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(node_id, timeout=timeout) as conn:
         node = query.select_node(conn.cursor(), node_id, ctx)
 
     if node is None:
@@ -136,8 +137,9 @@ def batch_get(pool, nid_ctx_pairs, timeout=None):
         list of ``(id, ctx)`` tuples describing the nodes to fetch
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a list of node dicts containing ``id``, ``ctx``, ``value`` and
@@ -150,23 +152,19 @@ def batch_get(pool, nid_ctx_pairs, timeout=None):
     for nid, ctx in nid_ctx_pairs:
         groups.setdefault(pool.shard_by_id(nid), []).append((nid, ctx))
 
-    if timeout is not None:
-        deadline = time.time() + timeout
-
-    nodes = []
-    for shard, group in groups.iteritems():
-        with pool.get_by_shard(shard, timeout=timeout) as conn:
-            nodes.extend(
-                    query.select_nodes(conn.cursor(), group))
-
-        if timeout is not None:
-            timeout = deadline - time.time()
+    def fetch(shard, group, deadline):
+        nodes = []
+        with pool.get_read_by_shard(shard, timeout=deadline) as conn:
+            for chunk in util.chunks(group, pool.batch_size):
+                nodes.extend(query.select_nodes(conn.cursor(), chunk))
+        return nodes
 
     results = [None] * len(nid_ctx_pairs)
-    for node in nodes:
-        node['flags'] = util.int_to_flags(node['ctx'], node['flags'])
-        node['value'] = util.storage_unwrap(node['ctx'], node['value'])
-        results[order[node['id']]] = node
+    for nodes in pool.fan_out(fetch, groups, timeout).itervalues():
+        for node in nodes:
+            node['flags'] = util.int_to_flags(node['ctx'], node['flags'])
+            node['value'] = util.storage_unwrap(node['ctx'], node['value'])
+            results[order[node['id']]] = node
 
     return results
 
@@ -185,8 +183,9 @@ def child_of(pool, node_id, ctx, base_id, timeout=None):
     :param int base_id: the parent node's id
 
     :param timeout:
-        maximum time in seconds to allow the method to block. default of
-        ``None`` means no limit.
+        maximum time in seconds to allow the method to block, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls.
+        default of ``None`` means no limit.
 
     :returns: boolean of whether the child exists
 
@@ -199,7 +198,7 @@ def child_of(pool, node_id, ctx, base_id, timeout=None):
             or util.ctx_storage(ctx) is None):
         raise error.BadContext(ctx)
 
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         return query.select_edge_exists(
                 conn.cursor(), node_id, ctx, base_id)
 
@@ -222,8 +221,9 @@ def list_children(pool, base_id, ctx, limit=100, start=0, timeout=None):
         start the results
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         two tuple with a list of ints of the ids of the nodes, and an integer
@@ -239,7 +239,7 @@ def list_children(pool, base_id, ctx, limit=100, start=0, timeout=None):
             or util.ctx_storage(ctx) is None):
         raise error.BadContext(ctx)
 
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         results = query.select_node_ids(
                 conn.cursor(), base_id, limit, start, ctx)
 
@@ -266,8 +266,9 @@ def get_children(pool, base_id, ctx, limit=100, start=0, timeout=None):
         start the results
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         two tuple with a list of node dicts (each containing ``id``, ``ctx``,
@@ -279,17 +280,89 @@ def get_children(pool, base_id, ctx, limit=100, start=0, timeout=None):
         if ``ctx`` isn't a registered context for ``table.NODE``, or
         doesn't have both a ``base_ctx`` and ``storage`` configured
     '''
-    if timeout is not None:
-        deadline = time.time() + timeout
+    deadline = Deadline.coerce(timeout)
+    nids, pos = list_children(pool, base_id, ctx, limit, start, deadline)
+    nodes = batch_get(pool, [(nid, ctx) for nid in nids], deadline)
 
-    nids, pos = list_children(pool, base_id, ctx, limit, start, timeout)
+    return [node for node in nodes if node is not None], pos
 
-    if timeout is not None:
-        timeout = deadline - time.time()
 
-    nodes = batch_get(pool, [(nid, ctx) for nid in nids], timeout)
+def iter_children(pool, base_id, ctx, start=0, page_size=100, timeout=None):
+    '''iterate over all the nodes under a common parent
 
-    return [node for node in nodes if node is not None], pos
+    the nodes are fetched a page at a time, and the next page is requested
+    in the background while the current one is being consumed, so only a
+    couple of pages are ever held in memory however long the list is.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int base_id: the id of the parent node
+
+    :param int ctx: context of the nodes
+
+    :param int start:
+        an integer representing the index in the list of nodes from which to
+        start
+
+    :param int page_size: the number of nodes to fetch at a time
+
+    :param timeout:
+        maximum time in seconds that fetching each page is allowed to take;
+        the default of ``None`` means no limit
+
+    :returns:
+        a generator of node dicts (each containing ``id``, ``ctx``, ``value``
+        and ``flags`` keys)
+
+    :raises BadContext:
+        if ``ctx`` isn't a registered context for ``table.NODE``, or
+        doesn't have both a ``base_ctx`` and ``storage`` configured
+    '''
+    if (util.ctx_tbl(ctx) != table.NODE
+            or util.ctx_base_ctx(ctx) is None
+            or util.ctx_storage(ctx) is None):
+        raise error.BadContext(ctx)
+
+    def fetch(start):
+        nids, pos = list_children(
+                pool, base_id, ctx, page_size, start, timeout)
+        return batch_get(pool, [(nid, ctx) for nid in nids], timeout), pos
+
+    return (node for page in txn.pages(pool, fetch, start, page_size)
+            for node in page if node is not None)
+
+
+def count_children(pool, base_id, ctx, timeout=None):
+    '''count the nodes under a common parent
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int base_id: the id of the parent node
+
+    :param int ctx: context of the nodes
+
+    :param timeout:
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
+
+    :returns: the number of child nodes
+
+    :raises BadContext:
+        if ``ctx`` isn't a registered context for ``table.NODE``, or
+        doesn't have both a ``base_ctx`` and ``storage`` configured
+    '''
+    if (util.ctx_tbl(ctx) != table.NODE
+            or util.ctx_base_ctx(ctx) is None
+            or util.ctx_storage(ctx) is None):
+        raise error.BadContext(ctx)
+
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
+        return query.select_list_length(conn.cursor(), base_id, ctx)
 
 
 def update(pool, node_id, ctx, value, old_value=_missing, timeout=None):
@@ -309,8 +382,9 @@ def update(pool, node_id, ctx, value, old_value=_missing, timeout=None):
         if provided, only do the update if this is the current value
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a bool of whether the update happened. reasons that it might not are
@@ -360,8 +434,9 @@ def increment(pool, node_id, ctx, by=1, limit=None, timeout=None):
         for the resulting value (default of ``None`` means no limit)
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the modified integer node value, or None if no property exists for the
@@ -403,8 +478,9 @@ def set_flags(pool, node_id, ctx, add, clear, timeout=None):
     :param iterable clear: the flags to clear
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the new set of flags, or None if there is no node for the given
@@ -452,8 +528,9 @@ def shift(pool, node_id, ctx, base_id, index, timeout=None):
     :param int index: the 0-indexed position to which to move the node
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether or not the change was applied. it might return
@@ -494,8 +571,9 @@ def move(pool, node_id, ctx, base_id, new_base_id, index=None, timeout=None):
         insert this node, instead of at the end of the list
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether a node was moved. this would be ``False`` if there
@@ -537,8 +615,9 @@ def remove(pool, node_id, ctx, base_id=None, timeout=None):
     :param int base_id: the id of the node's parent, if it has one
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether a node was removed. this would be ``False`` if there
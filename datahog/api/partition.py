@@ -0,0 +1,78 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+from __future__ import absolute_import
+
+from .. import error
+from ..const import context, table, util
+from ..db import query
+
+
+__all__ = ['create_partitions']
+
+
+def create_partitions(pool, shards=None, timeout=None):
+    '''add the partitions for contexts configured with a ``partition``
+
+    needs schema migration 03, which makes the property, alias, relationship
+    and name tables partitioned by ctx with everything in a default
+    partition. this creates a partition for each ``partition`` named in the
+    registered contexts' meta (see :func:`set_context
+    <datahog.const.context.set_context>`) that doesn't exist yet, moving its
+    contexts' rows over from the default partition. it is meant to be run
+    after registering new contexts, and each partition is created in its own
+    transaction which locks the default partition while the rows move.
+
+    the contexts of a partition can't be changed once it exists, so adding a
+    context to an existing partition name has no effect here until that
+    partition is detached and dropped by hand.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting database connections
+
+    :param shards:
+        the shards to create partitions on, the default is all of the pool's
+        shards
+
+    :param timeout:
+        maximum time in seconds that creating a single partition (or looking
+        up the existing ones on a shard) is allowed to take; the default of
+        ``None`` means no limit
+
+    :returns:
+        a dict mapping shard numbers to dicts of the names of partitions
+        created and the numbers of rows moved into them
+
+    :raises ReadOnly: if given a read-only ``pool``
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    groups = {}
+    for ctx, (tbl, meta) in context.META.iteritems():
+        name = util.ctx_partition(ctx)
+        if name is not None:
+            groups.setdefault((table.NAMES[tbl], name), []).append(ctx)
+
+    if shards is None:
+        shards = pool.shards
+
+    created = {}
+    for shard in shards:
+        created[shard] = {}
+
+        with pool.get_by_shard(shard, timeout=timeout) as conn:
+            cursor = conn.cursor()
+            existing = set()
+            for tblname in sorted(set(tbl for tbl, name in groups)):
+                existing |= query.select_partitions(cursor, tblname)
+
+        for (tblname, name), ctxs in sorted(groups.iteritems()):
+            if name in existing:
+                continue
+
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                created[shard][name] = query.create_partition(
+                        conn.cursor(), tblname, name, sorted(ctxs))
+
+    return created
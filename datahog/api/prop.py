@@ -33,8 +33,9 @@ def set(pool, base_id, ctx, value, flags=None, timeout=None):
         is ignored if an update is made instead of an insert)
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a two-tuple of ``(inserted, updated)`` bools indicating whether the
@@ -88,8 +89,9 @@ def get(pool, base_id, ctx, timeout=None):
     :param int ctx: the property's context
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         property dict (containing ``base_id``, ``ctx``, ``flags``, and
@@ -103,7 +105,7 @@ def get(pool, base_id, ctx, timeout=None):
     if util.ctx_tbl(ctx) != table.PROPERTY or util.ctx_storage(ctx) is None:
         raise error.BadContext(ctx)
 
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         exists, value, flags = query.select_property(
                 conn.cursor(), base_id, ctx)
         if not exists:
@@ -130,15 +132,16 @@ def get_list(pool, base_id, ctx_list=None, timeout=None):
         or ``None`` (default) to fetch all contexts for the ``base_id``
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a list of the same length as ``ctx_list`` of property dicts (containing
         ``base_id``, ``ctx``, ``flags``, and ``value`` keys) or ``None``s,
         depending on whether the property exists for a given context.
     '''
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         results = query.select_properties(conn.cursor(), base_id, ctx_list)
 
     for r in results:
@@ -166,8 +169,9 @@ def increment(pool, base_id, ctx, by=1, limit=None, timeout=None):
         for the resulting property value (default of ``None`` means no limit)
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the modified integer property value, or None if no property exists for
@@ -210,8 +214,9 @@ def set_flags(pool, base_id, ctx, add, clear, timeout=None):
     :param iterable clear: the flags to clear
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the new set of flags, or None if there is no property for the given
@@ -260,8 +265,9 @@ def remove(pool, base_id, ctx, value=_missing, timeout=None):
     :param value: if provided, will only do the remove if this is the value
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether the remove was done or not (it would only fail if
@@ -0,0 +1,119 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+from __future__ import absolute_import
+
+from .. import error
+from ..db import query
+
+
+__all__ = ['TABLES', 'purge', 'purge_shard']
+
+
+#: every table with a ``time_removed`` column, in the order they are purged
+TABLES = ('property', 'alias', 'alias_lookup', 'relationship', 'edge',
+        'node', 'name', 'prefix_lookup', 'phonetic_lookup')
+
+
+def purge_shard(pool, shard, retention, archive=False, batch_size=None,
+        pause=100, tables=TABLES, progress=None, timeout=None):
+    '''purge old removed rows from a single shard
+
+    rows whose ``time_removed`` is more than ``retention`` seconds ago are
+    deleted (or moved to the matching ``<table>_archive`` table) at most
+    ``batch_size`` at a time, each batch in its own short transaction on a
+    freshly checked-out connection. the job sleeps for ``pause``
+    milliseconds between batches, so it can run alongside regular traffic.
+
+    this needs the indexes and archive tables from schema migration 02.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting database connections
+
+    :param int shard: the shard to purge
+
+    :param retention:
+        how long in seconds removed rows are kept before they are purged
+
+    :param bool archive:
+        whether to copy the rows into the archive tables instead of simply
+        deleting them (default ``False``)
+
+    :param int batch_size:
+        the most rows to purge from a table in one transaction, the default
+        is the pool's ``batch_size``
+
+    :param pause:
+        milliseconds to wait after each batch (default 100)
+
+    :param tables:
+        the names of the tables to purge, the default is all of
+        :data:`TABLES`
+
+    :param progress:
+        a function to call after every batch with the arguments ``(shard,
+        table, count)``, where ``count`` is the running total of rows purged
+        from that table
+
+    :param timeout:
+        maximum time in seconds that a single batch is allowed to take; the
+        default of ``None`` means no limit
+
+    :returns: a dict mapping table names to the number of rows purged
+
+    :raises ReadOnly: if given a read-only ``pool``
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    for tbl in tables:
+        if tbl not in TABLES:
+            raise ValueError("no tombstones in table %r" % (tbl,))
+
+    batch_size = batch_size or pool.batch_size
+    counts = {}
+    for tbl in tables:
+        counts[tbl] = 0
+        while 1:
+            with pool.get_by_shard(shard, timeout=timeout) as conn:
+                count = query.purge_removed(conn.cursor(), tbl, retention,
+                        batch_size, archive)
+
+            counts[tbl] += count
+            if progress is not None:
+                progress(shard, tbl, counts[tbl])
+
+            if count < batch_size:
+                break
+
+            if pause:
+                pool._pause(pause)
+
+    return counts
+
+
+def purge(pool, retention, archive=False, batch_size=None, pause=100,
+        tables=TABLES, shards=None, progress=None, timeout=None):
+    '''purge old removed rows from every shard
+
+    runs :func:`purge_shard` against each shard in turn, see there for the
+    details and the rest of the arguments.
+
+    :param shards:
+        the shards to purge, the default is all of the pool's shards
+
+    :returns:
+        a dict mapping shard numbers to the dicts of table names and counts
+        returned by :func:`purge_shard`
+
+    :raises ReadOnly: if given a read-only ``pool``
+    '''
+    if pool.readonly:
+        raise error.ReadOnly()
+
+    if shards is None:
+        shards = pool.shards
+
+    return dict((shard, purge_shard(pool, shard, retention, archive,
+            batch_size, pause, tables, progress, timeout))
+        for shard in shards)
@@ -7,7 +7,8 @@ from ..const import table, util
 from ..db import query, txn
 
 
-__all__ = ['create', 'list', 'get', 'set_flags', 'shift', 'remove']
+__all__ = ['create', 'list', 'iter_relationships', 'count', 'get',
+        'set_flags', 'shift', 'remove']
 
 
 def create(pool, ctx, base_id, rel_id, forward_index=None, reverse_index=None,
@@ -38,8 +39,9 @@ def create(pool, ctx, base_id, rel_id, forward_index=None, reverse_index=None,
         created by this method)
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a boolean of whether the new relationship was created. it wouldn't be
@@ -96,8 +98,9 @@ def list(pool, id, ctx, forward=True, limit=100, start=0, timeout=None):
         which to start the results
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         two-tuple with a list of relationship dicts (containing ``ctx``,
@@ -105,7 +108,7 @@ def list(pool, id, ctx, forward=True, limit=100, start=0, timeout=None):
         that can be used as ``start`` in a subsequent call to page forward from
         after the end of this result list.
     '''
-    with pool.get_by_id(id, timeout=timeout) as conn:
+    with pool.get_read_by_id(id, timeout=timeout) as conn:
         results = query.select_relationships(conn.cursor(), id, ctx, forward, limit, start)
 
     pos = 0
@@ -116,6 +119,81 @@ def list(pool, id, ctx, forward=True, limit=100, start=0, timeout=None):
     return results, pos
 
 
+def iter_relationships(pool, id, ctx, forward=True, start=0, page_size=100,
+        timeout=None):
+    '''iterate over all the relationships associated with a id object
+
+    relationships are read ``page_size`` at a time, with the following page
+    requested while the current one is consumed. at most two pages are in
+    memory at once.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int id: id of the parent object
+
+    :param int ctx: context of the relationships to fetch
+
+    :param bool forward:
+        if ``True``, then fetches relationships which have ``id`` as their
+        ``base_id``, otherwise ``id`` refers to ``rel_id``
+
+    :param int start:
+        an integer representing the index in the list of relationships from
+        which to start
+
+    :param int page_size: the number of relationships to fetch at a time
+
+    :param timeout:
+        maximum time in seconds that fetching each page is allowed to take;
+        the default of ``None`` means no limit
+
+    :returns:
+        a generator of relationship dicts (containing ``ctx``, ``base_id``,
+        ``rel_id``, and ``flags`` keys)
+    '''
+    def fetch(start):
+        return list(pool, id, ctx, forward, page_size, start, timeout)
+
+    return (rel for page in txn.pages(pool, fetch, start, page_size)
+            for rel in page)
+
+
+def count(pool, id, ctx, forward=True, timeout=None):
+    '''count the relationships associated with a id object
+
+    this reads a maintained counter rather than the relationships themselves.
+
+    :param ConnectionPool pool:
+        a :class:`ConnectionPool <datahog.dbconn.ConnectionPool>` to use for
+        getting a database connection
+
+    :param int id: id of the parent object
+
+    :param int ctx: context of the relationships to count
+
+    :param bool forward:
+        if ``True``, then counts relationships which have ``id`` as their
+        ``base_id``, otherwise ``id`` refers to ``rel_id``
+
+    :param timeout:
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
+
+    :returns: the number of relationships
+
+    :raises BadContext:
+        if the ``ctx`` is not a registered context for table.RELATIONSHIP
+    '''
+    if util.ctx_tbl(ctx) != table.RELATIONSHIP:
+        raise error.BadContext(ctx)
+
+    with pool.get_read_by_id(id, timeout=timeout) as conn:
+        return query.select_list_length(conn.cursor(), id, ctx, forward)
+
+
 def get(pool, ctx, base_id, rel_id, timeout=None):
     '''fetch the relationship between two ids
 
@@ -130,14 +208,15 @@ def get(pool, ctx, base_id, rel_id, timeout=None):
     :param int rel_id: id of the object at the other end
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         a relationship dict (with ``ctx``, ``base_id``, ``rel_id``, and
         ``flags`` keys) or None if there is no such relationship
     '''
-    with pool.get_by_id(base_id, timeout=timeout) as conn:
+    with pool.get_read_by_id(base_id, timeout=timeout) as conn:
         rels = query.select_relationships(
                 conn.cursor(), base_id, ctx, True, 1, 0, rel_id)
 
@@ -167,8 +246,9 @@ def set_flags(pool, base_id, rel_id, ctx, add, clear, timeout=None):
     :param iterable clear: the flags to clear
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         the new set of flags, or None if there is no relationship for the given
@@ -224,8 +304,9 @@ def shift(pool, base_id, rel_id, ctx, forward, index, timeout=None):
         ``forward``) to which to move this relationship
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean of whether the shift happened or not. it might not happen if
@@ -257,8 +338,9 @@ def remove(pool, base_id, rel_id, ctx, timeout=None):
     :param int ctx: the relationshp's context
 
     :param timeout:
-        maximum time in seconds that the method is allowed to take; the default
-        of ``None`` means no limit
+        maximum time in seconds that the method is allowed to take, or a
+        :class:`Deadline <datahog.pool.Deadline>` shared with other calls; the
+        default of ``None`` means no limit
 
     :returns:
         boolean, whether the remove was done or not (it would only fail if
@@ -2,12 +2,12 @@
 
 from __future__ import absolute_import
 
-from . import context, flag, search, storage, table
+from . import context, flag, ordering, search, storage, table
 from .table import *
 
 
-__all__ = table.__all__ + ['context', 'flag', 'search', 'storage', 'table',
-        'set_context', 'set_flag']
+__all__ = table.__all__ + ['context', 'flag', 'ordering', 'search', 'storage',
+        'table', 'set_context', 'set_flag']
 
 
 set_context = context.set_context
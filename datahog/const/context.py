@@ -2,13 +2,20 @@
 
 from __future__ import absolute_import
 
+import re
+
 import mummy
 
-from . import search, storage, table
+from . import ordering, search, storage, table
 
 
 META = {}
 
+# the tables that schema migration 03 partitions by ctx
+PARTITIONED = (table.PROPERTY, table.ALIAS, table.RELATIONSHIP, table.NAME)
+
+_partition_name = re.compile(r'^[a-z0-9_]+$')
+
 
 def set_context(value, tbl, meta=None):
     '''create a constant for use in 'ctx'
@@ -57,6 +64,31 @@ def set_context(value, tbl, meta=None):
             phonetic_loose
                 for ``table.NAME`` and ``search.PHONETIC``, setting this to
                 ``True`` (default ``False``) enables looser phonetic matching.
+
+            ordering
+                how positions are kept in the lists of this context's objects
+                under a common parent. must be one of the ordering constants
+                ``DENSE`` (the default) or ``SPARSE``. applies when ``tbl`` is
+                ``table.ALIAS``, ``table.NAME``, ``table.RELATIONSHIP`` or
+                ``table.NODE`` (for its place among its parent's children).
+
+                ``DENSE`` lists are numbered consecutively, so inserting,
+                moving or removing anywhere but the end renumbers the rest of
+                the list. ``SPARSE`` lists leave gaps between positions, so
+                those take a single row write, at the cost of the ``start``
+                returned for paging no longer being the count of items passed.
+
+            partition
+                gives the context a partition of its own in its table (see
+                schema migration 03 and
+                :func:`partition.create_partitions
+                <datahog.api.partition.create_partitions>`). ``True`` puts the
+                context in a partition by itself, and a name (lowercase
+                letters, digits and underscores) groups it with the other
+                contexts of the same table given the same name. applies when
+                ``tbl`` is ``table.PROPERTY``, ``table.ALIAS``,
+                ``table.RELATIONSHIP`` or ``table.NAME``. contexts without it
+                share the default partition.
     '''
     if value in META:
         raise ValueError("duplicate context value: %s" % value)
@@ -81,6 +113,17 @@ def set_context(value, tbl, meta=None):
             meta['schema'] = type('Schema', (mummy.Message,),
                     {'SCHEMA': meta['schema']})
 
+        if meta.get('ordering', ordering.DENSE) not in ordering.ALL:
+            raise ValueError("unrecognized ordering: %r" % meta['ordering'])
+
+        if 'partition' in meta:
+            if tbl not in PARTITIONED:
+                raise ValueError("%s contexts aren't partitioned" %
+                        table.NAMES[tbl])
+            if (meta['partition'] is not True and
+                    not _partition_name.match(str(meta['partition']))):
+                raise ValueError("bad partition name: %r" % meta['partition'])
+
         if meta.get('search') == search.PHONETIC:
             # just so that this blows up nice and early
             import fuzzy
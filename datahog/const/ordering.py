@@ -0,0 +1,6 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+DENSE = 0
+SPARSE = 1
+
+ALL = frozenset([DENSE, SPARSE])
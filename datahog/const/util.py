@@ -2,10 +2,12 @@
 
 from __future__ import absolute_import
 
+import itertools
+
 import mummy
 import psycopg2
 
-from . import context, flag, storage, table
+from . import context, flag, ordering, storage, table
 from .. import error
 
 
@@ -86,6 +88,23 @@ def ctx_phonetic_loose(ctx):
     return meta and meta[1].get('phonetic_loose')
 
 
+def ctx_ordering(ctx):
+    "return the list ordering for a context"
+    meta = context.META.get(ctx)
+    return ((meta and meta[1]) or {}).get('ordering', ordering.DENSE)
+
+
+def ctx_partition(ctx):
+    "return the name of the partition for a context, or None for the default"
+    meta = context.META.get(ctx)
+    partition = ((meta and meta[1]) or {}).get('partition')
+    if partition is None:
+        return None
+    if partition is True:
+        return '%s_part_%d' % (table.NAMES[meta[0]], ctx)
+    return '%s_part_%s' % (table.NAMES[meta[0]], partition)
+
+
 def flags_to_int(ctx, flag_list):
     "convert an iterable of flag consts to a single bitmap integer"
     if ctx not in context.META:
@@ -185,6 +204,15 @@ def storage_unwrap(ctx, value):
     return value
 
 
+def chunks(items, size):
+    items = iter(items)
+    while 1:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            break
+        yield chunk
+
+
 _dm = None
 
 def dmetaphone(value):
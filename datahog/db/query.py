@@ -2,28 +2,230 @@
 
 from __future__ import absolute_import
 
+import cStringIO
+import itertools
+import re
+import weakref
+
 import psycopg2
 
-from ..const import context, storage, table, util
+from ..const import context, ordering, storage, table, util
 
 
 _missing = object() # default argument sentinel
 
 
-def select_property(cursor, base_id, ctx):
-    if util.ctx_storage(ctx) == storage.INT:
-        val_field = 'num'
+# the hot statements that can be PREPAREd on every connection (see the
+# 'prepare_statements' ConnectionPool option), by the name they're EXECUTEd as
+_statements = {}
+
+# connections on which the statements have been prepared
+_prepared = weakref.WeakKeyDictionary()
+
+def _statement(name, sql):
+    _statements[name] = sql
+
+def _execute(cursor, name, params):
+    conn = getattr(cursor, 'connection', None)
+    if conn is not None and conn in _prepared:
+        cursor.execute("execute %s (%s)" % (
+            name, ', '.join(['%s'] * len(params))), params)
     else:
-        val_field = 'value'
+        cursor.execute(_statements[name], params)
+
+def _columns(rows, width):
+    # rows -> one list per column, to be passed as arrays and unnest()ed. the
+    # SQL is then the same however many rows there are, so it plans the same
+    if not rows:
+        return [[] for i in xrange(width)]
+    return map(list, zip(*rows))
+
+def _numbered(sql):
+    # psycopg2 placeholders -> PREPARE's $1, $2...
+    counter = itertools.count(1)
+    return re.sub('%s', lambda m: '$%d' % next(counter), sql)
+
+def prepare_statements(conn):
+    cursor = conn.cursor()
+    for name, sql in sorted(_statements.iteritems()):
+        cursor.execute("prepare %s as %s" % (name, _numbered(sql)))
+    conn.commit()
+    _prepared[conn] = True
+
+def reset(conn):
+    # psycopg2's reset() discards prepared statements along with the rest
+    conn.reset()
+    if conn in _prepared:
+        prepare_statements(conn)
+
+
+# positions in the lists of SPARSE ordering contexts are spaced SPARSE_GAP
+# apart, so an insert or move can take the midpoint between its neighbors
+# rather than renumbering everything after it. only when two neighbors have
+# run out of room between them is the list spaced out again, and a list too
+# long for that spacing to fit in the int4 pos column is spaced as widely as
+# it will fit (down to plain consecutive numbers).
+SPARSE_GAP = 1 << 10
+_MAX_POS = (1 << 31) - 1
+
+# the lists of alias, name and edge rows
+_BASE_LIST = 'base_id=%s and ctx=%s'
+
+def _sparse(ctx):
+    return util.ctx_ordering(ctx) == ordering.SPARSE
+
+def _sparse_slot(cursor, tbl, where, params, index, exclude=None):
+    # a free position at ``index`` (None for the end) of the list, not
+    # counting the ``exclude`` item (the one being moved)
+    pos = _find_slot(cursor, tbl, where, params, index, exclude)
+    if pos is None:
+        _spread(cursor, tbl, where, params)
+        pos = _find_slot(cursor, tbl, where, params, index, exclude)
+    return pos
+
+def _find_slot(cursor, tbl, where, params, index, exclude):
+    if exclude is not None:
+        where = '%s and not (%s)' % (where, exclude[0])
+        params = params + exclude[1]
+
+    if index is None:
+        cursor.execute("""
+select pos
+from %s
+where
+    time_removed is null
+    and %s
+order by pos desc
+limit 1
+""" % (tbl, where), params)
+        lo = cursor.fetchone()[0] if cursor.rowcount else 0
+        rows = []
+    else:
+        cursor.execute("""
+select pos
+from %s
+where
+    time_removed is null
+    and %s
+order by pos asc
+offset %%s
+limit 2
+""" % (tbl, where), params + (max(index - 1, 0),))
+        rows = [r[0] for r in cursor.fetchall()]
+
+        if not index:
+            lo = -1
+        elif rows:
+            lo = rows.pop(0)
+        else:
+            # past the end of the list
+            return _find_slot(cursor, tbl, where, params, None, None)
+
+    if not rows:
+        # near the top of the pos range, appends take half the room left
+        pos = min(lo + SPARSE_GAP, (lo + _MAX_POS + 1) // 2)
+        return pos if pos > lo else None
+
+    if rows[0] - lo < 2:
+        return None
+    return (lo + rows[0]) // 2
+
+def _spread_gap(count):
+    # the widest spacing that still leaves room to append after the last of
+    # ``count`` items, or 1 for dense numbering once midpoints can't fit
+    gap = min(SPARSE_GAP, _MAX_POS // (count + 1))
+    return gap if gap >= 2 else 1
+
+def _spread(cursor, tbl, where, params):
+    cursor.execute("""
+select count(*)
+from %s
+where
+    time_removed is null
+    and %s
+""" % (tbl, where), params)
+    gap = _spread_gap(cursor.fetchone()[0])
+
+    cursor.execute("""
+update %s
+set pos=spread.n * %d
+from (
+    select tableoid, ctid, row_number() over (order by pos) as n
+    from %s
+    where
+        time_removed is null
+        and %s
+) as spread
+where %s.tableoid=spread.tableoid and %s.ctid=spread.ctid
+""" % (tbl, gap, tbl, where, tbl, tbl), params)
+
+def _sparse_insert(cursor, tbl, values, parent):
+    # values are (column, value) pairs, and parent is the (table name, id,
+    # ctx) of an object that has to exist for the insert to happen, or None
+    cols, params = zip(*values)
+    if parent is None:
+        where = 'true'
+    else:
+        where = """exists (
+    select 1 from %s
+    where
+        time_removed is null
+        and id=%%s
+        and ctx=%%s
+)""" % (parent[0],)
+        params += parent[1:]
+
+    cursor.execute("""
+insert into %s (%s)
+select %s
+where %s
+returning 1
+""" % (tbl, ', '.join(cols), ', '.join(['%s'] * len(cols)), where), params)
+
+    return cursor.rowcount
+
+def _sparse_move(cursor, tbl, where, params, item, item_params, index):
+    pos = _sparse_slot(cursor, tbl, where, params, index, (item, item_params))
+    cursor.execute("""
+update %s
+set pos=%%s
+where
+    time_removed is null
+    and %s
+    and %s
+""" % (tbl, where, item), (pos,) + params + item_params)
 
+    return bool(cursor.rowcount)
+
+def _sparse_remove(cursor, tbl, where, params):
     cursor.execute("""
+update %s
+set time_removed=now()
+where
+    time_removed is null
+    and %s
+""" % (tbl, where), params)
+
+    return bool(cursor.rowcount)
+
+
+for _field in ('num', 'value'):
+    _statement('select_property_' + _field, """
 select %s, flags
 from property
 where
     time_removed is null
     and base_id=%%s
     and ctx=%%s
-""" % (val_field,), (base_id, ctx))
+""" % (_field,))
+
+def select_property(cursor, base_id, ctx):
+    if util.ctx_storage(ctx) == storage.INT:
+        val_field = 'num'
+    else:
+        val_field = 'value'
+
+    _execute(cursor, 'select_property_' + val_field, (base_id, ctx))
 
     if not cursor.rowcount:
         return False, None, None
@@ -40,9 +242,8 @@ where
     time_removed is null
     and base_id=%%s
     %s
-""" % ('' if ctxs is None else
-            'and ctx in (%s)' % ','.join('%s' for c in ctxs),),
-        (base_id,) + tuple(ctxs or ()))
+""" % ('' if ctxs is None else 'and ctx=any(%s::smallint[])',),
+        (base_id,) if ctxs is None else (base_id, list(ctxs)))
 
     if ctxs is None:
         return [{
@@ -129,9 +330,7 @@ where
     return cursor.rowcount
 
 
-def increment_property(cursor, base_id, ctx, by=1, limit=_missing):
-    if limit is _missing:
-        cursor.execute("""
+_statement('increment_property', """
 update property
 set num=num+%s
 where
@@ -139,11 +338,10 @@ where
     and base_id=%s
     and ctx=%s
 returning num
-""", (by, base_id, ctx))
+""")
 
-    else:
-        op = '>' if by < 0 else '<'
-        cursor.execute("""
+for _name, _op in (('floor', '>'), ('ceiling', '<')):
+    _statement('increment_property_' + _name, """
 update property
 set num=case
     when (num+%%s %s %%s)
@@ -155,7 +353,16 @@ where
     and base_id=%%s
     and ctx=%%s
 returning num
-""" % (op,), (by, limit, by, limit, base_id, ctx))
+""" % (_op,))
+
+def increment_property(cursor, base_id, ctx, by=1, limit=_missing):
+    if limit is _missing:
+        _execute(cursor, 'increment_property', (by, base_id, ctx))
+
+    else:
+        name = 'floor' if by < 0 else 'ceiling'
+        _execute(cursor, 'increment_property_' + name,
+                (by, limit, by, limit, base_id, ctx))
 
     if not cursor.rowcount:
         return None
@@ -196,22 +403,24 @@ update property
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
-""" % (','.join('%s' for x in base_ids),), base_ids)
+    and base_id=any(%s::bigint[])
+""", (list(base_ids),))
 
     return cursor.rowcount
 
 
-def select_alias_lookup(cursor, digest, ctx):
-    digest = psycopg2.Binary(digest)
-    cursor.execute("""
+_statement('select_alias_lookup', """
 select base_id, flags
 from alias_lookup
 where
     time_removed is null
     and hash=%s
     and ctx=%s
-""", (digest, ctx))
+""")
+
+def select_alias_lookup(cursor, digest, ctx):
+    digest = psycopg2.Binary(digest)
+    _execute(cursor, 'select_alias_lookup', (digest, ctx))
 
     if not cursor.rowcount:
         return None
@@ -248,8 +457,6 @@ limit %s
 
 
 def select_alias_batch(cursor, pairs):
-    flat_pairs = reduce(lambda a, b: a.extend(b) or a, pairs, [])
-
     cursor.execute("""
 with window_query as (
     select base_id, flags, ctx, value, rank() over (
@@ -259,12 +466,13 @@ with window_query as (
     from alias
     where
         time_removed is null
-        and (base_id, ctx) in (%s)
+        and (base_id, ctx) in (
+            select * from unnest(%s::bigint[], %s::smallint[]))
 )
 select base_id, flags, ctx, value
 from window_query
 where r=1
-""" % (','.join('(%s, %s)' for pair in pairs),), flat_pairs)
+""", _columns(pairs, 2))
 
     return [{
             'base_id': base_id,
@@ -304,6 +512,13 @@ def insert_alias(cursor, base_id, ctx, value, index, flags):
     base_tbl, base_ctx = util.ctx_base(ctx)
     base_tbl = table.NAMES[base_tbl]
 
+    if _sparse(ctx):
+        pos = _sparse_slot(cursor, 'alias', _BASE_LIST, (base_id, ctx), index)
+        return bool(_sparse_insert(cursor, 'alias', (
+                ('base_id', base_id), ('ctx', ctx), ('value', value),
+                ('pos', pos), ('flags', flags)),
+            (base_tbl, base_id, base_ctx)))
+
     if index is None:
         cursor.execute("""
 insert into alias (base_id, ctx, value, pos, flags)
@@ -357,6 +572,10 @@ returning 1
 
 
 def reorder_alias(cursor, base_id, ctx, value, pos):
+    if _sparse(ctx):
+        return _sparse_move(cursor, 'alias', _BASE_LIST, (base_id, ctx),
+                'value=%s', (value,), pos)
+
     cursor.execute("""
 with oldpos as (
     select pos
@@ -428,6 +647,10 @@ where
 
 
 def remove_alias(cursor, base_id, ctx, value):
+    if _sparse(ctx):
+        return _sparse_remove(cursor, 'alias', _BASE_LIST + ' and value=%s',
+                (base_id, ctx, value))
+
     cursor.execute("""
 with removal as (
     update alias
@@ -455,19 +678,17 @@ select 1 from removal
 
 
 def remove_alias_lookups_multi(cursor, aliases):
-    flat = []
-    for digest, ctx in aliases:
-        flat.append(psycopg2.Binary(digest))
-        flat.append(ctx)
+    digests, ctxs = _columns(aliases, 2)
+    digests = map(psycopg2.Binary, digests)
 
     cursor.execute("""
 update alias_lookup
 set time_removed=now()
 where
     time_removed is null
-    and (hash, ctx) in (%s)
+    and (hash, ctx) in (select * from unnest(%s::bytea[], %s::smallint[]))
 returning hash, ctx
-""" % (','.join('(%s, %s)' for x in aliases),), flat)
+""", (digests, ctxs))
 
     return cursor.fetchall()
 
@@ -478,9 +699,9 @@ update alias
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
+    and base_id=any(%s::bigint[])
 returning value, ctx
-""" % (','.join('%s' for x in base_ids),), base_ids)
+""", (list(base_ids),))
 
     return cursor.fetchall()
 
@@ -496,18 +717,26 @@ def insert_relationship(cursor, base_id, rel_id, ctx, forward, index, flags):
         id_col = 'rel_id'
     id_tbl = table.NAMES[id_tbl]
 
+    if _sparse(ctx):
+        pos = _sparse_slot(cursor, 'relationship',
+                '%s=%%s and ctx=%%s and forward=%%s' % (id_col,),
+                (id, ctx, forward), index)
+        return _sparse_insert(cursor, 'relationship', (
+                ('base_id', base_id), ('rel_id', rel_id), ('ctx', ctx),
+                ('forward', forward), ('pos', pos), ('flags', flags)),
+            (id_tbl, id, id_ctx))
+
     if index is None:
         cursor.execute("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %%s, %%s, %%s, %%s, (
-    select count(*)
-    from relationship
+select %%s, %%s, %%s, %%s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and %s=%%s
+        anchor_id=%%s
         and ctx=%%s
         and forward=%%s
-), %%s
+), 0), %%s
 where exists (
     select 1
     from %s
@@ -517,7 +746,7 @@ where exists (
         and ctx=%%s
 )
 returning 1
-""" % (id_col, id_tbl), (
+""" % (id_tbl,), (
         base_id, rel_id, ctx, forward,
         id, ctx, forward,
         flags,
@@ -554,30 +783,38 @@ returning 1
     return cursor.rowcount
 
 
-def select_relationships(cursor, id, ctx, forward, limit, start, other_id=_missing):
-    here_name = "base_id" if forward else "rel_id"
-    other_name = "rel_id" if forward else "base_id"
-
-    if other_id is _missing:
-        clause = ""
-        params = (id, ctx, forward, start, limit)
-    else:
-        clause = "and %s=%%s" % (other_name,)
-        params = (id, ctx, forward, start, other_id, limit)
-
-    cursor.execute("""
+# forward is written into these rather than passed, so that even the generic
+# plans of the prepared statements match the partial (covering) indexes
+for _forward in (True, False):
+    _here = "base_id" if _forward else "rel_id"
+    _other = "rel_id" if _forward else "base_id"
+    for _suffix, _clause in (('', ''), ('_other', 'and %s=%%s' % (_other,))):
+        _statement('select_relationships_%s%s' % (_here, _suffix), """
 select %s, flags, pos
 from relationship
 where
     time_removed is null
     and %s=%%s
     and ctx=%%s
-    and forward=%%s
+    and forward=%s
     and pos >= %%s
     %s
 order by pos asc
 limit %%s
-""" % (other_name, here_name, clause), params)
+""" % (_other, _here, str(_forward).lower(), _clause))
+
+def select_relationships(cursor, id, ctx, forward, limit, start, other_id=_missing):
+    here_name = "base_id" if forward else "rel_id"
+    other_name = "rel_id" if forward else "base_id"
+
+    if other_id is _missing:
+        name = 'select_relationships_' + here_name
+        params = (id, ctx, start, limit)
+    else:
+        name = 'select_relationships_%s_other' % (here_name,)
+        params = (id, ctx, start, other_id, limit)
+
+    _execute(cursor, name, params)
 
     return [{
             here_name: id,
@@ -596,6 +833,11 @@ def remove_relationship(cursor, base_id, rel_id, ctx, forward):
         anchor_id = rel_id
         anchor_col = "rel_id"
 
+    if _sparse(ctx):
+        return _sparse_remove(cursor, 'relationship',
+                'base_id=%s and ctx=%s and forward=%s and rel_id=%s',
+                (base_id, ctx, forward, rel_id))
+
     cursor.execute("""
 with removal as (
     update relationship
@@ -634,7 +876,7 @@ with forwardrels (base_id, ctx, forward, rel_id) as (
     where
         time_removed is null
         and forward=true
-        and base_id in (%s)
+        and base_id=any(%s::bigint[])
     returning base_id, ctx, forward, rel_id
 ),
 backwardrels (base_id, ctx, forward, rel_id) as (
@@ -643,27 +885,27 @@ backwardrels (base_id, ctx, forward, rel_id) as (
     where
         time_removed is null
         and forward=false
-        and rel_id in (%s)
+        and rel_id=any(%s::bigint[])
     returning base_id, ctx, forward, rel_id
 )
 select base_id, ctx, forward, rel_id from forwardrels
 UNION ALL
 select base_id, ctx, forward, rel_id from backwardrels
-""" % ((','.join('%s' for x in base_ids),) * 2), base_ids * 2)
+""", (list(base_ids),) * 2)
 
     return cursor.fetchall()
 
 
 def remove_relationships_multi(cursor, rels):
-    flat_rels = reduce(lambda a, b: a.extend(b) or a, rels, [])
-
     cursor.execute("""
 update relationship
 set time_removed=now()
 where
     time_removed is null
-    and (base_id, ctx, forward, rel_id) in (%s)
-""" % (','.join('(%s, %s, %s, %s)' for x in rels),), flat_rels)
+    and (base_id, ctx, forward, rel_id) in (
+        select * from unnest(
+            %s::bigint[], %s::smallint[], %s::bool[], %s::bigint[]))
+""", _columns(rels, 4))
 
     return cursor.rowcount
 
@@ -672,8 +914,8 @@ def bulk_reorder_relationships(cursor, pairs, forward):
     anchor_col = "base_id" if forward else "rel_id"
     data_col = "rel_id" if forward else "base_id"
 
-    replace = ','.join('(%s,%s)' for p in pairs)
-    flat_pairs = reduce(lambda a, b: a.extend(b) or a, pairs, [])
+    replace = 'select * from unnest(%s::bigint[], %s::smallint[])'
+    columns = _columns(list(pairs), 2)
 
     cursor.execute("""
 update relationship
@@ -697,7 +939,7 @@ where
 returning 1
 """ % (anchor_col, data_col, anchor_col, replace, data_col, data_col,
             anchor_col, replace),
-        ([forward] + flat_pairs) * 2)
+        ([forward] + columns) * 2)
 
     return cursor.rowcount
 
@@ -706,6 +948,12 @@ def reorder_relationship(cursor, base_id, rel_id, ctx, forward, pos):
     anchor_col = "base_id" if forward else "rel_id"
     anchor_id = base_id if forward else rel_id
 
+    if _sparse(ctx):
+        return _sparse_move(cursor, 'relationship',
+                '%s=%%s and ctx=%%s and forward=%%s' % (anchor_col,),
+                (anchor_id, ctx, forward),
+                'base_id=%s and rel_id=%s', (base_id, rel_id), pos)
+
     cursor.execute("""
 with oldpos as (
     select pos
@@ -793,6 +1041,13 @@ returning id
 
 
 def insert_edge(cursor, base_id, ctx, child_id, pos=None, check=False):
+    if _sparse(ctx):
+        slot = _sparse_slot(cursor, 'edge', _BASE_LIST, (base_id, ctx), pos)
+        return bool(_sparse_insert(cursor, 'edge', (
+                ('base_id', base_id), ('ctx', ctx), ('child_id', child_id),
+                ('pos', slot)),
+            ('node', base_id, util.ctx_base_ctx(ctx)) if check else None))
+
     if check:
         where = '''exists(
     select 1 from node
@@ -842,20 +1097,23 @@ returning 1
     return bool(cursor.rowcount)
 
 
-def select_node(cursor, nid, ctx):
-    if util.ctx_storage(ctx) == storage.INT:
-        val_field = 'num'
-    else:
-        val_field = 'value'
-
-    cursor.execute("""
+for _field in ('num', 'value'):
+    _statement('select_node_' + _field, """
 select flags, %s
 from node
 where
     time_removed is null
     and id=%%s
     and ctx=%%s
-""" % (val_field,), (nid, ctx))
+""" % (_field,))
+
+def select_node(cursor, nid, ctx):
+    if util.ctx_storage(ctx) == storage.INT:
+        val_field = 'num'
+    else:
+        val_field = 'value'
+
+    _execute(cursor, 'select_node_' + val_field, (nid, ctx))
 
     if not cursor.rowcount:
         return None
@@ -885,15 +1143,13 @@ where
 
 
 def select_nodes(cursor, id_ctx_pairs):
-    flat_pairs = reduce(lambda a, b: a.extend(b) or a, id_ctx_pairs, [])
-
     cursor.execute("""
 select id, ctx, flags, num, value
 from node
 where
     time_removed is null
-    and (id, ctx) in (%s)
-""" % (','.join('(%s, %s)' for p in id_ctx_pairs),), flat_pairs)
+    and (id, ctx) in (select * from unnest(%s::bigint[], %s::smallint[]))
+""", _columns(id_ctx_pairs, 2))
 
     return [{
             'id': id,
@@ -983,6 +1239,10 @@ returning num
 
 
 def reorder_edge(cursor, base_id, ctx, child_id, pos):
+    if _sparse(ctx):
+        return _sparse_move(cursor, 'edge', _BASE_LIST, (base_id, ctx),
+                'child_id=%s', (child_id,), pos)
+
     cursor.execute("""
 with oldpos as (
     select pos
@@ -1038,6 +1298,10 @@ select exists (select 1 from move)
 
 
 def remove_edge(cursor, base_id, ctx, child_id):
+    if _sparse(ctx):
+        return _sparse_remove(cursor, 'edge', _BASE_LIST + ' and child_id=%s',
+                (base_id, ctx, child_id))
+
     cursor.execute("""
 with removal as (
     update edge
@@ -1070,9 +1334,9 @@ update edge
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
+    and base_id=any(%s::bigint[])
 returning child_id
-""" % (','.join('%s' for b in base_ids),), base_ids)
+""", (list(base_ids),))
 
     return [r[0] for r in cursor.fetchall()]
 
@@ -1083,9 +1347,9 @@ update node
 set time_removed=now()
 where
     time_removed is null
-    and id in (%s)
+    and id=any(%s::bigint[])
 returning id
-""" % (','.join('%s' for n in nodes),), nodes)
+""", (list(nodes),))
 
     return [r[0] for r in cursor.fetchall()]
 
@@ -1094,6 +1358,13 @@ def insert_name(cursor, base_id, ctx, value, flags, index):
     base_tbl, base_ctx = util.ctx_base(ctx)
     base_tbl = table.NAMES[base_tbl]
 
+    if _sparse(ctx):
+        pos = _sparse_slot(cursor, 'name', _BASE_LIST, (base_id, ctx), index)
+        return _sparse_insert(cursor, 'name', (
+                ('base_id', base_id), ('ctx', ctx), ('value', value),
+                ('flags', flags), ('pos', pos)),
+            (base_tbl, base_id, base_ctx))
+
     if index is None:
         cursor.execute("""
 insert into name (base_id, ctx, value, flags, pos)
@@ -1230,6 +1501,8 @@ where
 
 
 def search_prefixes(cursor, value, ctx, limit, start):
+    # start is the (value, base_id) of the last row already seen. values
+    # needn't be unique, so paging on the value alone could skip some
     cursor.execute("""
 select base_id, flags, value
 from prefix_lookup
@@ -1237,10 +1510,10 @@ where
     time_removed is null
     and ctx=%s
     and value like %s || '%%'
-    and value > %s
-order by value
+    and (value, base_id) > (%s, %s)
+order by value, base_id
 limit %s
-""", (ctx, value, start, limit))
+""", (ctx, value, start[0], start[1], limit))
 
     return [{
             'base_id': base_id,
@@ -1251,6 +1524,8 @@ limit %s
 
 
 def search_phonetics(cursor, code, ctx, limit, start):
+    # start is the (base_id, value) of the last row already seen, as one
+    # base_id can have several names with the same code
     cursor.execute("""
 select base_id, flags, value
 from phonetic_lookup
@@ -1258,10 +1533,10 @@ where
     time_removed is null
     and ctx=%s
     and code=%s
-    and base_id > %s
-order by base_id
+    and (base_id, value) > (%s, %s)
+order by base_id, value
 limit %s
-""", (ctx, code, start, limit))
+""", (ctx, code, start[0], start[1], limit))
 
     return [{
             'base_id': base_id,
@@ -1273,6 +1548,10 @@ limit %s
 
 
 def reorder_name(cursor, base_id, ctx, value, index):
+    if _sparse(ctx):
+        return _sparse_move(cursor, 'name', _BASE_LIST, (base_id, ctx),
+                'value=%s', (value,), index)
+
     cursor.execute("""
 with oldpos as (
     select pos
@@ -1328,6 +1607,10 @@ select 1 from move
 
 
 def remove_name(cursor, base_id, ctx, value):
+    if _sparse(ctx):
+        return _sparse_remove(cursor, 'name', _BASE_LIST + ' and value=%s',
+                (base_id, ctx, value))
+
     cursor.execute("""
 with removal as (
     update name
@@ -1389,39 +1672,37 @@ update name
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
+    and base_id=any(%s::bigint[])
 returning base_id, ctx, value
-""" % (','.join('%s' for x in base_ids),), base_ids)
+""", (list(base_ids),))
 
     return cursor.fetchall()
 
 
 def remove_prefix_lookups_multi(cursor, triples):
-    flat = reduce(lambda a, b: a.extend(b) or a, triples, [])
-
     cursor.execute("""
 update prefix_lookup
 set time_removed=now()
 where
     time_removed is null
-    and (base_id, ctx, value) in (%s)
+    and (base_id, ctx, value) in (
+        select * from unnest(%s::bigint[], %s::smallint[], %s::varchar[]))
 returning base_id, ctx, value
-""" % (','.join('(%s, %s, %s)' for t in triples),), flat)
+""", _columns(triples, 3))
 
     return cursor.fetchall()
 
 
 def remove_phonetic_lookups_multi(cursor, triples):
-    flat = reduce(lambda a, b: a.extend(b) or a, triples, [])
-
     cursor.execute("""
 update phonetic_lookup
 set time_removed=now()
 where
     time_removed is null
-    and (base_id, ctx, value) in (%s)
+    and (base_id, ctx, value) in (
+        select * from unnest(%s::bigint[], %s::smallint[], %s::varchar[]))
 returning base_id, ctx, value
-""" % (','.join('(%s, %s, %s)' for t in triples)), flat)
+""", _columns(triples, 3))
 
     return cursor.fetchall()
 
@@ -1459,3 +1740,137 @@ returning flags
 """ % (table, s_clause, w_clause), s_values + w_values)
 
     return [x[0] for x in cursor.fetchall()]
+
+
+_statement('select_list_length', """
+select length
+from list_length
+where
+    anchor_id=%s
+    and ctx=%s
+    and forward=%s
+""")
+
+def select_list_length(cursor, anchor_id, ctx, forward=True):
+    _execute(cursor, 'select_list_length', (anchor_id, ctx, forward))
+
+    if not cursor.rowcount:
+        return 0
+
+    return cursor.fetchone()[0]
+
+
+def reserve_node_ids(cursor, count):
+    cursor.execute("""
+select nextval('node_ids')
+from generate_series(1, %s)
+""", (count,))
+
+    return [r[0] for r in cursor.fetchall()]
+
+
+def select_last_positions(cursor, tbl, pairs):
+    cursor.execute("""
+select base_id, ctx, max(pos)
+from %s
+where
+    time_removed is null
+    and (base_id, ctx) in (
+        select * from unnest(%%s::bigint[], %%s::smallint[]))
+group by base_id, ctx
+""" % (tbl,), _columns(pairs, 2))
+
+    return {(base_id, ctx): pos for base_id, ctx, pos in cursor.fetchall()}
+
+
+_copy_escapes = re.compile(r'[\\\t\n\r]')
+_copy_escaped = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+def _copy_field(value):
+    # a value in COPY's text format
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, util._Binary):
+        value = '\\x' + str(value.adapted).encode('hex')
+    elif isinstance(value, unicode):
+        value = value.encode('utf8')
+    return _copy_escapes.sub(lambda m: _copy_escaped[m.group()], value)
+
+def copy_rows(cursor, tbl, columns, rows):
+    data = cStringIO.StringIO()
+    for row in rows:
+        data.write('\t'.join(map(_copy_field, row)))
+        data.write('\n')
+    data.seek(0)
+
+    cursor.copy_from(data, tbl, columns=columns)
+
+
+def purge_removed(cursor, tbl, retention, limit, archive=False):
+    # rows are matched by tableoid as well as ctid, as ctids are only unique
+    # within a single partition
+    doomed = """
+delete from %s
+using (
+    select tableoid, ctid
+    from %s
+    where time_removed < now() - %%s * interval '1 second'
+    limit %%s
+) as doomed
+where %s.tableoid=doomed.tableoid and %s.ctid=doomed.ctid""" % (
+            tbl, tbl, tbl, tbl)
+
+    if archive:
+        cursor.execute("""
+with purged as (%s
+    returning %s.*
+)
+insert into %s_archive
+select * from purged
+""" % (doomed, tbl, tbl), (retention, limit))
+    else:
+        cursor.execute(doomed + "\n", (retention, limit))
+
+    return cursor.rowcount
+
+
+def select_partitions(cursor, tbl):
+    cursor.execute("""
+select c.relname
+from pg_inherits i
+join pg_class c on c.oid=i.inhrelid
+where i.inhparent=%s::regclass
+""", (tbl,))
+
+    return set(r[0] for r in cursor.fetchall())
+
+
+def create_partition(cursor, tbl, name, ctxs):
+    cursor.execute("""
+create table %s (
+  like %s including defaults including constraints
+)
+""" % (name, tbl))
+
+    # the rows move over before the new table is attached, so they don't pass
+    # through the list_length triggers
+    cursor.execute("""
+with moved as (
+    delete from %s_default
+    where ctx=any(%%s::smallint[])
+    returning *
+)
+insert into %s
+select * from moved
+""" % (tbl, name), (list(ctxs),))
+    moved = cursor.rowcount
+
+    cursor.execute("""
+alter table %s attach partition %s for values in (%s)
+""" % (tbl, name, ', '.join('%d' % ctx for ctx in ctxs)))
+
+    return moved
@@ -2,27 +2,32 @@
 
 from __future__ import absolute_import
 
+import collections
 import contextlib
 import hashlib
+import heapq
 import hmac
+import itertools
 import random
 import sys
 import time
 
 import psycopg2
-import psycopg2.extensions
 
 from . import query
 from .. import error
-from ..const import search, table, util
+from ..pool import Deadline
+from ..const import ordering, search, table, util
 
 
 class TwoPhaseCommit(object):
-    def __init__(self, pool, shard, name, uniq_data):
+    def __init__(self, pool, shard, name, uniq_data, deadline=None):
         self._pool = pool
         self._shard = shard
         self._name = name
         self._uniq_data = uniq_data
+        self._deadline = deadline or Deadline()
+        self._timer = None
         self._conn = None
         self._failed = False
 
@@ -30,10 +35,10 @@ class TwoPhaseCommit(object):
         self._pool.put(self._conn)
         self._conn = None
 
-    def _get_conn(self):
+    def _get_conn(self, timeout=None):
         if self._conn is None:
             self._conn = self._pool.get_by_shard(
-                    self._shard, replace=False)
+                    self._shard, replace=False, timeout=timeout)
 
         return self._conn
 
@@ -43,7 +48,7 @@ class TwoPhaseCommit(object):
             conn.tpc_rollback(self._xid)
 
         except Exception:
-            conn.reset()
+            query.reset(conn)
             raise
 
         finally:
@@ -55,7 +60,7 @@ class TwoPhaseCommit(object):
             conn.tpc_commit(self._xid)
 
         except Exception:
-            conn.reset()
+            query.reset(conn)
             raise
 
         finally:
@@ -66,7 +71,10 @@ class TwoPhaseCommit(object):
 
     def __enter__(self):
         intxn = False
-        conn = self._get_conn()
+        # only the first phase is held to the deadline. once prepared, the
+        # commit or rollback has to go through however long it takes
+        conn = self._get_conn(self._deadline)
+        self._timer = self._deadline.timer(self._pool, conn)
 
         xid = []
         for ud in self._uniq_data:
@@ -78,13 +86,17 @@ class TwoPhaseCommit(object):
         return conn
 
     def __exit__(self, klass=None, exc=None, tb=None):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
         try:
             if self._failed or exc is not None:
                 self._conn.tpc_rollback()
                 self._failed = True
             else:
                 self._conn.tpc_prepare()
-                self._conn.reset()
+                query.reset(self._conn)
 
         finally:
             self._conn = None
@@ -113,27 +125,6 @@ class TwoPhaseCommit(object):
                 self.commit()
 
 
-class Timer(object):
-    def __init__(self, pool, timeout, conn):
-        self.pool = pool
-        self.timeout = timeout
-        self.conn = conn
-
-    def __enter__(self):
-        self.t = self.pool._timer(self.timeout, self.ding)
-        self.t.start()
-        return self
-
-    def __exit__(self, klass=None, exc=None, tb=None):
-        if klass is psycopg2.extensions.QueryCanceledError:
-            raise error.Timeout()
-        self.t.cancel()
-
-    def ding(self):
-        if self.conn is not None:
-            self.conn.cancel()
-
-
 def set_property(conn, base_id, ctx, value, flags):
     cursor = conn.cursor()
     try:
@@ -146,56 +137,55 @@ def set_property(conn, base_id, ctx, value, flags):
         return False, bool(updated)
 
 
+def pages(pool, fetch, start, page_size):
+    # yields the pages of a list as fetch(start) returns them (each with the
+    # start of the following page), requesting the next page in the
+    # background while the caller works through the current one
+    pending = pool._spawn(fetch, start)
+    while pending is not None:
+        page, start = pending.get()
+        pending = None
+        if len(page) >= page_size:
+            pending = pool._spawn(fetch, start)
+        yield page
+
+
 def lookup_alias(pool, digest, ctx, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _lookup_alias(pool, digest, ctx, timer)
-    with timer:
-        return _lookup_alias(pool, digest, ctx, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _lookup_alias(pool, digest, ctx, deadline)
 
-def _lookup_alias(pool, digest, ctx, timer):
-    for shard in pool.shards_for_lookup_hash(digest):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
+def _lookup_alias(pool, digest, ctx, deadline):
+    shard, alias = _find_alias_lookup(pool, digest, ctx,
+            pool.shards_for_lookup_hash(digest), deadline, read=True)
+    return alias
 
-            alias = query.select_alias_lookup(conn.cursor(), digest, ctx)
-            if alias is not None:
-                return alias
+def _find_alias_lookup(pool, digest, ctx, shards, deadline, read=False):
+    # (shard, alias lookup) from whichever of the shards has it, going
+    # through them as the pool's lookup_hedge says
+    get = pool.get_read_by_shard if read else pool.get_by_shard
 
-            timer.conn = None
+    def lookup(shard, deadline):
+        with get(shard, timeout=deadline) as conn:
+            return query.select_alias_lookup(conn.cursor(), digest, ctx)
 
-    return None
+    return pool.hedged(lookup, shards, pool.lookup_hedge, deadline)
 
 
 def set_alias(pool, base_id, ctx, alias, flags, index, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _set_alias(pool, base_id, ctx, alias, flags, index, timer)
-    with timer:
-        return _set_alias(pool, base_id, ctx, alias, flags, index, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _set_alias(pool, base_id, ctx, alias, flags, index, deadline)
 
-def _set_alias(pool, base_id, ctx, alias, flags, index, timer):
+def _set_alias(pool, base_id, ctx, alias, flags, index, deadline):
     digest = hmac.new(pool.digestkey, alias.encode('utf8'),
             hashlib.sha1).digest()
     digest_b64 = digest.encode('base64').strip()
 
     # look up pre-existing aliases on any but the current insert shard
     insert_shard = pool.shard_for_alias_write(digest)
-    owner = None
-    for shard in pool.shards_for_lookup_hash(digest):
-        if shard == insert_shard:
-            continue
-
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                owner = query.select_alias_lookup(conn.cursor(), digest, ctx)
-            finally:
-                timer.conn = None
-        del conn
-
-        if owner is not None:
-            break
+    shard, owner = _find_alias_lookup(pool, digest, ctx,
+            [s for s in pool.shards_for_lookup_hash(digest)
+                if s != insert_shard],
+            deadline)
 
     if owner is not None:
         if owner['base_id'] == base_id:
@@ -204,11 +194,10 @@ def _set_alias(pool, base_id, ctx, alias, flags, index, timer):
         raise error.AliasInUse(alias, ctx)
 
     tpc = TwoPhaseCommit(pool, insert_shard, 'set_alias',
-            (base_id, ctx, digest_b64))
+            (base_id, ctx, digest_b64), deadline)
     conn = None
     try:
         with tpc as conn:
-            timer.conn = conn
             inserted, owner_id = query.maybe_insert_alias_lookup(
                     conn.cursor(), digest, ctx, base_id, flags)
 
@@ -233,16 +222,11 @@ def _set_alias(pool, base_id, ctx, alias, flags, index, timer):
     finally:
         if conn is not None:
             pool.put(conn)
-        timer.conn = None
 
     with tpc.elsewhere():
-        with pool.get_by_id(base_id) as conn:
-            timer.conn = conn
-            try:
-                result = query.insert_alias(
-                        conn.cursor(), base_id, ctx, alias, index, flags)
-            finally:
-                timer.conn = None
+        with pool.get_by_id(base_id, timeout=deadline) as conn:
+            result = query.insert_alias(
+                    conn.cursor(), base_id, ctx, alias, index, flags)
 
             if not result:
                 conn.rollback()
@@ -256,47 +240,28 @@ def _set_alias(pool, base_id, ctx, alias, flags, index, timer):
 
 
 def set_alias_flags(pool, base_id, ctx, alias, add, clear, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _set_alias_flags(pool, base_id, ctx, alias, add, clear, timer)
-    with timer:
-        return _set_alias_flags(pool, base_id, ctx, alias, add, clear, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _set_alias_flags(
+                pool, base_id, ctx, alias, add, clear, deadline)
 
-def _set_alias_flags(pool, base_id, ctx, alias, add, clear, timer):
+def _set_alias_flags(pool, base_id, ctx, alias, add, clear, deadline):
     digest = hmac.new(pool.digestkey, alias.encode('utf8'),
             hashlib.sha1).digest()
     digest_b64 = digest.encode('base64').strip()
 
-    for shard in pool.shards_for_lookup_hash(digest):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                owner = query.select_alias_lookup(conn.cursor(), digest, ctx)
-            finally:
-                timer.conn = None
-
-            if owner is None:
-                continue
+    lookup_shard, owner = _find_alias_lookup(pool, digest, ctx,
+            pool.shards_for_lookup_hash(digest), deadline)
 
-            if owner['base_id'] != base_id:
-                return None
-
-            lookup_shard = shard
-            break
-    else:
+    if owner is None or owner['base_id'] != base_id:
         return None
 
     tpc = TwoPhaseCommit(pool, lookup_shard, 'set_alias_flags',
-            (base_id, ctx, digest_b64, add, clear))
+            (base_id, ctx, digest_b64, add, clear), deadline)
     try:
         with tpc as conn:
             cursor = conn.cursor()
-            timer.conn = conn
-            try:
-                result = query.set_flags(cursor, 'alias_lookup', add, clear,
-                        {'hash': digest, 'ctx': ctx})
-            finally:
-                timer.conn = None
+            result = query.set_flags(cursor, 'alias_lookup', add, clear,
+                    {'hash': digest, 'ctx': ctx})
 
             if not result:
                 tpc.fail()
@@ -307,13 +272,9 @@ def _set_alias_flags(pool, base_id, ctx, alias, add, clear, timer):
     result_flags = result[0]
 
     with tpc.elsewhere():
-        with pool.get_by_id(base_id) as conn:
-            timer.conn = conn
-            try:
-                result = query.set_flags(conn.cursor(), 'alias', add, clear,
-                        {'base_id': base_id, 'ctx': ctx, 'value': alias})
-            finally:
-                timer.conn = None
+        with pool.get_by_id(base_id, timeout=deadline) as conn:
+            result = query.set_flags(conn.cursor(), 'alias', add, clear,
+                    {'base_id': base_id, 'ctx': ctx, 'value': alias})
 
             if not result or result[0] != result_flags:
                 conn.rollback()
@@ -324,24 +285,17 @@ def _set_alias_flags(pool, base_id, ctx, alias, add, clear, timer):
 
 
 def remove_alias(pool, base_id, ctx, alias, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _remove_alias(pool, base_id, ctx, alias, timer)
-    with timer:
-        return _remove_alias(pool, base_id, ctx, alias, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _remove_alias(pool, base_id, ctx, alias, deadline)
 
-def _remove_alias(pool, base_id, ctx, alias, timer):
+def _remove_alias(pool, base_id, ctx, alias, deadline):
     digest = hmac.new(pool.digestkey, alias.encode('utf8'),
             hashlib.sha1).digest()
     digest_b64 = digest.encode('base64').strip()
 
     for shard in pool.shards_for_lookup_hash(digest):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                owner = query.select_alias_lookup(conn.cursor(), digest, ctx)
-            finally:
-                timer.conn = None
+        with pool.get_by_shard(shard, timeout=deadline) as conn:
+            owner = query.select_alias_lookup(conn.cursor(), digest, ctx)
 
             if owner is None:
                 continue
@@ -354,17 +308,13 @@ def _remove_alias(pool, base_id, ctx, alias, timer):
     else:
         return False
 
-    tpc = TwoPhaseCommit(
-            pool, lookup_shard, 'remove_alias', (base_id, ctx, digest_b64))
+    tpc = TwoPhaseCommit(pool, lookup_shard, 'remove_alias',
+            (base_id, ctx, digest_b64), deadline)
     try:
         with tpc as conn:
             cursor = conn.cursor()
-            timer.conn = conn
-            try:
-                result = query.remove_alias_lookup(
-                        cursor, digest, ctx, base_id)
-            finally:
-                timer.conn = None
+            result = query.remove_alias_lookup(
+                    cursor, digest, ctx, base_id)
 
             if not result:
                 tpc.fail()
@@ -373,12 +323,8 @@ def _remove_alias(pool, base_id, ctx, alias, timer):
         pool.put(conn)
 
     with tpc.elsewhere():
-        with pool.get_by_id(base_id) as conn:
-            timer.conn = conn
-            try:
-                result = query.remove_alias(conn.cursor(), base_id, ctx, alias)
-            finally:
-                timer.conn = None
+        with pool.get_by_id(base_id, timeout=deadline) as conn:
+            result = query.remove_alias(conn.cursor(), base_id, ctx, alias)
 
             if not result:
                 conn.rollback()
@@ -390,26 +336,18 @@ def _remove_alias(pool, base_id, ctx, alias, timer):
 
 def create_relationship_pair(pool, base_id, rel_id, ctx, forw_idx, rev_idx,
         flags, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
+    with Deadline.coerce(timeout) as deadline:
         return _create_relationship_pair(
-                pool, base_id, rel_id, ctx, forw_idx, rev_idx, flags, timer)
-    with timer:
-        return _create_relationship_pair(
-                pool, base_id, rel_id, ctx, forw_idx, rev_idx, flags, timer)
+                pool, base_id, rel_id, ctx, forw_idx, rev_idx, flags, deadline)
 
 def _create_relationship_pair(pool, base_id, rel_id, ctx, forw_idx, rev_idx,
-        flags, timer):
+        flags, deadline):
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id),
-            'create_relationship_pair', (base_id, rel_id, ctx))
+            'create_relationship_pair', (base_id, rel_id, ctx), deadline)
     try:
         with tpc as conn:
-            timer.conn = conn
-            try:
-                inserted = query.insert_relationship(conn.cursor(), base_id,
-                        rel_id, ctx, True, forw_idx, flags)
-            finally:
-                timer.conn = None
+            inserted = query.insert_relationship(conn.cursor(), base_id,
+                    rel_id, ctx, True, forw_idx, flags)
 
             if not inserted:
                 tpc.fail()
@@ -427,13 +365,9 @@ def _create_relationship_pair(pool, base_id, rel_id, ctx, forw_idx, rev_idx,
 
     try:
         with tpc.elsewhere():
-            with pool.get_by_id(rel_id) as conn:
-                timer.conn = conn
-                try:
-                    inserted = query.insert_relationship(conn.cursor(),
-                            base_id, rel_id, ctx, False, rev_idx, flags)
-                finally:
-                    timer.conn = None
+            with pool.get_by_id(rel_id, timeout=deadline) as conn:
+                inserted = query.insert_relationship(conn.cursor(),
+                        base_id, rel_id, ctx, False, rev_idx, flags)
 
                 if not inserted:
                     tpc.fail()
@@ -450,27 +384,20 @@ def _create_relationship_pair(pool, base_id, rel_id, ctx, forw_idx, rev_idx,
 
 
 def set_relationship_flags(pool, base_id, rel_id, ctx, add, clear, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
+    with Deadline.coerce(timeout) as deadline:
         return _set_relationship_flags(
-                pool, base_id, rel_id, ctx, add, clear, timer)
-    with timer:
-        return _set_relationship_flags(
-                pool, base_id, rel_id, ctx, add, clear, timer)
+                pool, base_id, rel_id, ctx, add, clear, deadline)
 
-def _set_relationship_flags(pool, base_id, rel_id, ctx, add, clear, timer):
+def _set_relationship_flags(pool, base_id, rel_id, ctx, add, clear, deadline):
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id),
-            'set_relationship_flags', (base_id, rel_id, ctx, add, clear))
+            'set_relationship_flags', (base_id, rel_id, ctx, add, clear),
+            deadline)
     try:
         with tpc as conn:
-            timer.conn = conn
-            try:
-                result = query.set_flags(
-                        conn.cursor(), 'relationship', add, clear,
-                        {'base_id': base_id, 'rel_id': rel_id, 'ctx': ctx,
-                            'forward': True})
-            finally:
-                timer.conn = None
+            result = query.set_flags(
+                    conn.cursor(), 'relationship', add, clear,
+                    {'base_id': base_id, 'rel_id': rel_id, 'ctx': ctx,
+                        'forward': True})
 
             if not result:
                 tpc.fail()
@@ -482,15 +409,11 @@ def _set_relationship_flags(pool, base_id, rel_id, ctx, add, clear, timer):
     result_flags = result[0]
 
     with tpc.elsewhere():
-        with pool.get_by_id(rel_id) as conn:
-            timer.conn = conn
-            try:
-                result = query.set_flags(
-                        conn.cursor(), 'relationship', add, clear,
-                        {'base_id': base_id, 'rel_id': rel_id, 'ctx': ctx,
-                            'forward': False})
-            finally:
-                timer.conn = None
+        with pool.get_by_id(rel_id, timeout=deadline) as conn:
+            result = query.set_flags(
+                    conn.cursor(), 'relationship', add, clear,
+                    {'base_id': base_id, 'rel_id': rel_id, 'ctx': ctx,
+                        'forward': False})
 
             if not result or result[0] != result_flags:
                 conn.rollback()
@@ -501,23 +424,16 @@ def _set_relationship_flags(pool, base_id, rel_id, ctx, add, clear, timer):
 
 
 def remove_relationship_pair(pool, base_id, rel_id, ctx, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _remove_relationship_pair(pool, base_id, rel_id, ctx, timer)
-    with timer:
-        return _remove_relationship_pair(pool, base_id, rel_id, ctx, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _remove_relationship_pair(pool, base_id, rel_id, ctx, deadline)
 
-def _remove_relationship_pair(pool, base_id, rel_id, ctx, timer):
+def _remove_relationship_pair(pool, base_id, rel_id, ctx, deadline):
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id),
-            'remove_relationship_pair', (base_id, rel_id, ctx))
+            'remove_relationship_pair', (base_id, rel_id, ctx), deadline)
     try:
         with tpc as conn:
-            timer.conn = conn
-            try:
-                removed = query.remove_relationship(
-                        conn.cursor(), base_id, rel_id, ctx, True)
-            finally:
-                timer.conn = None
+            removed = query.remove_relationship(
+                    conn.cursor(), base_id, rel_id, ctx, True)
 
             if not removed:
                 tpc.fail()
@@ -526,13 +442,13 @@ def _remove_relationship_pair(pool, base_id, rel_id, ctx, timer):
         pool.put(conn)
 
     with tpc.elsewhere():
-        conn = pool.get_by_id(rel_id, replace=False)
-        timer.conn = conn
+        conn = pool.get_by_id(rel_id, replace=False, timeout=deadline)
         # manually managing commits/rollbacks and replacing on the pool
         # so we don't get an extra COMMIT when we just ROLLBACKed
         try:
-            removed = query.remove_relationship(
-                    conn.cursor(), base_id, rel_id, ctx, False)
+            with deadline.watch(pool, conn):
+                removed = query.remove_relationship(
+                        conn.cursor(), base_id, rel_id, ctx, False)
         except Exception:
             conn.rollback()
             tpc.fail()
@@ -581,59 +497,47 @@ def move_node(pool, node_id, ctx, base_id, new_base_id, index, timeout):
 
         return True
 
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _move_node(pool, node_id, ctx, base_id, new_base_id, timer)
-    with timer:
-        return _move_node(pool, node_id, ctx, base_id, new_base_id, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _move_node(pool, node_id, ctx, base_id, new_base_id, deadline)
 
 
-def _move_node(pool, node_id, ctx, base_id, new_base_id, timer):
+def _move_node(pool, node_id, ctx, base_id, new_base_id, deadline):
     base_ctx = util.ctx_base_ctx(ctx)
 
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id), 'move_node',
-            (node_id, ctx, base_id, new_base_id))
+            (node_id, ctx, base_id, new_base_id), deadline)
     try:
         with tpc as conn:
-            timer.conn = conn
             if not query.remove_edge(
                     conn.cursor(), base_id, ctx, node_id):
                 tpc.fail()
                 return False
     finally:
         pool.put(conn)
-        timer.conn = None
 
     with tpc.elsewhere():
-        with pool.get_by_id(new_base_id) as conn:
-            timer.conn = conn
-            try:
-                if not query.insert_edge(conn.cursor(),
-                        new_base_id, ctx, node_id, None, base_ctx):
-                    tpc.fail()
-                    return False
-            finally:
-                timer.conn = None
+        with pool.get_by_id(new_base_id, timeout=deadline) as conn:
+            if not query.insert_edge(conn.cursor(),
+                    new_base_id, ctx, node_id, None, base_ctx):
+                tpc.fail()
+                return False
 
     return True
 
 
 def create_name(pool, base_id, ctx, value, flags, index, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _create_name(pool, base_id, ctx, value, flags, index, timer)
-    with timer:
-        return _create_name(pool, base_id, ctx, value, flags, index, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _create_name(pool, base_id, ctx, value, flags, index, deadline)
 
-def _create_name(pool, base_id, ctx, value, flags, index, timer):
+def _create_name(pool, base_id, ctx, value, flags, index, deadline):
     base_ctx = util.ctx_base_ctx(ctx)
 
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id), 'create_name',
-            (base_id, ctx, value.encode('ascii', 'ignore'), flags, index))
+            (base_id, ctx, value.encode('ascii', 'ignore'), flags, index),
+            deadline)
     conn = None
     try:
         with tpc as conn:
-            timer.conn = conn
             inserted = query.insert_name(
                     conn.cursor(), base_id, ctx, value, flags, index)
 
@@ -648,54 +552,49 @@ def _create_name(pool, base_id, ctx, value, flags, index, timer):
     finally:
         if conn is not None:
             pool.put(conn)
-        timer.conn = None
 
     with tpc.elsewhere():
         if not _write_name_lookup(
-                pool, tpc, base_id, ctx, value, flags, timer):
+                pool, tpc, base_id, ctx, value, flags, deadline):
             tpc.fail()
             return False
 
     return True
 
 
-def _write_name_lookup(pool, tpc, base_id, ctx, value, flags, timer):
+def _write_name_lookup(pool, tpc, base_id, ctx, value, flags, deadline):
     sclass = util.ctx_search(ctx)
 
     if sclass == search.PREFIX:
-        return _write_prefix_lookup(pool, base_id, ctx, value, flags, timer)
+        return _write_prefix_lookup(pool, base_id, ctx, value, flags, deadline)
 
     if sclass == search.PHONETIC:
-        return _write_phonetic_lookups(pool, base_id, ctx, value, flags, timer)
+        return _write_phonetic_lookups(
+                pool, base_id, ctx, value, flags, deadline)
 
     if sclass is None:
         raise error.BadContext(ctx)
 
 
-def _write_prefix_lookup(pool, base_id, ctx, value, flags, timer):
-    with pool.get_by_shard(
-            pool.shard_for_prefix_write(value.encode('utf8'))) as conn:
-        timer.conn = conn
-        try:
-            return query.insert_prefix_lookup(
-                    conn.cursor(), value, flags, ctx, base_id)
-        finally:
-            timer.conn = None
+def _write_prefix_lookup(pool, base_id, ctx, value, flags, deadline):
+    shard = pool.shard_for_prefix_write(value.encode('utf8'))
+    with pool.get_by_shard(shard, timeout=deadline) as conn:
+        return query.insert_prefix_lookup(
+                conn.cursor(), value, flags, ctx, base_id)
 
 
-def _write_phonetic_lookups(pool, base_id, ctx, value, flags, timer):
+def _write_phonetic_lookups(pool, base_id, ctx, value, flags, deadline):
     dm, dmalt = util.dmetaphone(value)
     shard1 = pool.shard_for_phonetic_write(dm)
     tpc = TwoPhaseCommit(pool, shard1, 'phonetic_lookup_writes',
-            (base_id, ctx, value.encode('ascii', 'ignore'), flags, shard1))
+            (base_id, ctx, value.encode('ascii', 'ignore'), flags, shard1),
+            deadline)
 
     try:
         with tpc as conn:
-            timer.conn = conn
             inserted = query.insert_phonetic_lookup(
                     conn.cursor(), value, dm, flags, ctx, base_id)
     finally:
-        timer.conn = None
         pool.put(conn)
 
     if not inserted:
@@ -708,13 +607,9 @@ def _write_phonetic_lookups(pool, base_id, ctx, value, flags, timer):
 
     with tpc.elsewhere():
         shard2 = pool.shard_for_phonetic_write(dmalt)
-        with pool.get_by_shard(shard2) as conn:
-            timer.conn = conn
-            try:
-                inserted = query.insert_phonetic_lookup(
-                        conn.cursor(), value, dmalt, flags, ctx, base_id)
-            finally:
-                timer.conn = None
+        with pool.get_by_shard(shard2, timeout=deadline) as conn:
+            inserted = query.insert_phonetic_lookup(
+                    conn.cursor(), value, dmalt, flags, ctx, base_id)
 
             if not inserted:
                 conn.rollback()
@@ -724,120 +619,152 @@ def _write_phonetic_lookups(pool, base_id, ctx, value, flags, timer):
 
 
 def search_names(pool, value, ctx, limit, start, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _search_names(pool, value, ctx, limit, start, timer)
-    with timer:
-        return _search_names(pool, value, ctx, limit, start, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _search_names(pool, value, ctx, limit, start, deadline)
 
 
-def _search_names(pool, value, ctx, limit, start, timer):
+def _search_names(pool, value, ctx, limit, start, deadline):
     sclass = util.ctx_search(ctx)
 
     if sclass == search.PREFIX:
-        return _search_prefix(pool, value, ctx, limit, start, timer)
+        return _search_prefix(pool, value, ctx, limit, start, deadline)
 
     if sclass == search.PHONETIC:
-        return _search_phonetic(pool, value, ctx, limit, start, timer)
+        return _search_phonetic(pool, value, ctx, limit, start, deadline)
 
 
-def _search_prefix(pool, value, ctx, limit, start, timer):
+def _search_prefix(pool, value, ctx, limit, start, deadline):
     if start is None:
-        start = ''
+        start = ('', 0)
 
-    names = []
     shards = list(pool.shards_for_lookup_prefix(value.encode('utf8')))
-    for shard in shards:
-        with pool.get_by_shard(shard) as conn:
-            try:
-                timer.conn = conn
-                names.extend(query.search_prefixes(
-                    conn.cursor(), value, ctx, limit, start))
-            finally:
-                timer.conn = None
+    size = _merge_page_size(limit, len(shards))
+
+    def fetch(shard, after, deadline):
+        with pool.get_read_by_shard(shard, timeout=deadline) as conn:
+            return query.search_prefixes(
+                    conn.cursor(), value, ctx, size, after)
 
-    if len(shards) > 1:
-        names.sort(key=lambda name: name['value'])
-        names = names[:limit]
+    pages = pool.fan_out(fetch, collections.OrderedDict(
+            (shard, start) for shard in shards), deadline)
 
-    return names, names[-1]['value']
+    streams = [_paged(pages[shard], size, lambda last, shard=shard:
+                fetch(shard, _prefix_key(last), deadline))
+        for shard in shards]
 
+    names = list(itertools.islice(_merged(streams, _prefix_key), limit))
 
-def _sortkey(shardbits):
-    def f(d):
-        return (d['base_id'] & ((1 << (64 - shardbits)) - 1)), d['base_id']
-    return f
+    return names, (_prefix_key(names[-1]) if names else start)
 
-def _phontoken(results):
-    token = {}
-    for r in results:
-        token[r.pop('code')] = r['base_id']
-    return token
 
-def _search_phonetic(pool, value, ctx, limit, start, timer):
+def _prefix_key(name):
+    return name['value'], name['base_id']
+
+def _search_phonetic(pool, value, ctx, limit, start, deadline):
     if start is None:
         start = {}
 
     dm, dmalt = util.dmetaphone(value)
-    results = []
-    for shard in pool.shards_for_lookup_phonetic(dm):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                results.extend(query.search_phonetics(
-                        conn.cursor(), dm, ctx, limit, start.get(dm, 0)))
-            finally:
-                timer.conn = None
-
-    if dmalt is None or not util.ctx_phonetic_loose(ctx):
-        return results, _phontoken(results)
-
-    for shard in pool.shards_for_lookup_phonetic(dmalt):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                results.extend(query.search_phonetics(
-                    conn.cursor(), dmalt, ctx, limit, start.get(dmalt, 0)))
-            finally:
-                timer.conn = None
-
-    # global sort
-    results.sort(key=_sortkey(pool.shardbits))
-
-    token = _phontoken(results)
-
-    # de-duplicate by the unique criteria
-    copy = []
-    seen = set()
-    for r in results:
+    codes = [dm]
+    if dmalt is not None and util.ctx_phonetic_loose(ctx):
+        codes.append(dmalt)
+
+    keys = [(code, shard) for code in codes
+            for shard in pool.shards_for_lookup_phonetic(code)]
+    size = _merge_page_size(limit, len(keys))
+
+    def fetch(key, after, deadline):
+        code, shard = key
+        with pool.get_read_by_shard(shard, timeout=deadline) as conn:
+            return query.search_phonetics(
+                    conn.cursor(), code, ctx, size, after)
+
+    # the searches of every shard for both codes all go out at once
+    pages = pool.fan_out(fetch, collections.OrderedDict(
+            (key, start.get(key[0], (0, ''))) for key in keys), deadline)
+
+    streams = [_paged(pages[key], size, lambda last, key=key:
+                fetch(key, _phonetic_key(last), deadline))
+        for key in keys]
+
+    # the token records how far through each code's lookups we have read,
+    # including the duplicates that were skipped over. merging in the same
+    # (base_id, value) order the shards return keeps it moving forward
+    token = dict(start)
+    results, seen = [], set()
+    for r in _merged(streams, _phonetic_key):
+        token[r.pop('code')] = _phonetic_key(r)
+
+        # de-duplicate by the unique criteria
         trip = (r['base_id'], r['ctx'], r['value'])
         if trip in seen:
             continue
         seen.add(trip)
-        copy.append(r)
-    results = copy
-    return results[:limit], token
+
+        results.append(r)
+        if len(results) >= limit:
+            break
+
+    return results, token
+
+
+def _phonetic_key(name):
+    return name['base_id'], name['value']
+
+def _merge_page_size(limit, streams):
+    # how many rows to fetch at a time from each of a number of sorted
+    # streams that are to be merged. with several, asking each for the whole
+    # limit would mostly fetch rows that don't make the cut
+    if streams <= 1:
+        return limit
+    return min(limit, max(2 * limit // streams, 10))
+
+def _paged(rows, size, fetch_more):
+    # iterate a page of sorted rows, then the pages after it as they're needed
+    while rows:
+        for row in rows:
+            yield row
+        if len(rows) < size:
+            return
+        rows = fetch_more(rows[-1])
+
+def _merged(streams, key):
+    # lazily merge sorted iterables into one sorted iterator. the stream
+    # index breaks ties, so the items themselves never get compared
+    heads = []
+    for i, stream in enumerate(streams):
+        stream = iter(stream)
+        for item in stream:
+            heads.append((key(item), i, item, stream))
+            break
+    heapq.heapify(heads)
+
+    while heads:
+        k, i, item, stream = heads[0]
+        yield item
+        for item in stream:
+            heapq.heapreplace(heads, (key(item), i, item, stream))
+            break
+        else:
+            heapq.heappop(heads)
 
 
 def set_name_flags(pool, base_id, ctx, value, add, clear, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _set_name_flags(pool, base_id, ctx, value, add, clear, timer)
-    with timer:
-        return _set_name_flags(pool, base_id, ctx, value, add, clear, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _set_name_flags(pool, base_id, ctx, value, add, clear, deadline)
 
-def _set_name_flags(pool, base_id, ctx, value, add, clear, timer):
+def _set_name_flags(pool, base_id, ctx, value, add, clear, deadline):
     lookup_shard = _find_name_lookup_shard(pool, base_id, ctx,
-            value.encode('utf8'), timer)
+            value.encode('utf8'), deadline)
     if lookup_shard is None:
         return None
 
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id), 'set_name_flags',
-            (base_id, ctx, value.encode('ascii', 'ignore'), add, clear))
+            (base_id, ctx, value.encode('ascii', 'ignore'), add, clear),
+            deadline)
 
     try:
         with tpc as conn:
-            timer.conn = conn
             result = query.set_flags(conn.cursor(), 'name', add, clear,
                     {'base_id': base_id, 'ctx': ctx, 'value': value})
             if not result:
@@ -846,7 +773,6 @@ def _set_name_flags(pool, base_id, ctx, value, add, clear, timer):
 
     finally:
         pool.put(conn)
-        timer.conn = None
 
     result_flags = result[0]
 
@@ -854,11 +780,11 @@ def _set_name_flags(pool, base_id, ctx, value, add, clear, timer):
         sclass = util.ctx_search(ctx)
         if sclass == search.PREFIX:
             if not _apply_flags_to_prefix_lookup(pool, lookup_shard,
-                    add, clear, base_id, ctx, value, timer, result_flags):
+                    add, clear, base_id, ctx, value, deadline, result_flags):
                 return None
         elif sclass == search.PHONETIC:
             if not _apply_flags_to_phonetic_lookups(pool, lookup_shard,
-                    add, clear, base_id, ctx, value, timer, result_flags):
+                    add, clear, base_id, ctx, value, deadline, result_flags):
                 return None
         else:
             raise error.BadContext(ctx)
@@ -866,46 +792,38 @@ def _set_name_flags(pool, base_id, ctx, value, add, clear, timer):
     return result_flags
 
 
-def _find_name_lookup_shard(pool, base_id, ctx, value, timer):
+def _find_name_lookup_shard(pool, base_id, ctx, value, deadline):
     sclass = util.ctx_search(ctx)
 
     if sclass == search.PREFIX:
-        return _find_prefix_lookup_shard(pool, base_id, ctx, value, timer)
+        return _find_prefix_lookup_shard(pool, base_id, ctx, value, deadline)
 
     if sclass == search.PHONETIC:
-        return _find_phonetic_lookup_shards(pool, base_id, ctx, value, timer)
+        return _find_phonetic_lookup_shards(
+                pool, base_id, ctx, value, deadline)
 
     raise error.BadContext(ctx)
 
 
-def _find_prefix_lookup_shard(pool, base_id, ctx, value, timer):
+def _find_prefix_lookup_shard(pool, base_id, ctx, value, deadline):
     for shard in pool.shards_for_lookup_prefix(value):
-        with pool.get_by_shard(shard) as conn:
-            try:
-                timer.conn = conn
-                if query.select_prefix_lookups(
-                        conn.cursor(), value, ctx, base_id):
-                    return shard
-
-            finally:
-                timer.conn = None
+        with pool.get_by_shard(shard, timeout=deadline) as conn:
+            if query.select_prefix_lookups(
+                    conn.cursor(), value, ctx, base_id):
+                return shard
 
     return None
 
 
-def _find_phonetic_lookup_shards(pool, base_id, ctx, value, timer):
+def _find_phonetic_lookup_shards(pool, base_id, ctx, value, deadline):
     dm, dmalt = util.dmetaphone(value)
 
     for shard in pool.shards_for_lookup_phonetic(dm):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                if query.find_phonetic_lookup(
-                        conn.cursor(), dm, ctx, value, base_id):
-                    dmshard = shard
-                    break
-            finally:
-                timer.conn = None
+        with pool.get_by_shard(shard, timeout=deadline) as conn:
+            if query.find_phonetic_lookup(
+                    conn.cursor(), dm, ctx, value, base_id):
+                dmshard = shard
+                break
     else: 
         return None
 
@@ -913,15 +831,11 @@ def _find_phonetic_lookup_shards(pool, base_id, ctx, value, timer):
         return (dmshard, None)
 
     for shard in pool.shards_for_lookup_phonetic(dmalt):
-        with pool.get_by_shard(shard) as conn:
-            timer.conn = conn
-            try:
-                if query.find_phonetic_lookup(
-                        conn.cursor(), dmalt, ctx, value, base_id):
-                    dmashard = shard
-                    break
-            finally:
-                timer.conn = None
+        with pool.get_by_shard(shard, timeout=deadline) as conn:
+            if query.find_phonetic_lookup(
+                    conn.cursor(), dmalt, ctx, value, base_id):
+                dmashard = shard
+                break
     else:
         return None
 
@@ -929,15 +843,12 @@ def _find_phonetic_lookup_shards(pool, base_id, ctx, value, timer):
 
 
 def _apply_flags_to_prefix_lookup(
-        pool, lookup_shard, add, clear, base_id, ctx, value, timer, expected):
-    with pool.get_by_shard(lookup_shard) as conn:
-        timer.conn = conn
-        try:
-            result = query.set_flags(
-                    conn.cursor(), 'prefix_lookup', add, clear,
-                    {'base_id': base_id, 'ctx': ctx, 'value': value})
-        finally:
-            timer.conn = None
+        pool, lookup_shard, add, clear, base_id, ctx, value, deadline,
+        expected):
+    with pool.get_by_shard(lookup_shard, timeout=deadline) as conn:
+        result = query.set_flags(
+                conn.cursor(), 'prefix_lookup', add, clear,
+                {'base_id': base_id, 'ctx': ctx, 'value': value})
 
         if not result or result[0] != expected:
             conn.rollback()
@@ -947,23 +858,19 @@ def _apply_flags_to_prefix_lookup(
 
 
 def _apply_flags_to_phonetic_lookups(pool, lookup_shard,
-        add, clear, base_id, ctx, value, timer, expected):
+        add, clear, base_id, ctx, value, deadline, expected):
     dmshard, dmashard = lookup_shard
 
     if dmashard is not None:
         return _apply_flags_to_phonetic_lookups_both(pool, lookup_shard,
-                add, clear, base_id, ctx, value, timer, expected)
+                add, clear, base_id, ctx, value, deadline, expected)
 
     dm, dmalt = util.dmetaphone(value)
 
-    with pool.get_by_shard(dmshard) as conn:
-        timer.conn = conn
-        try:
-            result = query.set_flags(conn.cursor(), 'phonetic_lookup',
-                    add, clear, {'ctx': ctx, 'value': value, 'code': dm,
-                        'base_id': base_id})
-        finally:
-            timer.conn = None
+    with pool.get_by_shard(dmshard, timeout=deadline) as conn:
+        result = query.set_flags(conn.cursor(), 'phonetic_lookup',
+                add, clear, {'ctx': ctx, 'value': value, 'code': dm,
+                    'base_id': base_id})
 
         if not result or result[0] != expected:
             conn.rollback()
@@ -973,15 +880,15 @@ def _apply_flags_to_phonetic_lookups(pool, lookup_shard,
 
 
 def _apply_flags_to_phonetic_lookups_both(
-        pool, lookup_shard, add, clear, base_id, ctx, value, timer, expected):
+        pool, lookup_shard, add, clear, base_id, ctx, value, deadline,
+        expected):
     dmshard, dmashard = lookup_shard
     dm, dmalt = util.dmetaphone(value)
     tpc = TwoPhaseCommit(pool, dmshard, 'apply_flag_phonetic',
-            (base_id, ctx, add, clear))
+            (base_id, ctx, add, clear), deadline)
     conn = None
     try:
         with tpc as conn:
-            timer.conn = conn
             result = query.set_flags(conn.cursor(), 'phonetic_lookup',
                     add, clear, {'ctx': ctx, 'value': value, 'code': dm,
                         'base_id': base_id})
@@ -992,17 +899,12 @@ def _apply_flags_to_phonetic_lookups_both(
     finally:
         if conn is not None:
             pool.put(conn)
-        timer.conn = None
 
     with tpc.elsewhere():
-        with pool.get_by_shard(dmashard) as conn:
-            timer.conn = conn
-            try:
-                result = query.set_flags(conn.cursor(), 'phonetic_lookup',
-                        add, clear, {'ctx': ctx, 'value': value, 'code': dmalt,
-                            'base_id': base_id})
-            finally:
-                timer.conn = None
+        with pool.get_by_shard(dmashard, timeout=deadline) as conn:
+            result = query.set_flags(conn.cursor(), 'phonetic_lookup',
+                    add, clear, {'ctx': ctx, 'value': value, 'code': dmalt,
+                        'base_id': base_id})
 
             if not result or result[0] != expected:
                 tpc.fail()
@@ -1013,16 +915,15 @@ def _apply_flags_to_phonetic_lookups_both(
 
 
 def reorder_name(pool, base_id, ctx, value, index, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _reorder_name(pool, base_id, ctx, value, index, timer)
-    with timer:
-        return _reorder_name(pool, base_id, ctx, value, index, timer)
-
-def _reorder_name(pool, base_id, ctx, value, index, timer):
-    conn = pool.get_by_id(base_id, replace=False)
+    with Deadline.coerce(timeout) as deadline:
+        return _reorder_name(pool, base_id, ctx, value, index, deadline)
+
+def _reorder_name(pool, base_id, ctx, value, index, deadline):
+    conn = pool.get_by_id(base_id, replace=False, timeout=deadline)
     try:
-        result = query.reorder_name(conn.cursor(), base_id, ctx, value, index)
+        with deadline.watch(pool, conn):
+            result = query.reorder_name(
+                    conn.cursor(), base_id, ctx, value, index)
     except Exception:
         conn.rollback()
         raise
@@ -1038,110 +939,97 @@ def _reorder_name(pool, base_id, ctx, value, index, timer):
 
 
 def remove_name(pool, base_id, ctx, value, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _remove_name(pool, base_id, ctx, value, timer)
-    with timer:
-        return _remove_name(pool, base_id, ctx, value, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _remove_name(pool, base_id, ctx, value, deadline)
 
 
-def _remove_name(pool, base_id, ctx, value, timer):
+def _remove_name(pool, base_id, ctx, value, deadline):
     lookup_shard = _find_name_lookup_shard(pool, base_id, ctx,
-            value.encode('utf8'), timer)
+            value.encode('utf8'), deadline)
 
     tpc = TwoPhaseCommit(pool, pool.shard_by_id(base_id), 'remove_name',
-            (base_id, ctx, value.encode('ascii', 'ignore')))
+            (base_id, ctx, value.encode('ascii', 'ignore')), deadline)
 
     try:
         with tpc as conn:
-            timer.conn = conn
             if not query.remove_name(conn.cursor(), base_id, ctx, value):
                 tpc.fail()
                 return False
     finally:
         pool.put(conn)
-        timer.conn = None
 
     with tpc.elsewhere():
-        if not _remove_lookup(pool, lookup_shard, base_id, ctx, value, timer):
+        if not _remove_lookup(
+                pool, lookup_shard, base_id, ctx, value, deadline):
             tpc.fail()
             return False
 
     return True
 
 
-def _remove_lookup(pool, lookup_shard, base_id, ctx, value, timer):
+def _remove_lookup(pool, lookup_shard, base_id, ctx, value, deadline):
     sclass = util.ctx_search(ctx)
 
     if sclass == search.PREFIX:
         return _remove_prefix_lookup(
-                pool, lookup_shard, base_id, ctx, value, timer)
+                pool, lookup_shard, base_id, ctx, value, deadline)
 
     if sclass == search.PHONETIC:
         return _remove_phonetic_lookups(
-                pool, lookup_shard, base_id, ctx, value, timer)
+                pool, lookup_shard, base_id, ctx, value, deadline)
 
     raise error.BadContext(ctx)
 
 
-def _remove_prefix_lookup(pool, lookup_shard, base_id, ctx, value, timer):
-    with pool.get_by_shard(lookup_shard) as conn:
-        timer.conn = conn
-        try:
-            return query.remove_prefix_lookup(
-                    conn.cursor(), base_id, ctx, value)
-        finally:
-            timer.conn = None
+def _remove_prefix_lookup(pool, lookup_shard, base_id, ctx, value, deadline):
+    with pool.get_by_shard(lookup_shard, timeout=deadline) as conn:
+        return query.remove_prefix_lookup(
+                conn.cursor(), base_id, ctx, value)
 
 
-def _remove_phonetic_lookups(pool, lookup_shard, base_id, ctx, value, timer):
+def _remove_phonetic_lookups(
+        pool, lookup_shard, base_id, ctx, value, deadline):
     dmshard, dmashard = lookup_shard
 
     if dmashard is not None:
         return _remove_phonetic_lookups_both(
-                pool, lookup_shard, base_id, ctx, value, timer)
+                pool, lookup_shard, base_id, ctx, value, deadline)
 
     dm, dma = util.dmetaphone(value)
 
-    with pool.get_by_shard(dmshard) as conn:
-        timer.conn = conn
-        try:
-            return query.remove_phonetic_lookup(
-                    conn.cursor(), base_id, ctx, dm, value)
-        finally:
-            timer.conn = None
+    with pool.get_by_shard(dmshard, timeout=deadline) as conn:
+        return query.remove_phonetic_lookup(
+                conn.cursor(), base_id, ctx, dm, value)
 
 def _remove_phonetic_lookups_both(
-        pool, lookup_shard, base_id, ctx, value, timer):
+        pool, lookup_shard, base_id, ctx, value, deadline):
     dmshard, dmashard = lookup_shard
     dm, dma = util.dmetaphone(value)
 
     tpc = TwoPhaseCommit(pool, dmshard, 'remove_phonetic_lookups',
-            (base_id, ctx, value.encode('ascii', 'ignore')))
+            (base_id, ctx, value.encode('ascii', 'ignore')), deadline)
     conn = None
     try:
         with tpc as conn:
-            timer.conn = conn
             if not query.remove_phonetic_lookup(
                     conn.cursor(), base_id, ctx, dm, value):
                 return False
     finally:
         if conn is not None:
             pool.put(conn)
-        timer.conn = None
 
     with tpc.elsewhere():
-        conn = pool.get_by_shard(dmashard, replace=False)
-        timer.conn = conn
+        conn = pool.get_by_shard(dmashard, replace=False, timeout=deadline)
         try:
-            if not query.remove_phonetic_lookup(
-                    conn.cursor(), base_id, ctx, dma, value):
+            with deadline.watch(pool, conn):
+                removed = query.remove_phonetic_lookup(
+                        conn.cursor(), base_id, ctx, dma, value)
+            if not removed:
                 tpc.fail()
                 conn.rollback()
                 return False
             conn.commit()
         finally:
-            timer.conn = None
             pool.put(conn)
 
         return True
@@ -1163,9 +1051,19 @@ def _remove_lookups(cursor, triples):
     return removed
 
 
+def _merge_estates(estates, more):
+    for shard, (alias_lookups, name_lookups, rels, ids) in more.iteritems():
+        estate = estates.setdefault(shard, (set(), set(), [], []))
+        estate[0].update(alias_lookups)
+        estate[1].update(name_lookups)
+        estate[2].extend(rels)
+        estate[3].extend(ids)
+
 def _remove_local_estates(shard, pool, cursor, estate, node_base):
-    ids = estate[shard][3][:]
-    del estate[shard][3][:]
+    # the ids are worked through at most pool.batch_size at a time
+    size = pool.batch_size
+    ids = estate[shard][3][:size]
+    del estate[shard][3][:size]
 
     while ids:
         if not node_base:
@@ -1176,19 +1074,23 @@ def _remove_local_estates(shard, pool, cursor, estate, node_base):
 
         query.remove_properties_multiple_bases(cursor, ids)
 
-        aliases = query.remove_aliases_multiple_bases(cursor, ids)
-        for value, ctx in aliases:
+        aliases = {}
+        for value, ctx in query.remove_aliases_multiple_bases(cursor, ids):
             digest = hmac.new(pool.digestkey, value, hashlib.sha1).digest()
-            # add each alias_lookup to every shard it *might* live on
-            for s in pool.shards_for_lookup_hash(digest):
-                group = estate.setdefault(s, (set(), set(), [], []))[0]
-                group.add((digest, ctx))
-
-        names = query.remove_names_multiple_bases(cursor, ids)
-        for base_id, ctx, value in names:
-            for s in pool.shards_for_lookup_prefix(value):
-                group = estate.setdefault(s, (set(), set(), [], []))[1]
-                group.add((base_id, ctx, value))
+            aliases.setdefault(digest, []).append(ctx)
+        # add each alias_lookup to every shard it *might* live on
+        for s, digests in pool.shards_for_lookup_hashes(aliases).iteritems():
+            group = estate.setdefault(s, (set(), set(), [], []))[0]
+            for digest in digests:
+                group.update((digest, ctx) for ctx in aliases[digest])
+
+        names = {}
+        for triple in query.remove_names_multiple_bases(cursor, ids):
+            names.setdefault(triple[2], []).append(triple)
+        for s, values in pool.shards_for_lookup_prefixes(names).iteritems():
+            group = estate.setdefault(s, (set(), set(), [], []))[1]
+            for value in values:
+                group.update(names[value])
 
         removed_rels = query.remove_relationships_multiple_bases(cursor, ids)
         for base_id, ctx, forward, rel_id in removed_rels:
@@ -1208,84 +1110,99 @@ def _remove_local_estates(shard, pool, cursor, estate, node_base):
             s = pool.shard_by_id(id)
             estate.setdefault(s, (set(), set(), [], []))[3].append(id)
 
-        ids = estate[shard][3][:]
-        del estate[shard][3][:]
+        ids = estate[shard][3][:size]
+        del estate[shard][3][:size]
 
     alias_lookups, name_lookups, rels, ids = estate[shard]
 
     if alias_lookups:
-        removed = query.remove_alias_lookups_multi(cursor, list(alias_lookups))
-        for pair in removed:
-            for s in pool.shards_for_lookup_hash(pair[0]):
-                if s == shard:
-                    continue
-                estate[s][0].discard(pair)
+        removed = {}
+        for chunk in util.chunks(alias_lookups, size):
+            for digest, ctx in query.remove_alias_lookups_multi(cursor, chunk):
+                digest = str(digest)
+                removed.setdefault(digest, []).append((digest, ctx))
+        for s, digests in pool.shards_for_lookup_hashes(removed).iteritems():
+            if s == shard or s not in estate:
+                continue
+            for digest in digests:
+                estate[s][0].difference_update(removed[digest])
 
     if name_lookups:
-        removed = _remove_lookups(cursor, name_lookups)
-        for triple in removed:
-            for s in pool.shards_for_lookup_prefix(triple[2]):
-                if s == shard:
-                    continue
-                estate[s][1].discard(triple)
+        removed = {}
+        for chunk in util.chunks(name_lookups, size):
+            for triple in _remove_lookups(cursor, chunk):
+                removed.setdefault(triple[2], []).append(tuple(triple))
+        for s, values in pool.shards_for_lookup_prefixes(removed).iteritems():
+            if s == shard or s not in estate:
+                continue
+            for value in values:
+                estate[s][1].difference_update(removed[value])
 
     if rels:
-        query.remove_relationships_multi(cursor, rels)
+        for chunk in util.chunks(rels, size):
+            query.remove_relationships_multi(cursor, chunk)
 
         forw, rev = set(), set()
         for base_id, ctx, forward, rel_id in rels:
+            if util.ctx_ordering(ctx) == ordering.SPARSE:
+                # gaps left in sparse lists don't need closing up
+                continue
             if forward:
                 forw.add((base_id, ctx))
             else:
                 rev.add((rel_id, ctx))
-        if forw:
-            query.bulk_reorder_relationships(cursor, forw, True)
-        if rev:
-            query.bulk_reorder_relationships(cursor, rev, False)
+        for chunk in util.chunks(forw, size):
+            query.bulk_reorder_relationships(cursor, chunk, True)
+        for chunk in util.chunks(rev, size):
+            query.bulk_reorder_relationships(cursor, chunk, False)
 
 
     estate.pop(shard)
 
 
 def remove_node(pool, id, ctx, base_id, timeout):
-    timer = Timer(pool, timeout, None)
-    if timeout is None:
-        return _remove_node(pool, id, ctx, base_id, timer)
-    with timer:
-        return _remove_node(pool, id, ctx, base_id, timer)
+    with Deadline.coerce(timeout) as deadline:
+        return _remove_node(pool, id, ctx, base_id, deadline)
 
-def _remove_node(pool, id, ctx, base_id, timer):
+def _remove_node(pool, id, ctx, base_id, deadline):
     shard = pool.shard_by_id(base_id)
     tpc = TwoPhaseCommit(pool, shard, "remove_node_edge",
-            (id, ctx, base_id, shard))
+            (id, ctx, base_id, shard), deadline)
     tpcs = [tpc]
 
     try:
         with tpc as conn:
-            timer.conn = conn
             if not query.remove_edge(
                     conn.cursor(), base_id, ctx, id):
                 tpc.fail()
                 return False
     finally:
         pool.put(conn)
-        timer.conn = None
+
+    def remove_estate(shard, estate, deadline):
+        tpc = TwoPhaseCommit(pool, shard, 'remove_node_shard',
+                (id, ctx, base_id, shard), deadline)
+        tpcs.append(tpc)
+
+        # whatever turns up belonging on other shards is left in here
+        found = {shard: estate}
+        try:
+            with tpc as conn:
+                _remove_local_estates(shard, pool, conn.cursor(), found, False)
+        finally:
+            pool.put(conn)
+        return found
 
     estates = {pool.shard_by_id(id): (set(), set(), [], [id])}
 
     try:
+        # every shard with something to remove is worked on at once, then
+        # the same again for whatever that turned up on other shards
         while estates:
-            shard = next(iter(estates))
-            tpc = TwoPhaseCommit(pool, shard, 'remove_node_shard',
-                    (id, ctx, base_id, shard))
-            tpcs.append(tpc)
-
-            try:
-                with tpc as conn:
-                    _remove_local_estates(next(iter(estates)),
-                            pool, conn.cursor(), estates, False)
-            finally:
-                pool.put(conn)
+            found = pool.fan_out(remove_estate, estates, deadline)
+            estates = {}
+            for more in found.itervalues():
+                _merge_estates(estates, more)
     except Exception:
         klass, exc, tb = sys.exc_info()
         for tpc in tpcs:
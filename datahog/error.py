@@ -3,6 +3,9 @@
 class NoShard(Exception):
     pass
 
+class ShardDown(NoShard):
+    pass
+
 class Timeout(Exception):
     pass
 
@@ -1,10 +1,16 @@
 # vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
 
 import bisect
+import collections
 import contextlib
+import fractions
+import os
 import Queue
 import random
+import sys
+import threading
 import time
+import warnings
 
 try:
     import greenhouse
@@ -13,6 +19,48 @@ except ImportError:
 else:
     import greenhouse.ext.psycopg2 as greenpsycopg2
 
+def _clock_gettime():
+    # CLOCK_MONOTONIC through libc, for when the monotonic package is missing
+    import ctypes
+    import ctypes.util
+
+    clock_id = {'linux': 1, 'darwin': 6, 'freebsd': 4}.get(
+            sys.platform.rstrip('0123456789'))
+    libc = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+    if clock_id is None or libc is None:
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        clock_gettime = ctypes.CDLL(libc, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def monotonic():
+        ts = timespec()
+        if clock_gettime(clock_id, ctypes.byref(ts)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+try:
+    from monotonic import monotonic
+except ImportError:
+    monotonic = _clock_gettime()
+    if monotonic is None:
+        warnings.warn("no monotonic clock available, datahog deadlines will "
+                "follow the wall clock (install the 'monotonic' package)")
+        monotonic = time.time
+
 try:
     import gevent
 except ImportError:
@@ -28,6 +76,7 @@ import psycopg2.extensions
 
 from . import error
 from .const import util
+from .db import query
 
 __all__ = []
 
@@ -46,12 +95,21 @@ class ConnectionPool(object):
 
             - ``shard``: shard number
             - ``count``: number of connections to build for this shard
+              (may be left out if ``max`` is given)
             - ``host``: hostname of the db
             - ``port``: db's port
             - ``user``: username to connect with
             - ``password``: user's password
             - ``database``: database name
 
+            Optional in these dicts:
+
+            - ``min``: number of connections to open at :meth:`start` and
+              never close for idleness (default ``count``, or 1)
+            - ``max``: upper limit on the connections to this shard. when a
+              checkout would otherwise have to wait, another connection is
+              opened if this hasn't been reached yet (default ``count``)
+
         ``lookup_insertion_plans``
             Lists of lists of two-tuples of shard numbers, and their integer
             weights. This is used for the associated lookup tables of aliases
@@ -87,6 +145,77 @@ class ConnectionPool(object):
             optional, the default implementation performs exponential backoff
             with random jitter, trying for a total of around 20 seconds.
 
+        ``connection_concurrency``
+            The most connections to be in the process of opening at once
+            during :meth:`start` (including those waiting through
+            ``connection_backoff`` between retries). The first connection of
+            every shard is opened before any shard's second one. This key is
+            optional, by default all connections are opened at once.
+
+        ``prepare_statements``
+            Whether to PREPARE the hottest point queries (node and property
+            gets, alias lookups, relationship lists and property increments)
+            on each connection as it is opened, and then EXECUTE them by name
+            so postgres needn't parse and plan them every time. If preparing
+            them fails (say on a shard missing a schema migration), that
+            connection's queries are sent unprepared instead. This key is
+            optional, the default is ``False``.
+
+        ``autocommit_reads``
+            Whether to run queries which only read on connections in
+            autocommit mode, so a lookup costs just its SELECT rather than
+            BEGIN, SELECT and COMMIT. Each statement then sees its own
+            snapshot, which the reads don't rely on. This key is optional,
+            the default is ``False``.
+
+        ``batch_size``
+            The most ids (or other keys) to send to postgres in a single
+            statement. Batch fetches and the cascading deletes of
+            :func:`node.remove <datahog.api.node.remove>` split anything
+            bigger into several statements of at most this size, run one
+            after another, and it is the default chunk size of the
+            :mod:`bulk loaders <datahog.api.bulk>`. This key is optional,
+            the default is 1000.
+
+        ``lookup_hedge``
+            How alias lookups and the checks :func:`alias.set
+            <datahog.api.alias.set>` makes for an alias already in use go
+            through the shards which the ``lookup_insertion_plans`` could have
+            put an alias on. With the default of ``None`` they are queried one
+            at a time, newest plan first. A number of seconds hedges: the next
+            shard is also queried whenever none of those already asked has
+            answered in that time, and the first to find the alias wins, so
+            ``0`` queries them all at once. This key is optional.
+
+        ``connection_idle_timeout``
+            Number of seconds a connection may sit unused in the pool before
+            it is closed, as long as that doesn't take its shard below its
+            ``min``. This key is optional, by default connections are never
+            closed for idleness.
+
+        ``circuit_breaker_threshold``
+            Number of consecutive failures (connections that couldn't be
+            opened, queries canceled for running past their timeout, or
+            queries which lost their connection or found the server shutting
+            down) after which a shard is considered down. Other errors
+            particular to a query, like deadlocks, don't count, and neither
+            do checkouts which time out waiting on a busy pool.
+            While a shard is down, checkouts from it immediately raise
+            :class:`ShardDown <datahog.error.ShardDown>`, its idle connections
+            are closed, and a single connection attempt is made in the
+            background every ``circuit_breaker_reset`` seconds (default 5).
+            The first of these that succeeds brings the shard back. This key
+            is optional, by default shards are never considered down.
+
+        ``stats_callback``
+            A function to be called for every event recorded in
+            :meth:`stats`, with the arguments ``(shard, event, value)``. The
+            events are ``"checkout"`` (value is the seconds spent waiting for
+            the connection), ``"checkin"`` (value is the seconds the
+            connection was held), ``"timeout"``, ``"query_timeout"``,
+            ``"connect_failure"``, ``"shard_down"`` and ``"shard_up"`` (value
+            is ``None`` for these). This key is optional.
+
     :param bool readonly:
         Whether to disallow data-modifying methods against this connection
         pool. Can be useful for querying replication slaves to take some read
@@ -98,12 +227,26 @@ class ConnectionPool(object):
         self._dbconf = dbconf
         self._conns = {}
         self._out = {}
-        self._ready_evs = []
+        self._outlock = self._lock()
+        self._sizes = {}
+        self._connecting = {}
+        self._sizelock = self._lock()
+        self._idle = {}
+        self._shards = {}
+        self._stats = {}
+        self._statslock = self._lock()
+        self._breakers = {}
+        self._breakerlock = self._lock()
+        self._ready_evs = {}
 
         self._init_conf()
+        self._init_routes()
 
+        self.shards = sorted(s['shard'] for s in self._dbconf['shards'])
         self.shardbits = self._dbconf['shard_bits']
         self.digestkey = self._dbconf['digest_key']
+        self.batch_size = self._dbconf.get('batch_size', 1000)
+        self.lookup_hedge = self._dbconf.get('lookup_hedge')
 
         if 'connection_backoff' in self._dbconf:
             self.backoff = self._dbconf['connection_backoff']
@@ -120,91 +263,267 @@ class ConnectionPool(object):
             _prepare_plan(plan)
 
         for shard in conf['shards']:
-            for key in ('shard', 'count', 'host', 'port', 'user', 'password',
+            for key in ('shard', 'host', 'port', 'user', 'password',
                     'database'):
                 if key not in shard:
                     raise Exception("missing shard dict key %r" % key)
 
+            if 'count' not in shard and 'max' not in shard:
+                raise Exception("shard dict needs a 'count' or 'max' key")
+            shard.setdefault('max', shard.get('count'))
+            shard.setdefault('min', min(shard.get('count', 1), shard['max']))
+            if shard['min'] > shard['max']:
+                raise Exception("shard %r has 'min' greater than 'max'" %
+                        shard['shard'])
+
         if 'root_insertion_plan' not in conf:
             conf['root_insertion_plan'] = [(s['shard'], 1)
                     for s in conf['shards']]
         _prepare_plan(conf['root_insertion_plan'])
 
+    def _init_routes(self):
+        # newest plan first, that's the order lookups are tried in
+        plans = self._dbconf['lookup_insertion_plans'][::-1]
+        self._lookup_plans = plans
+
+        # prefix and phonetic routing goes by the first byte alone
+        self._prefix_routes = [_route(plans, num) for num in xrange(256)]
+
+        # and hash routing only depends on the hash modulo each plan's total
+        # weight, so if the least common multiple of those is small enough
+        # then every possible route can be worked out ahead of time
+        modulus = reduce(_lcm, (plan[-1][0] for plan in plans), 1)
+        if modulus <= _MAX_ROUTE_TABLE:
+            self._hash_modulus = modulus
+            self._hash_routes = [_route(plans, num) for num in xrange(modulus)]
+        else:
+            self._hash_modulus = None
+
     def start(self):
         '''Initiate the DB connections
 
         This method won't block, use :meth:`wait_ready` to wait until the
         connections have all been established.
         '''
+        pending = []
         for shard in self._dbconf['shards']:
+            self._shards[shard['shard']] = shard
             self._conns[shard['shard']] = self._q()
-            for i in xrange(shard['count']):
+            self._stats[shard['shard']] = _ShardStats()
+            self._breakers[shard['shard']] = _ShardBreaker()
+            self._sizes[shard['shard']] = shard['min']
+            self._connecting[shard['shard']] = shard['min']
+            evs = self._ready_evs[shard['shard']] = []
+            for i in xrange(shard['min']):
                 ev = self._ev()
-                self._ready_evs.append(ev)
-                self._start_conn(shard, ev)
+                evs.append(ev)
+                pending.append((i, shard, ev))
+
+        # round-robin through the shards, so that each gets its
+        # first connection before any gets its second
+        pending.sort(key=lambda item: item[0])
+        pending = collections.deque(item[1:] for item in pending)
+
+        concurrency = self._dbconf.get('connection_concurrency')
+        if concurrency is None:
+            concurrency = len(pending)
+        for i in xrange(min(concurrency, len(pending))):
+            self._start_connector(pending)
 
-    def wait_ready(self, timeout=None):
+        if self._dbconf.get('connection_idle_timeout'):
+            self._start_reaper(self._dbconf['connection_idle_timeout'])
+
+    def wait_ready(self, timeout=None, per_shard=False):
         '''Block until all dB connections are ready (or have exhausted retries)
 
         :param timeout:
             Maximum time to wait in seconds. the default None means no limit.
 
+        :param bool per_shard:
+            Whether to report on each shard separately (default ``False``).
+
         :returns:
-            A boolean indicating that all connections were successfully made.
+            A boolean indicating that all connections were successfully made,
+            or with ``per_shard``, a dict mapping shard numbers to such
+            booleans for each shard. A shard is ready while it has its
+            ``min`` connections open, and shards which are ready can be
+            served while others are still retrying.
         '''
         if timeout is not None:
-            now = time.time()
-            deadline = now + timeout
+            deadline = time.time() + timeout
 
-        for ev in self._ready_evs:
-            if timeout is None:
-                ev.wait()
+        ready = {}
+        for shard, evs in self._ready_evs.iteritems():
+            for ev in evs:
+                if timeout is None:
+                    ev.wait()
+                else:
+                    ev.wait(max(deadline - time.time(), 0))
+                if not ev.is_set():
+                    break
             else:
-                ev.wait(deadline - now)
-                now = time.time()
-                if now > deadline:
-                    return False
+                ready[shard] = self._open_count(shard) >= (
+                        self._shards[shard]['min'])
+                continue
 
-        return True
+            ready[shard] = False
+            if not per_shard:
+                # no point waiting on the rest
+                return False
+
+        if per_shard:
+            return ready
+        return all(ready.itervalues())
 
     def put(self, conn):
-        shard = self._out.pop(id(conn))
-        self._conns[shard].put(conn)
+        with self._outlock:
+            shard, checked_out = self._out.pop(id(conn))
+        now = time.time()
+
+        if conn.closed:
+            # lost its DB connection, so drop it and open a new one if that
+            # is needed to keep the shard at its 'min'
+            self._idle.pop(id(conn), None)
+            with self._sizelock:
+                self._sizes[shard] -= 1
+            if (not self.shard_down(shard) and
+                    self._sizes[shard] < self._shards[shard]['min']):
+                self._grow(shard)
+        else:
+            self._idle[id(conn)] = now
+            self._conns[shard].put(conn)
+
+        self._record(shard, 'checkin', now - checked_out)
+
+    def shard_down(self, shard):
+        '''whether a shard's circuit breaker has it considered down
+
+        see the ``circuit_breaker_threshold`` dbconf key.
+        '''
+        return self._breakers[shard].down_since is not None
+
+    def stats(self):
+        '''take a snapshot of the connection usage statistics of every shard
+
+        :returns:
+            a dict mapping shard numbers to dicts with these keys:
+
+            - ``checkouts``: number of connections handed out
+            - ``in_use``: number of connections currently checked out
+            - ``size``: number of connections currently open (or opening)
+            - ``idle``: number of connections waiting in the pool
+            - ``wait_time``: total seconds spent waiting for checkouts
+            - ``wait_histogram``: list of ``(upper_bound, count)`` pairs
+              bucketing checkouts by their wait time in seconds. the last
+              ``upper_bound`` is ``None``, it counts everything longer.
+            - ``held_time``: total seconds connections were held before
+              being put back
+            - ``timeouts``: checkouts which timed out waiting for a
+              connection
+            - ``query_timeouts``: queries which were canceled for running
+              past their timeout
+            - ``connect_failures``: failed attempts to open a connection
+            - ``down``: whether the shard is currently considered down
+            - ``down_count``: number of times the shard has gone down
+        '''
+        with self._statslock:
+            snapshot = dict((shard, stats.snapshot())
+                    for shard, stats in self._stats.iteritems())
+
+        for shard, stats in snapshot.iteritems():
+            stats['size'] = self._sizes[shard]
+            stats['idle'] = self._conns[shard].qsize()
+            stats['down'] = self.shard_down(shard)
+
+        return snapshot
+
+    def reap_idle(self, idle_timeout=None):
+        '''close connections which have been sitting unused in the pool
+
+        this runs periodically on its own when ``connection_idle_timeout`` is
+        configured, but can also be called directly.
+
+        :param idle_timeout:
+            seconds a connection must have been idle to be closed (default is
+            the configured ``connection_idle_timeout``)
+
+        :returns: the number of connections closed
+        '''
+        if idle_timeout is None:
+            idle_timeout = self._dbconf['connection_idle_timeout']
+        cutoff = time.time() - idle_timeout
+
+        closed = 0
+        for shard, queue in self._conns.iteritems():
+            # the rest stay queued, so checkouts meanwhile still find them
+            def expired(conn, shard=shard):
+                return (self._idle.get(id(conn), cutoff) < cutoff and
+                        self._shrink(shard))
+
+            for conn in self._q_take(queue, expired):
+                self._idle.pop(id(conn), None)
+                conn.close()
+                closed += 1
+
+        return closed
 
     def shard_by_id(self, id):
         return id >> (64 - self.shardbits)
 
     def shards_for_lookup_hash(self, digest):
         num = _int_hash(digest)
-        seen = set()
-        for plan in self._dbconf['lookup_insertion_plans'][::-1]:
-            shard = _pick_from_plan(digest, plan, num)
-            if shard in seen:
-                continue
-            seen.add(shard)
-            yield shard
+        if self._hash_modulus is None:
+            return _route(self._lookup_plans, num)
+        return self._hash_routes[num % self._hash_modulus]
 
     def shards_for_lookup_prefix(self, value):
         num = ord(value[0])
-        seen = set()
-        for plan in self._dbconf['lookup_insertion_plans'][::-1]:
-            shard = _pick_from_plan(None, plan, num)
-            if shard in seen:
-                continue
-            seen.add(shard)
-            yield shard
+        if num < 256:
+            return self._prefix_routes[num]
+        return _route(self._lookup_plans, num)
+
+    def shards_for_lookup_hashes(self, digests):
+        '''group many lookup hashes by the shards they might be stored on
+
+        :param iterable digests: the HMAC digests of the lookup strings
+
+        :returns:
+            a dict mapping shard numbers to lists of digests. each digest
+            shows up under every shard that :meth:`shards_for_lookup_hash`
+            would produce for it.
+        '''
+        groups = {}
+        for digest in digests:
+            for shard in self.shards_for_lookup_hash(digest):
+                groups.setdefault(shard, []).append(digest)
+        return groups
+
+    def shards_for_lookup_prefixes(self, values):
+        '''group many prefix lookup values by the shards they might be on
+
+        :param iterable values: the (utf8-encoded) lookup strings
+
+        :returns:
+            a dict mapping shard numbers to lists of values. each value
+            shows up under every shard that :meth:`shards_for_lookup_prefix`
+            would produce for it.
+        '''
+        groups = {}
+        for value in values:
+            for shard in self.shards_for_lookup_prefix(value):
+                groups.setdefault(shard, []).append(value)
+        return groups
 
     def shard_for_alias_write(self, digest):
-        return _pick_from_plan(digest,
-                self._dbconf['lookup_insertion_plans'][-1])
+        return self.shards_for_lookup_hash(digest)[0]
 
     def shard_for_prefix_write(self, value):
-        return _pick_from_plan(None,
-                self._dbconf['lookup_insertion_plans'][-1], ord(value[0]))
+        return self.shards_for_lookup_prefix(value)[0]
 
     # pass in the dmetaphone code, then these implementations are identical
     shard_for_phonetic_write = shard_for_prefix_write
     shards_for_lookup_phonetic = shards_for_lookup_prefix
+    shards_for_lookup_phonetics = shards_for_lookup_prefixes
 
     def shard_for_root_insert(self):
         plan = self._dbconf['root_insertion_plan']
@@ -215,34 +534,138 @@ class ConnectionPool(object):
     def get_by_shard(self, shard, replace=True, timeout=None):
         if shard not in self._conns:
             raise error.NoShard(shard)
+        if self.shard_down(shard):
+            raise error.ShardDown(shard)
 
-        if timeout is not None:
-            deadline = time.time() + timeout
+        deadline = Deadline.coerce(timeout)
+        if deadline.expired():
+            raise error.Timeout()
+
+        start = time.time()
+        if self._conns[shard].empty():
+            self._grow(shard)
 
         try:
-            conn = self._conns[shard].get(timeout)
+            conn = self._conns[shard].get(True, deadline.remaining())
         except Queue.Empty:
+            self._record(shard, 'timeout')
             raise error.Timeout()
 
-        if timeout is not None:
-            timeout = deadline - time.time()
-
-        self._out[id(conn)] = shard
+        now = time.time()
+        with self._outlock:
+            self._out[id(conn)] = shard, now
+        self._record(shard, 'checkout', now - start)
 
         if replace:
-            if timeout is not None:
-                conn = self._timeout_context(conn, timeout)
-            conn = self._replacement_context(conn)
+            if deadline.expires is not None:
+                conn = self._timeout_context(conn, deadline, shard)
+            conn = self._replacement_context(conn, shard)
 
         return conn
 
     def get_by_id(self, id, replace=True, timeout=None):
         return self.get_by_shard(self.shard_by_id(id), replace, timeout)
 
+    def get_read_by_shard(self, shard, replace=True, timeout=None):
+        # connections for queries that only read. a plain pool has only the
+        # one set of connections, but see RoutingConnPool
+        if not (replace and self._dbconf.get('autocommit_reads')):
+            return self.get_by_shard(shard, replace, timeout)
+
+        deadline = Deadline.coerce(timeout)
+        conn = self.get_by_shard(shard, False, deadline)
+        return self._autocommit_context(conn, deadline, shard)
+
+    def get_read_by_id(self, id, replace=True, timeout=None):
+        return self.get_read_by_shard(self.shard_by_id(id), replace, timeout)
+
     def get_for_root_insert(self, replace=True, timeout=None):
         return self.get_by_shard(
                 self.shard_for_root_insert(), replace, timeout)
 
+    def session(self):
+        '''start a :class:`Session` which pins one connection per shard
+
+        use it as a context manager, and pass it to api functions in place
+        of the pool.
+        '''
+        return Session(self)
+
+    def fan_out(self, func, groups, timeout=None):
+        '''run ``func`` for each of a number of groups at the same time
+
+        this is for spreading per-shard work across the shards concurrently,
+        ``groups`` is typically a dict of shard numbers to the items which
+        belong on each. ``func(key, value, deadline)`` is called for each
+        item of ``groups`` in the background (a lone group is just run
+        directly), and the results are gathered once they have all finished.
+        the calls are started in the order ``groups`` iterates in, so pass
+        an ``OrderedDict`` to control it.
+
+        :param callable func:
+            called with each key and value of ``groups``, and a
+            :class:`Deadline` which it should pass as the ``timeout`` of
+            whatever it does, so that they all share the one time limit
+
+        :param dict groups: the keys and values to call ``func`` with
+
+        :param timeout:
+            maximum time in seconds for all of the calls together, or a
+            :class:`Deadline` shared with other calls. the default of
+            ``None`` means no limit.
+
+        :returns: a dict mapping each key of ``groups`` to ``func``'s result
+
+        :raises:
+            the exception of the first of the calls to fail, but only once
+            all of them have finished
+        '''
+        return _fan_out(self, func, groups, timeout)
+
+    def hedged(self, func, keys, delay=None, timeout=None):
+        '''find the first of a series of calls to come up with a result
+
+        ``func(key, deadline)`` is called for the keys in order, in the
+        background, until one returns something other than ``None``. each
+        call after the first is started once ``delay`` seconds pass without
+        any of those already running finishing, or as soon as they have all
+        finished without a result.
+
+        :param callable func:
+            called with each key, and a :class:`Deadline` to pass on as the
+            ``timeout`` of whatever it does
+
+        :param keys: the keys to call ``func`` with, in order of preference
+
+        :param delay:
+            seconds to wait on the running calls before starting the next one
+            as well. ``0`` starts them all at once, and the default of
+            ``None`` runs them strictly one after another.
+
+        :param timeout:
+            maximum time in seconds for all of the calls together, or a
+            :class:`Deadline` shared with other calls. the default of
+            ``None`` means no limit.
+
+        :returns:
+            a two-tuple of the key and the result of the first call to return
+            one, or ``(None, None)`` if none of them did. calls still running
+            then are left to finish in the background.
+
+        :raises: the exception of a call which failed before any result
+
+        :raises Timeout:
+            if the deadline passes while calls are still running and none
+            has found a result
+        '''
+        return _hedged(self, func, keys, delay, timeout)
+
+    def _spawn(self, func, *args):
+        # run func(*args) in the background, returning a _Future of its result
+        future = _Future(self._ev())
+        self._background(lambda: future._run(func, args))
+        return future
+
     def backoff(self):
         yield 0 # single immediate retry
         jitter = 0.25
@@ -252,55 +675,771 @@ class ConnectionPool(object):
             n *= 2 + (jitter * (random.random() - 0.5))
             yield n
 
+    def _grow(self, shard):
+        with self._sizelock:
+            if self._sizes[shard] >= self._shards[shard]['max']:
+                return False
+            self._sizes[shard] += 1
+            self._connecting[shard] += 1
+
+        self._start_conn(self._shards[shard], self._ev())
+        return True
+
+    def _open_count(self, shard):
+        # a shard's size counts the slots of connections still being opened
+        with self._sizelock:
+            return self._sizes[shard] - self._connecting[shard]
+
+    def _shrink(self, shard):
+        with self._sizelock:
+            if self._sizes[shard] <= self._shards[shard]['min']:
+                return False
+            self._sizes[shard] -= 1
+        return True
+
+    def _start_reaper(self, idle_timeout):
+        @self._background
+        def f():
+            while 1:
+                self._pause(idle_timeout * 500.0)
+                self.reap_idle(idle_timeout)
+
+    def _failure(self, shard):
+        threshold = self._dbconf.get('circuit_breaker_threshold')
+        if not threshold:
+            return
+
+        with self._breakerlock:
+            breaker = self._breakers[shard]
+            breaker.failures += 1
+            if breaker.down_since is not None or breaker.failures < threshold:
+                return
+            breaker.down_since = time.time()
+
+        self._record(shard, 'shard_down')
+
+        # the idle connections are most likely dead too
+        queue = self._conns[shard]
+        for i in xrange(queue.qsize()):
+            try:
+                conn = queue.get(False)
+            except Queue.Empty:
+                break
+            self._idle.pop(id(conn), None)
+            with self._sizelock:
+                self._sizes[shard] -= 1
+            conn.close()
+
+        self._start_probe(shard)
+
+    def _success(self, shard):
+        with self._breakerlock:
+            breaker = self._breakers[shard]
+            if breaker.down_since is None:
+                breaker.failures = 0
+
+    def _start_probe(self, shard):
+        reset = self._dbconf.get('circuit_breaker_reset', 5.0)
+        info = self._shards[shard]
+
+        @self._background
+        def f():
+            conn = None
+            while conn is None:
+                self._pause(reset * 1000.0)
+                conn = self._try_conn(info)
+
+            with self._sizelock:
+                full = self._sizes[shard] >= info['max']
+                if not full:
+                    self._sizes[shard] += 1
+            if full:
+                # enough connections checked out from before it went down
+                # have come back, this one only showed the shard is up
+                conn.close()
+            else:
+                self._idle[id(conn)] = time.time()
+                self._conns[shard].put(conn)
+
+            with self._breakerlock:
+                breaker = self._breakers[shard]
+                breaker.failures = 0
+                breaker.down_since = None
+            self._record(shard, 'shard_up')
+
+            while self._sizes[shard] < info['min'] and self._grow(shard):
+                pass
+
+    def _query_timeout(self, shard, deadline):
+        self._record(shard, 'query_timeout')
+
+        # a shard that has hung never answers with an error, all there is to
+        # go on is its queries running until our timers cancel them
+        if deadline.expired():
+            self._failure(shard)
+
+    def _record(self, shard, event, value=None):
+        with self._statslock:
+            self._stats[shard].record(event, value)
+
+        callback = self._dbconf.get('stats_callback')
+        if callback is not None:
+            callback(shard, event, value)
+
+    @staticmethod
+    def _lock():
+        # green threads never switch inside the sections this guards, so the
+        # green pools can get by without a real lock
+        return _nolock
+
     @contextlib.contextmanager
-    def _replacement_context(self, conn):
+    def _replacement_context(self, conn, shard):
         c = None
         try:
             with conn as c:
                 yield c
+        except psycopg2.Error, exc:
+            if _lost_connection(c, exc):
+                self._failure(shard)
+            raise
+        else:
+            self._success(shard)
         finally:
             if c is not None:
                 self.put(c)
 
     @contextlib.contextmanager
-    def _timeout_context(self, conn, timeout):
-        t = self._timer(timeout, conn.cancel)
-        t.start()
+    def _timeout_context(self, conn, deadline, shard):
         try:
-            with conn:
+            with deadline.watch(self, conn):
+                with conn:
+                    yield conn
+        except psycopg2.extensions.QueryCanceledError:
+            query.reset(conn)
+            self._query_timeout(shard, deadline)
+            raise error.Timeout()
+
+    @contextlib.contextmanager
+    def _autocommit_context(self, conn, deadline, shard):
+        # no transaction to open or close, and nothing to roll back if a
+        # query fails or is canceled
+        conn.autocommit = True
+        try:
+            with deadline.watch(self, conn):
                 yield conn
         except psycopg2.extensions.QueryCanceledError:
-            conn.reset()
+            self._query_timeout(shard, deadline)
             raise error.Timeout()
+        except psycopg2.Error, exc:
+            if _lost_connection(conn, exc):
+                self._failure(shard)
+            raise
         else:
-            t.cancel()
+            self._success(shard)
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+            self.put(conn)
 
     def _try_conn(self, info):
         try:
-            return psycopg2.connect(
+            conn = psycopg2.connect(
                     host=info['host'],
                     port=info['port'],
                     user=info['user'],
                     password=info['password'],
                     database=info['database'])
-        except psycopg2.OperationalError:
+            if self._dbconf.get('prepare_statements'):
+                self._prepare(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._record(info['shard'], 'connect_failure')
+            self._failure(info['shard'])
             return None
 
+        self._success(info['shard'])
+        return conn
+
+    def _prepare(self, conn):
+        try:
+            query.prepare_statements(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            conn.close()
+            raise
+        except psycopg2.Error:
+            # most likely a shard without the migration some statement
+            # needs. the connection is fine, its queries just won't be
+            # EXECUTEd by name
+            conn.rollback()
+
+    def _open_conn(self, shard):
+        conn = self._try_conn(shard)
+        if conn is None:
+            for pause in self.backoff():
+                if self.shard_down(shard['shard']):
+                    # leave it to the breaker's probe
+                    break
+                self._pause(pause)
+                conn = self._try_conn(shard)
+                if conn is not None:
+                    break
+
+        with self._sizelock:
+            self._connecting[shard['shard']] -= 1
+            if conn is None:
+                # give up the slot so a later checkout can try to grow again
+                self._sizes[shard['shard']] -= 1
+
+        if conn is not None:
+            self._idle[id(conn)] = time.time()
+            self._conns[shard['shard']].put(conn)
+        return conn
+
     def _start_conn(self, shard, done):
         @self._background
         def f():
-            conn = self._try_conn(shard)
-            if conn is None:
-                for pause in self.backoff():
-                    self._pause(pause)
-                    conn = self._try_conn(shard)
-                    if conn is not None:
-                        break
-
-            if conn is not None:
-                self._conns[shard['shard']].put(conn)
+            self._open_conn(shard)
             done.set()
 
+    def _start_connector(self, pending):
+        # opens connections one after another until there are none left
+        @self._background
+        def f():
+            while pending:
+                try:
+                    shard, done = pending.popleft()
+                except IndexError:
+                    break
+                self._open_conn(shard)
+                done.set()
+
+
+__all__.append("RoutingConnPool")
+
+class RoutingConnPool(object):
+    '''sends read-only queries to replicas and everything else to a primary
+
+    the api functions which only read (``node.get``, ``prop.get_list``,
+    ``alias.lookup``, ``name.search``, the ``list`` functions and so on) will
+    check out connections from one of the replica pools that has the shard,
+    preferring those with idle connections. all other queries, and reads of
+    shards that no replica pool covers, go to the primary.
+
+    keep in mind that replicas can lag behind, so a read through this pool
+    may not yet see a write that was just made through it.
+
+    all the other attributes and methods of :class:`ConnectionPool` are
+    those of the primary pool.
+
+    :param ConnectionPool primary: the pool connected to the primary DBs
+
+    :param list replicas:
+        :class:`ConnectionPool` objects connected to replicas. these should
+        be ``readonly`` pools, and need not cover every shard.
+    '''
+    def __init__(self, primary, replicas):
+        self._primary = primary
+        self._replicas = list(replicas)
+        self._owners = {}
+
+    def __getattr__(self, name):
+        return getattr(self._primary, name)
+
+    def start(self):
+        '''initiate the connections of the primary and all replica pools'''
+        for pool in [self._primary] + self._replicas:
+            pool.start()
+
+    def wait_ready(self, timeout=None, per_shard=False):
+        '''block until all the primary and replica pools are ready
+
+        :param timeout:
+            maximum time to wait in seconds. the default None means no limit.
+
+        :param bool per_shard:
+            whether to report on each shard separately (default ``False``).
+
+        :returns:
+            a boolean indicating that all connections were successfully made,
+            or with ``per_shard``, a dict mapping shard numbers to whether
+            every pool covering that shard is ready.
+        '''
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        ready = {}
+        for pool in [self._primary] + self._replicas:
+            if timeout is not None:
+                timeout = max(deadline - time.time(), 0)
+            result = pool.wait_ready(timeout, per_shard)
+            if not per_shard:
+                if not result:
+                    return False
+                continue
+            for shard, shard_ready in result.iteritems():
+                ready[shard] = ready.get(shard, True) and shard_ready
+
+        if per_shard:
+            return ready
+        return True
+
+    def get_read_by_shard(self, shard, replace=True, timeout=None):
+        pool = self._replica_for(shard)
+        conn = pool.get_read_by_shard(shard, replace, timeout)
+        if not replace:
+            self._owners[id(conn)] = pool
+        return conn
+
+    def get_read_by_id(self, id, replace=True, timeout=None):
+        return self.get_read_by_shard(self.shard_by_id(id), replace, timeout)
+
+    def put(self, conn):
+        self._owners.pop(id(conn), self._primary).put(conn)
+
+    def session(self):
+        return Session(self)
+
+    def _replica_for(self, shard):
+        candidates = [r for r in self._replicas
+                if shard in r._conns and not r.shard_down(shard)]
+        if not candidates:
+            return self._primary
+
+        idle = [r for r in candidates if not r._conns[shard].empty()]
+        return random.choice(idle or candidates)
+
+
+class Session(object):
+    '''pins one connection per shard across a series of api calls
+
+    get one from :meth:`ConnectionPool.session` and pass it to the api
+    functions in place of the pool::
+
+        with pool.session() as session:
+            node = datahog.node.get(session, node_id, ctx)
+            datahog.prop.set(session, node_id, prop_ctx, value)
+
+    a shard's connection is checked out of the pool the first time it is
+    needed and held until the end of the block, so later calls don't go back
+    through the pool's queue.
+
+    each call that writes still commits before returning. reads leave their
+    transaction open, it is committed by the next write to the shard or at
+    the end of the block, so a run of reads costs no COMMITs. reads use the
+    same connection as writes (even with a :class:`RoutingConnPool`), so
+    they always see the session's own writes.
+
+    a session is meant for a single request handler, don't share one between
+    threads or greenlets.
+    '''
+    def __init__(self, pool):
+        self._pool = pool
+        self._pinned = {}
+        self._busy = set()
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, klass=None, exc=None, tb=None):
+        self.close(exc is None)
+
+    def close(self, commit=True):
+        '''finish up any open reads and return the connections to the pool
+
+        :param bool commit:
+            whether to commit (the default) or roll back whatever
+            transactions are still open
+        '''
+        pinned, self._pinned = self._pinned, {}
+        for conn in pinned.itervalues():
+            try:
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            except psycopg2.Error:
+                # there are only ever reads left uncommitted, and put()
+                # takes care of connections which have gone bad
+                pass
+            finally:
+                self._pool.put(conn)
+
+    def get_by_shard(self, shard, replace=True, timeout=None):
+        return self._get(shard, replace, timeout, True)
+
+    def get_by_id(self, id, replace=True, timeout=None):
+        return self.get_by_shard(self.shard_by_id(id), replace, timeout)
+
+    def get_read_by_shard(self, shard, replace=True, timeout=None):
+        return self._get(shard, replace, timeout, False)
+
+    def get_read_by_id(self, id, replace=True, timeout=None):
+        return self.get_read_by_shard(self.shard_by_id(id), replace, timeout)
+
+    def get_for_root_insert(self, replace=True, timeout=None):
+        return self.get_by_shard(
+                self.shard_for_root_insert(), replace, timeout)
+
+    def put(self, conn):
+        for shard, pinned in self._pinned.iteritems():
+            if pinned is conn:
+                self._busy.discard(shard)
+                return
+        self._pool.put(conn)
+
+    def fan_out(self, func, groups, timeout=None):
+        # with _spawn running everything inline, the groups are simply done
+        # one after another on the pinned connections
+        return _fan_out(self, func, groups, timeout)
+
+    def hedged(self, func, keys, delay=None, timeout=None):
+        # likewise, with everything run inline there's nothing to hedge
+        return _hedged(self, func, keys, None, timeout)
+
+    def _spawn(self, func, *args):
+        # the pinned connections can't be used from two places at once, so
+        # nothing goes into the background
+        future = _Future(self._pool._ev())
+        future._run(func, args)
+        return future
+
+    def _get(self, shard, replace, timeout, commit):
+        if shard in self._busy:
+            # the shard's connection is already in use (by both halves of a
+            # two-phase commit, say), so this one comes from the pool
+            if commit:
+                return self._pool.get_by_shard(shard, replace, timeout)
+            return self._pool.get_read_by_shard(shard, replace, timeout)
+
+        deadline = Deadline.coerce(timeout)
+        conn = self._pinned.get(shard)
+        if conn is None:
+            conn = self._pool.get_by_shard(shard, replace=False,
+                    timeout=deadline)
+            self._pinned[shard] = conn
+        elif deadline.expired():
+            raise error.Timeout()
+
+        self._busy.add(shard)
+        if not replace:
+            # the caller manages its own transaction, so finish any reads
+            conn.commit()
+            return conn
+
+        return self._context(shard, conn, deadline, commit)
+
+    @contextlib.contextmanager
+    def _context(self, shard, conn, deadline, commit):
+        # the same accounting as the pool's own _replacement_context, so the
+        # circuit breaker sees the session's queries too
+        try:
+            with deadline.watch(self._pool, conn):
+                yield conn
+            if commit:
+                conn.commit()
+        except psycopg2.extensions.QueryCanceledError:
+            query.reset(conn)
+            self._pool._query_timeout(shard, deadline)
+            raise error.Timeout()
+        except Exception, exc:
+            if isinstance(exc, psycopg2.Error) and _lost_connection(conn, exc):
+                self._pool._failure(shard)
+            if not conn.closed:
+                conn.rollback()
+            raise
+        else:
+            self._pool._success(shard)
+        finally:
+            self._busy.discard(shard)
+
+
+__all__.append("Deadline")
+
+class Deadline(object):
+    '''a time limit shared by all the steps of an operation
+
+    any of the api functions or pool checkouts accept one of these as their
+    ``timeout`` in place of a number of seconds. everything it is passed to
+    counts against the same budget: checkouts only wait for the time that
+    remains, and queries are canceled once it has run out.
+
+    :param timeout:
+        seconds from now until the deadline. the default ``None`` means no
+        limit.
+    '''
+    def __init__(self, timeout=None):
+        if timeout is None:
+            self.expires = None
+        else:
+            self.expires = monotonic() + timeout
+
+    @classmethod
+    def coerce(cls, timeout):
+        '''produce a Deadline from a ``timeout`` which may already be one'''
+        if isinstance(timeout, cls):
+            return timeout
+        return cls(timeout)
+
+    def remaining(self):
+        '''seconds left until the deadline, or ``None`` if there's no limit'''
+        if self.expires is None:
+            return None
+        return max(self.expires - monotonic(), 0)
+
+    def expired(self):
+        return self.expires is not None and monotonic() >= self.expires
+
+    def timer(self, pool, conn):
+        '''start a timer to cancel ``conn``'s query when the deadline passes
+
+        :returns: the running timer, or ``None`` if there is no limit
+        '''
+        if self.expires is None:
+            return None
+        timer = pool._timer(self.remaining(), conn.cancel)
+        timer.start()
+        return timer
+
+    @contextlib.contextmanager
+    def watch(self, pool, conn):
+        '''cancel any of ``conn``'s queries still running at the deadline'''
+        timer = self.timer(pool, conn)
+        try:
+            yield conn
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, klass=None, exc=None, tb=None):
+        # a query was canceled by one of our timers
+        if klass is not None and issubclass(
+                klass, psycopg2.extensions.QueryCanceledError):
+            raise error.Timeout()
+
+
+def _fan_out(pool, func, groups, timeout):
+    # ConnectionPool.fan_out, shared with Session whose _spawn runs inline
+    deadline = Deadline.coerce(timeout)
+    if len(groups) == 1:
+        [(key, value)] = groups.items()
+        return {key: func(key, value, deadline)}
+
+    futures = [(key, pool._spawn(func, key, value, deadline))
+            for key, value in groups.iteritems()]
+
+    results, exc_info = {}, None
+    for key, future in futures:
+        try:
+            results[key] = future.get()
+        except Exception:
+            if exc_info is None:
+                exc_info = sys.exc_info()
+
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return results
+
+def _hedged(pool, func, keys, delay, timeout):
+    # ConnectionPool.hedged, shared with Session which never hedges
+    deadline = Deadline.coerce(timeout)
+    keys = list(keys)
+
+    if delay is None or len(keys) == 1:
+        for key in keys:
+            result = func(key, deadline)
+            if result is not None:
+                return key, result
+        return None, None
+
+    # every future sets wake too, once it is done
+    wake = pool._ev()
+    running = []
+    while keys or running:
+        if keys:
+            key = keys.pop(0)
+            future = _Future(pool._ev(), wake)
+            pool._background(lambda future=future, key=key:
+                    future._run(func, (key, deadline)))
+            running.append((key, future))
+
+        while running:
+            wake.clear()
+            for item in running[:]:
+                key, future = item
+                if future.done():
+                    running.remove(item)
+                    result = future.get()
+                    if result is not None:
+                        return key, result
+
+            if not running or (keys and delay == 0):
+                break
+
+            if deadline.expired():
+                raise error.Timeout()
+
+            # wait for one to finish, or until it's time to hedge
+            wait = deadline.remaining()
+            if keys and (wait is None or delay < wait):
+                wait = delay
+            wake.wait(wait)
+            if keys and not any(f.done() for k, f in running):
+                break
+
+    return None, None
+
+
+class _Future(object):
+    def __init__(self, done, notify=None):
+        self._done = done
+        self._notify = notify
+        self._result = None
+        self._exc_info = None
+
+    def _run(self, func, args):
+        try:
+            self._result = func(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+            # only now, so whoever is notified finds the future done
+            if self._notify is not None:
+                self._notify.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def get(self):
+        self._done.wait()
+        if self._exc_info is not None:
+            klass, exc, tb = self._exc_info
+            raise klass, exc, tb
+        return self._result
+
+
+# upper bounds in seconds of the buckets for the checkout wait-time histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class _ShardStats(object):
+    def __init__(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.wait_time = 0.0
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.held_time = 0.0
+        self.timeouts = 0
+        self.query_timeouts = 0
+        self.connect_failures = 0
+        self.down_count = 0
+
+    def record(self, event, value):
+        if event == 'checkout':
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_time += value
+            self.wait_counts[bisect.bisect_left(WAIT_BUCKETS, value)] += 1
+        elif event == 'checkin':
+            self.in_use -= 1
+            self.held_time += value
+        elif event == 'timeout':
+            self.timeouts += 1
+        elif event == 'query_timeout':
+            self.query_timeouts += 1
+        elif event == 'connect_failure':
+            self.connect_failures += 1
+        elif event == 'shard_down':
+            self.down_count += 1
+
+    def snapshot(self):
+        return {
+            'checkouts': self.checkouts,
+            'in_use': self.in_use,
+            'wait_time': self.wait_time,
+            'wait_histogram': zip(WAIT_BUCKETS + (None,), self.wait_counts),
+            'held_time': self.held_time,
+            'timeouts': self.timeouts,
+            'query_timeouts': self.query_timeouts,
+            'connect_failures': self.connect_failures,
+            'down_count': self.down_count,
+        }
+
+
+class _ShardBreaker(object):
+    def __init__(self):
+        self.failures = 0 # consecutive
+        self.down_since = None
+
+
+class _NoLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, klass=None, exc=None, tb=None):
+        pass
+
+_nolock = _NoLock()
+
+
+__all__.append("ThreadedConnPool")
+
+def _take(items, pred):
+    # remove the items for which pred is true from a queue's underlying list
+    # (oldest first) in place, returning them
+    keep, taken = [], []
+    for item in items:
+        if pred(item):
+            taken.append(item)
+        else:
+            keep.append(item)
+    items[:] = keep
+    return taken
+
+def _threaded_timer(timeout, func):
+    timer = threading.Timer(timeout, func)
+    timer.daemon = True
+    return timer
+
+class ThreadedConnPool(ConnectionPool):
+    '''a :class:`ConnectionPool` that can be shared between OS threads
+
+    this is suitable for threaded WSGI servers and the like, where a single
+    pool per process should serve all the worker threads.
+    '''
+    @staticmethod
+    def _background(f):
+        thread = threading.Thread(target=f)
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def _q():
+        return Queue.LifoQueue()
+
+    @staticmethod
+    def _q_take(queue, pred):
+        with queue.mutex:
+            return _take(queue.queue, pred)
+
+    @staticmethod
+    def _ev():
+        return threading.Event()
+
+    @staticmethod
+    def _lock():
+        return threading.Lock()
+
+    @staticmethod
+    def _pause(ms):
+        time.sleep(ms / 1000.0)
+
+    _timer = staticmethod(_threaded_timer)
+
 
 if greenhouse:
     __all__.append("GreenhouseConnPool")
@@ -316,7 +1455,11 @@ if greenhouse:
 
         @staticmethod
         def _q():
-            return greenhouse.Queue()
+            return greenhouse.LifoQueue()
+
+        @staticmethod
+        def _q_take(queue, pred):
+            return _take(queue._data, pred)
 
         @staticmethod
         def _ev():
@@ -375,7 +1518,11 @@ if gevent:
 
         @staticmethod
         def _q():
-            return gevent.queue.Queue()
+            return gevent.queue.LifoQueue()
+
+        @staticmethod
+        def _q_take(queue, pred):
+            return _take(queue.queue, pred)
 
         @staticmethod
         def _ev():
@@ -392,12 +1539,42 @@ if gevent:
         _timer = _gevent_timer
 
 
+# SQLSTATEs of a server going away: admin_shutdown, crash_shutdown and
+# cannot_connect_now. the whole 08 class (connection exceptions) counts too
+_SHUTDOWN_CODES = frozenset(['57P01', '57P02', '57P03'])
+
+def _lost_connection(conn, exc):
+    # whether a query's failure says the shard is in trouble, rather than just
+    # the query. deadlocks, serialization failures, lock timeouts and canceled
+    # queries are OperationalErrors too, but they come with a SQLSTATE and
+    # leave the connection open
+    if conn is not None and conn.closed:
+        return True
+    if not isinstance(exc, psycopg2.OperationalError) or isinstance(exc, (
+            psycopg2.extensions.TransactionRollbackError,
+            psycopg2.extensions.QueryCanceledError)):
+        return False
+    code = exc.pgcode
+    return code is None or code.startswith('08') or code in _SHUTDOWN_CODES
+
+
 def _int_hash(digest):
-    n = 0
-    for c in digest:
-        n <<= 8
-        n |= ord(c)
-    return n
+    return int(digest.encode('hex'), 16)
+
+# the largest precomputed table of lookup hash routes
+_MAX_ROUTE_TABLE = 1 << 16
+
+def _lcm(a, b):
+    return a * b // fractions.gcd(a, b)
+
+# the distinct shards for a lookup number across plans, in the order given
+def _route(plans, num):
+    shards = []
+    for plan in plans:
+        shard = _pick_from_plan(None, plan, num)
+        if shard not in shards:
+            shards.append(shard)
+    return tuple(shards)
 
 def _pick_from_plan(digest, plan, num=None):
     if num is None:
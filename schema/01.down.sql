@@ -0,0 +1,8 @@
+drop trigger relationship_list_length on relationship;
+drop trigger edge_list_length on edge;
+drop trigger name_list_length on name;
+drop trigger alias_list_length on alias;
+drop function relationship_list_length();
+drop function base_list_length();
+drop function bump_list_length(bigint, smallint, bool, int);
+drop table list_length;
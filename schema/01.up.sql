@@ -0,0 +1,98 @@
+-- LIST LENGTHS --
+
+-- the number of live rows in each list of aliases, names, child nodes (edges)
+-- and relationships, kept up to date by triggers. anchor_id is the base_id,
+-- or for backward relationships (forward=false) the rel_id.
+
+create table list_length (
+  anchor_id bigint not null,
+  ctx smallint not null,
+  forward bool not null,
+  length int not null,
+  primary key (anchor_id, ctx, forward)
+);
+
+create function bump_list_length(bigint, smallint, bool, int)
+returns void as $$
+  insert into list_length (anchor_id, ctx, forward, length)
+  values ($1, $2, $3, $4)
+  on conflict (anchor_id, ctx, forward)
+  do update set length=list_length.length + excluded.length;
+$$ language sql;
+
+create function base_list_length() returns trigger as $$
+begin
+  if TG_OP = 'INSERT' then
+    if NEW.time_removed is null then
+      perform bump_list_length(NEW.base_id, NEW.ctx, true, 1);
+    end if;
+  elsif OLD.time_removed is null and NEW.time_removed is not null then
+    perform bump_list_length(NEW.base_id, NEW.ctx, true, -1);
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+create function relationship_list_length() returns trigger as $$
+declare
+  anchor bigint;
+begin
+  if NEW.forward then
+    anchor := NEW.base_id;
+  else
+    anchor := NEW.rel_id;
+  end if;
+
+  if TG_OP = 'INSERT' then
+    if NEW.time_removed is null then
+      perform bump_list_length(anchor, NEW.ctx, NEW.forward, 1);
+    end if;
+  elsif OLD.time_removed is null and NEW.time_removed is not null then
+    perform bump_list_length(anchor, NEW.ctx, NEW.forward, -1);
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+create trigger alias_list_length
+after insert or update of time_removed on alias
+for each row execute procedure base_list_length();
+
+create trigger name_list_length
+after insert or update of time_removed on name
+for each row execute procedure base_list_length();
+
+create trigger edge_list_length
+after insert or update of time_removed on edge
+for each row execute procedure base_list_length();
+
+create trigger relationship_list_length
+after insert or update of time_removed on relationship
+for each row execute procedure relationship_list_length();
+
+-- count up the existing lists. writes should be stopped while this runs.
+insert into list_length (anchor_id, ctx, forward, length)
+select base_id, ctx, true, count(*)
+from alias
+where time_removed is null
+group by base_id, ctx
+union all
+select base_id, ctx, true, count(*)
+from name
+where time_removed is null
+group by base_id, ctx
+union all
+select base_id, ctx, true, count(*)
+from edge
+where time_removed is null
+group by base_id, ctx
+union all
+select base_id, ctx, forward, count(*)
+from relationship
+where time_removed is null and forward=true
+group by base_id, ctx, forward
+union all
+select rel_id, ctx, forward, count(*)
+from relationship
+where time_removed is null and forward=false
+group by rel_id, ctx, forward;
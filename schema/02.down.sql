@@ -0,0 +1,18 @@
+drop table phonetic_lookup_archive;
+drop table prefix_lookup_archive;
+drop table name_archive;
+drop table edge_archive;
+drop table node_archive;
+drop table relationship_archive;
+drop table alias_lookup_archive;
+drop table alias_archive;
+drop table property_archive;
+drop index phonetic_lookup_removed_idx;
+drop index prefix_lookup_removed_idx;
+drop index name_removed_idx;
+drop index edge_removed_idx;
+drop index node_removed_idx;
+drop index relationship_removed_idx;
+drop index alias_lookup_removed_idx;
+drop index alias_removed_idx;
+drop index property_removed_idx;
@@ -0,0 +1,42 @@
+-- TOMBSTONES --
+
+-- indexes for finding old removed rows to purge, and archive tables to
+-- optionally move them to. the archive tables have the same columns
+-- but none of the constraints or indexes.
+
+create index property_removed_idx on property (time_removed)
+where time_removed is not null;
+
+create index alias_removed_idx on alias (time_removed)
+where time_removed is not null;
+
+create index alias_lookup_removed_idx on alias_lookup (time_removed)
+where time_removed is not null;
+
+create index relationship_removed_idx on relationship (time_removed)
+where time_removed is not null;
+
+create index node_removed_idx on node (time_removed)
+where time_removed is not null;
+
+create index edge_removed_idx on edge (time_removed)
+where time_removed is not null;
+
+create index name_removed_idx on name (time_removed)
+where time_removed is not null;
+
+create index prefix_lookup_removed_idx on prefix_lookup (time_removed)
+where time_removed is not null;
+
+create index phonetic_lookup_removed_idx on phonetic_lookup (time_removed)
+where time_removed is not null;
+
+create table property_archive (like property);
+create table alias_archive (like alias);
+create table alias_lookup_archive (like alias_lookup);
+create table relationship_archive (like relationship);
+create table node_archive (like node);
+create table edge_archive (like edge);
+create table name_archive (like name);
+create table prefix_lookup_archive (like prefix_lookup);
+create table phonetic_lookup_archive (like phonetic_lookup);
@@ -0,0 +1,98 @@
+create table property_flat (
+  like property including defaults including constraints
+);
+
+insert into property_flat select * from property;
+
+drop table property;
+
+alter table property_flat rename to property;
+
+create unique index property_uniq on property (
+  base_id, ctx
+) where time_removed is null;
+
+create index property_removed_idx on property (time_removed)
+where time_removed is not null;
+
+
+create table alias_flat (
+  like alias including defaults including constraints
+);
+
+insert into alias_flat select * from alias;
+
+drop table alias;
+
+alter table alias_flat rename to alias;
+
+create index alias_idx on alias (
+  base_id, ctx, pos
+) where time_removed is null;
+
+create index alias_removed_idx on alias (time_removed)
+where time_removed is not null;
+
+create trigger alias_list_length
+after insert or update of time_removed on alias
+for each row execute procedure base_list_length();
+
+
+create table relationship_flat (
+  like relationship including defaults including constraints
+);
+
+insert into relationship_flat select * from relationship;
+
+drop table relationship;
+
+alter table relationship_flat rename to relationship;
+
+create unique index relationship_uniq_forward on relationship (
+  base_id, ctx, rel_id
+) where time_removed is null and forward=true;
+
+create index relationship_forward_idx on relationship (
+  base_id, ctx, pos
+) where time_removed is null and forward=true;
+
+create unique index relationship_uniq_backward on relationship (
+  rel_id, ctx, base_id
+) where time_removed is null and forward=false;
+
+create index relationship_backward_idx on relationship (
+  rel_id, ctx, pos
+) where time_removed is null and forward=false;
+
+create index relationship_removed_idx on relationship (time_removed)
+where time_removed is not null;
+
+create trigger relationship_list_length
+after insert or update of time_removed on relationship
+for each row execute procedure relationship_list_length();
+
+
+create table name_flat (
+  like name including defaults including constraints
+);
+
+insert into name_flat select * from name;
+
+drop table name;
+
+alter table name_flat rename to name;
+
+create index name_idx on name (
+  base_id, ctx, pos
+) where time_removed is null;
+
+create unique index name_uniq on name (
+  base_id, ctx, value
+) where time_removed is null;
+
+create index name_removed_idx on name (time_removed)
+where time_removed is not null;
+
+create trigger name_list_length
+after insert or update of time_removed on name
+for each row execute procedure base_list_length();
@@ -0,0 +1,122 @@
+-- PARTITIONING --
+
+-- list-partitions the property, alias, relationship and name tables by ctx.
+-- the existing tables (with their indexes) become the default partitions,
+-- and contexts configured with a "partition" get theirs added by
+-- datahog.partition.create_partitions. the list_length triggers move up to
+-- the partitioned tables so that they cover every partition.
+
+
+-- PROPERTIES --
+
+alter table property rename to property_default;
+alter index property_uniq rename to property_default_uniq;
+alter index property_removed_idx rename to property_default_removed_idx;
+
+create table property (
+  like property_default including defaults including constraints
+) partition by list (ctx);
+
+alter table property attach partition property_default default;
+
+create unique index property_uniq on property (
+  base_id, ctx
+) where time_removed is null;
+
+create index property_removed_idx on property (time_removed)
+where time_removed is not null;
+
+
+-- ALIASES --
+
+alter table alias rename to alias_default;
+alter index alias_idx rename to alias_default_idx;
+alter index alias_removed_idx rename to alias_default_removed_idx;
+drop trigger alias_list_length on alias_default;
+
+create table alias (
+  like alias_default including defaults including constraints
+) partition by list (ctx);
+
+alter table alias attach partition alias_default default;
+
+create index alias_idx on alias (
+  base_id, ctx, pos
+) where time_removed is null;
+
+create index alias_removed_idx on alias (time_removed)
+where time_removed is not null;
+
+create trigger alias_list_length
+after insert or update of time_removed on alias
+for each row execute procedure base_list_length();
+
+
+-- RELATIONSHIPS --
+
+alter table relationship rename to relationship_default;
+alter index relationship_uniq_forward rename to relationship_default_uniq_forward;
+alter index relationship_forward_idx rename to relationship_default_forward_idx;
+alter index relationship_uniq_backward rename to relationship_default_uniq_backward;
+alter index relationship_backward_idx rename to relationship_default_backward_idx;
+alter index relationship_removed_idx rename to relationship_default_removed_idx;
+drop trigger relationship_list_length on relationship_default;
+
+create table relationship (
+  like relationship_default including defaults including constraints
+) partition by list (ctx);
+
+alter table relationship attach partition relationship_default default;
+
+create unique index relationship_uniq_forward on relationship (
+  base_id, ctx, rel_id
+) where time_removed is null and forward=true;
+
+create index relationship_forward_idx on relationship (
+  base_id, ctx, pos
+) where time_removed is null and forward=true;
+
+create unique index relationship_uniq_backward on relationship (
+  rel_id, ctx, base_id
+) where time_removed is null and forward=false;
+
+create index relationship_backward_idx on relationship (
+  rel_id, ctx, pos
+) where time_removed is null and forward=false;
+
+create index relationship_removed_idx on relationship (time_removed)
+where time_removed is not null;
+
+create trigger relationship_list_length
+after insert or update of time_removed on relationship
+for each row execute procedure relationship_list_length();
+
+
+-- NAMES --
+
+alter table name rename to name_default;
+alter index name_idx rename to name_default_idx;
+alter index name_uniq rename to name_default_uniq;
+alter index name_removed_idx rename to name_default_removed_idx;
+drop trigger name_list_length on name_default;
+
+create table name (
+  like name_default including defaults including constraints
+) partition by list (ctx);
+
+alter table name attach partition name_default default;
+
+create index name_idx on name (
+  base_id, ctx, pos
+) where time_removed is null;
+
+create unique index name_uniq on name (
+  base_id, ctx, value
+) where time_removed is null;
+
+create index name_removed_idx on name (time_removed)
+where time_removed is not null;
+
+create trigger name_list_length
+after insert or update of time_removed on name
+for each row execute procedure base_list_length();
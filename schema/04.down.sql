@@ -0,0 +1,175 @@
+-- ONLINE --
+
+create unique index if not exists property_uniq_new
+on only property (
+  base_id, ctx
+)
+where time_removed is null;
+
+-- EACH PARTITION OF property --
+create unique index concurrently if not exists {partition}_uniq_new
+on {partition} (
+  base_id, ctx
+)
+where time_removed is null;
+
+-- EACH PARTITION OF property --
+alter index property_uniq_new
+attach partition {partition}_uniq_new;
+
+drop index if exists property_uniq;
+
+alter index if exists property_uniq_new
+rename to property_uniq;
+
+-- EACH PARTITION OF property --
+alter index if exists {partition}_uniq_new
+rename to {partition}_uniq;
+
+create index if not exists alias_idx_new
+on only alias (
+  base_id, ctx, pos
+)
+where time_removed is null;
+
+-- EACH PARTITION OF alias --
+create index concurrently if not exists {partition}_idx_new
+on {partition} (
+  base_id, ctx, pos
+)
+where time_removed is null;
+
+-- EACH PARTITION OF alias --
+alter index alias_idx_new
+attach partition {partition}_idx_new;
+
+drop index if exists alias_idx;
+
+alter index if exists alias_idx_new
+rename to alias_idx;
+
+-- EACH PARTITION OF alias --
+alter index if exists {partition}_idx_new
+rename to {partition}_idx;
+
+create unique index concurrently if not exists alias_lookup_uniq_new
+on alias_lookup (
+  hash, ctx
+)
+where time_removed is null;
+
+drop index concurrently if exists alias_lookup_uniq;
+
+alter index if exists alias_lookup_uniq_new
+rename to alias_lookup_uniq;
+
+create index if not exists relationship_forward_idx_new
+on only relationship (
+  base_id, ctx, pos
+)
+where time_removed is null and forward=true;
+
+-- EACH PARTITION OF relationship --
+create index concurrently if not exists {partition}_forward_idx_new
+on {partition} (
+  base_id, ctx, pos
+)
+where time_removed is null and forward=true;
+
+-- EACH PARTITION OF relationship --
+alter index relationship_forward_idx_new
+attach partition {partition}_forward_idx_new;
+
+drop index if exists relationship_forward_idx;
+
+alter index if exists relationship_forward_idx_new
+rename to relationship_forward_idx;
+
+-- EACH PARTITION OF relationship --
+alter index if exists {partition}_forward_idx_new
+rename to {partition}_forward_idx;
+
+create index if not exists relationship_backward_idx_new
+on only relationship (
+  rel_id, ctx, pos
+)
+where time_removed is null and forward=false;
+
+-- EACH PARTITION OF relationship --
+create index concurrently if not exists {partition}_backward_idx_new
+on {partition} (
+  rel_id, ctx, pos
+)
+where time_removed is null and forward=false;
+
+-- EACH PARTITION OF relationship --
+alter index relationship_backward_idx_new
+attach partition {partition}_backward_idx_new;
+
+drop index if exists relationship_backward_idx;
+
+alter index if exists relationship_backward_idx_new
+rename to relationship_backward_idx;
+
+-- EACH PARTITION OF relationship --
+alter index if exists {partition}_backward_idx_new
+rename to {partition}_backward_idx;
+
+create index concurrently if not exists edge_idx_new
+on edge (
+  base_id, ctx, pos
+)
+where time_removed is null;
+
+drop index concurrently if exists edge_idx;
+
+alter index if exists edge_idx_new
+rename to edge_idx;
+
+create index if not exists name_idx_new
+on only name (
+  base_id, ctx, pos
+)
+where time_removed is null;
+
+-- EACH PARTITION OF name --
+create index concurrently if not exists {partition}_idx_new
+on {partition} (
+  base_id, ctx, pos
+)
+where time_removed is null;
+
+-- EACH PARTITION OF name --
+alter index name_idx_new
+attach partition {partition}_idx_new;
+
+drop index if exists name_idx;
+
+alter index if exists name_idx_new
+rename to name_idx;
+
+-- EACH PARTITION OF name --
+alter index if exists {partition}_idx_new
+rename to {partition}_idx;
+
+create index concurrently if not exists prefix_lookup_idx_new
+on prefix_lookup (
+  ctx, value
+)
+where time_removed is null;
+
+drop index concurrently if exists prefix_lookup_idx;
+
+alter index if exists prefix_lookup_idx_new
+rename to prefix_lookup_idx;
+
+create index concurrently if not exists phonetic_lookup_idx_new
+on phonetic_lookup (
+  ctx, code, base_id
+)
+where time_removed is null;
+
+drop index concurrently if exists phonetic_lookup_idx;
+
+alter index if exists phonetic_lookup_idx_new
+rename to phonetic_lookup_idx;
@@ -7,7 +7,7 @@ from setuptools import setup
 
 VERSION = (0, 0, 2, "")
 
-install_deps = ['psycopg2', 'mummy']
+install_deps = ['psycopg2', 'mummy', 'monotonic']
 test_deps = install_deps + ['greenhouse', 'fuzzy', 'nose']
 
 setup(
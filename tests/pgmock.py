@@ -9,9 +9,9 @@ import psycopg2
 
 __all__ = ["activate", "deactivate", "reset", "connect_fail", "query_fail",
         "add_fetch_result", "eventlog", "CONNECT", "CONNECT_FAIL",
-        "GET_CURSOR", "COMMIT", "ROLLBACK", "RESET", "TPC_BEGIN", "TPC_COMMIT",
-        "TPC_ROLLBACK", "TPC_PREPARE", "FETCH_ONE", "FETCH_ALL", "ROWCOUNT",
-        "EXECUTE", "EXECUTE_FAILURE"]
+        "GET_CURSOR", "COMMIT", "ROLLBACK", "RESET", "CANCEL", "CLOSE",
+        "TPC_BEGIN", "TPC_COMMIT", "TPC_ROLLBACK", "TPC_PREPARE", "FETCH_ONE",
+        "FETCH_ALL", "ROWCOUNT", "EXECUTE", "EXECUTE_FAILURE", "COPY"]
 
 
 def activate():
@@ -61,6 +61,8 @@ GET_CURSOR = pgevent("GET_CURSOR")
 COMMIT = pgevent("COMMIT")
 ROLLBACK = pgevent("ROLLBACK")
 RESET = pgevent("RESET")
+CANCEL = pgevent("CANCEL")
+CLOSE = pgevent("CLOSE")
 TPC_BEGIN = pgevent("TPC_BEGIN")
 TPC_COMMIT = pgevent("TPC_COMMIT")
 TPC_ROLLBACK = pgevent("TPC_ROLLBACK")
@@ -85,16 +87,34 @@ class EXECUTE(object):
                 self.args == other.args)
 class EXECUTE_FAILURE(EXECUTE):
     pass
+class COPY(object):
+    def __init__(self, table, columns, data):
+        self.table = table
+        self.columns = tuple(columns)
+        self.data = data
+
+    def __repr__(self):
+        return '<COPY %s%r: %r>' % (self.table, self.columns, self.data)
+
+    def __eq__(self, other):
+        return (isinstance(other, COPY) and
+                (self.table, self.columns, self.data) ==
+                (other.table, other.columns, other.data))
 
 
 class FakePGConn(object):
+    closed = 0
+    autocommit = False
+
     def cursor(self):
         _log(GET_CURSOR)
-        return FakePGCursor()
+        return FakePGCursor(self)
 
     def commit(self): _log(COMMIT)
     def rollback(self): _log(ROLLBACK)
     def reset(self): _log(RESET)
+    def cancel(self): _log(CANCEL)
+    def close(self): _log(CLOSE)
     def tpc_begin(self, xid): _log(TPC_BEGIN)
     def tpc_commit(self, xid): _log(TPC_COMMIT)
     def tpc_rollback(self, xid=None): _log(TPC_ROLLBACK)
@@ -113,17 +133,32 @@ class FakePGConn(object):
         return ''.join(map(repr, args))
 
 
+def _unwrap(x):
+    if isinstance(x, list):
+        return map(_unwrap, x)
+    if isinstance(x, type(psycopg2.Binary(''))):
+        return x.adapted
+    return x
+
+
 class FakePGCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
     def execute(self, pattern, args=()):
-        args = tuple(
-                x.adapted if isinstance(x, type(psycopg2.Binary(''))) else x
-                for x in args)
+        args = tuple(map(_unwrap, args))
         if _query_fail is not None:
             _log(EXECUTE_FAILURE(pattern, args))
             raise _query_fail()
         _log(EXECUTE(pattern, args))
         _fetch[0] += 1
 
+    def copy_from(self, file, table, sep='\t', null='\\N', size=8192,
+            columns=None):
+        if _query_fail is not None:
+            raise _query_fail()
+        _log(COPY(table, columns, file.read()))
+
     def fetchone(self):
         _log(FETCH_ONE)
         if not _fetch:
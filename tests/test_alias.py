@@ -238,6 +238,24 @@ where
             ROWCOUNT,
             COMMIT])
 
+    def test_count(self):
+        add_fetch_result([(3,)])
+
+        self.assertEqual(datahog.alias.count(self.p, 123, 2), 3)
+        self.assertEqual(eventlog[1], EXECUTE("""
+select length
+from list_length
+where
+    anchor_id=%s
+    and ctx=%s
+    and forward=%s
+""", (123, 2, True)))
+
+    def test_count_bad_context(self):
+        self.assertRaises(error.BadContext,
+                datahog.alias.count, self.p, 123, 1)
+        self.assertEqual(eventlog, [])
+
     def test_list(self):
         add_fetch_result([(0, 'val1', 0), (0, 'val2', 1), (0, 'val3', 2)])
 
@@ -268,6 +286,33 @@ limit %s
             FETCH_ALL,
             COMMIT])
 
+    def test_iter_full_last_page(self):
+        add_fetch_result([(0, 'val1', 0), (0, 'val2', 1)])
+        add_fetch_result([])
+
+        self.assertEqual(
+                [a['value'] for a in datahog.alias.iter_aliases(
+                    self.p, 123, 2, start=0, page_size=2)],
+                ['val1', 'val2'])
+
+        self.assertEqual(eventlog.count(FETCH_ALL), 2)
+        self.assertEqual(eventlog[-3], EXECUTE("""
+select flags, value, pos
+from alias
+where
+    time_removed is null
+    and base_id=%s
+    and ctx=%s
+    and pos >= %s
+order by pos asc
+limit %s
+""", (123, 2, 2, 2)))
+
+    def test_iter_error(self):
+        query_fail(psycopg2.OperationalError)
+        aliases = datahog.alias.iter_aliases(self.p, 123, 2)
+        self.assertRaises(psycopg2.OperationalError, list, aliases)
+
     def test_list_empty(self):
         add_fetch_result([])
 
@@ -320,12 +365,13 @@ with window_query as (
     from alias
     where
         time_removed is null
-        and (base_id, ctx) in ((%s, %s),(%s, %s),(%s, %s),(%s, %s))
+        and (base_id, ctx) in (
+            select * from unnest(%s::bigint[], %s::smallint[]))
 )
 select base_id, flags, ctx, value
 from window_query
 where r=1
-""", (123, 2, 124, 2, 125, 2, 126, 2)),
+""", ([123, 124, 125, 126], [2, 2, 2, 2])),
             FETCH_ALL,
             COMMIT])
 
@@ -741,5 +787,173 @@ select 1 from removal
             TPC_COMMIT])
 
 
+class SparseAliasTests(base.TestCase):
+    def setUp(self):
+        super(SparseAliasTests, self).setUp()
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(2, datahog.ALIAS, {
+            'base_ctx': 1, 'ordering': datahog.ordering.SPARSE})
+
+    def executes(self):
+        return [e for e in eventlog if isinstance(e, EXECUTE)]
+
+    def test_set_between_neighbors(self):
+        add_fetch_result([])
+        add_fetch_result([(1024,), (2048,)])
+        add_fetch_result([(1,)])
+
+        self.assertTrue(datahog.alias.set(self.p, 123, 2, 'value', index=1))
+
+        self.assertEqual(self.executes()[-2:], [
+            EXECUTE("""
+select pos
+from alias
+where
+    time_removed is null
+    and base_id=%s and ctx=%s
+order by pos asc
+offset %s
+limit 2
+""", (123, 2, 0)),
+            EXECUTE("""
+insert into alias (base_id, ctx, value, pos, flags)
+select %s, %s, %s, %s, %s
+where exists (
+    select 1 from node
+    where
+        time_removed is null
+        and id=%s
+        and ctx=%s
+)
+returning 1
+""", (123, 2, 'value', 1536, 0, 123, 1))])
+
+    def test_set_at_end(self):
+        add_fetch_result([])
+        add_fetch_result([(3072,)])
+        add_fetch_result([(1,)])
+
+        self.assertTrue(datahog.alias.set(self.p, 123, 2, 'value'))
+
+        self.assertEqual(self.executes()[-1].args,
+                (123, 2, 'value', 3072 + 1024, 0, 123, 1))
+
+    def test_shift_spreads_full_list(self):
+        add_fetch_result([(5,), (6,)])
+        add_fetch_result([(2,)])
+        add_fetch_result([])
+        add_fetch_result([(1024,), (2048,)])
+        add_fetch_result([()])
+
+        self.assertTrue(datahog.alias.shift(self.p, 123, 2, 'value', 1))
+
+        list_query = """
+select pos
+from alias
+where
+    time_removed is null
+    and base_id=%s and ctx=%s and not (value=%s)
+order by pos asc
+offset %s
+limit 2
+"""
+        self.assertEqual(self.executes(), [
+            EXECUTE(list_query, (123, 2, 'value', 0)),
+            EXECUTE("""
+select count(*)
+from alias
+where
+    time_removed is null
+    and base_id=%s and ctx=%s
+""", (123, 2)),
+            EXECUTE("""
+update alias
+set pos=spread.n * 1024
+from (
+    select tableoid, ctid, row_number() over (order by pos) as n
+    from alias
+    where
+        time_removed is null
+        and base_id=%s and ctx=%s
+) as spread
+where alias.tableoid=spread.tableoid and alias.ctid=spread.ctid
+""", (123, 2)),
+            EXECUTE(list_query, (123, 2, 'value', 0)),
+            EXECUTE("""
+update alias
+set pos=%s
+where
+    time_removed is null
+    and base_id=%s and ctx=%s
+    and value=%s
+""", (1536, 123, 2, 'value'))])
+
+    def spread_with(self, count):
+        add_fetch_result([(5,), (6,)])
+        add_fetch_result([(count,)])
+        add_fetch_result([])
+        add_fetch_result([(1024,), (2048,)])
+        add_fetch_result([()])
+
+        self.assertTrue(datahog.alias.shift(self.p, 123, 2, 'value', 1))
+        spread = self.executes()[2]
+        reset()
+        return spread
+
+    def spread_by(self, gap):
+        return EXECUTE("""
+update alias
+set pos=spread.n * %d
+from (
+    select tableoid, ctid, row_number() over (order by pos) as n
+    from alias
+    where
+        time_removed is null
+        and base_id=%%s and ctx=%%s
+) as spread
+where alias.tableoid=spread.tableoid and alias.ctid=spread.ctid
+""" % gap, (123, 2))
+
+    def test_spread_fits_max_pos(self):
+        # the longest list that still fits a whole gap apart with room for
+        # an append, and one item more
+        self.assertEqual(self.spread_with(2097150), self.spread_by(1024))
+        self.assertEqual(self.spread_with(2097151), self.spread_by(1023))
+
+    def test_spread_falls_back_to_dense(self):
+        self.assertEqual(self.spread_with(1073741822), self.spread_by(2))
+        self.assertEqual(self.spread_with(1073741823), self.spread_by(1))
+
+    def test_set_near_max_pos(self):
+        add_fetch_result([])
+        add_fetch_result([((1 << 31) - 11,)])
+        add_fetch_result([(1,)])
+
+        self.assertTrue(datahog.alias.set(self.p, 123, 2, 'value'))
+
+        # half the room left below the int4 limit rather than a whole gap
+        self.assertEqual(self.executes()[-1].args,
+                (123, 2, 'value', (1 << 31) - 6, 0, 123, 1))
+
+    def test_remove_leaves_gap(self):
+        add_fetch_result([(123, 0)])
+        add_fetch_result([()])
+        add_fetch_result([()])
+
+        self.assertTrue(datahog.alias.remove(self.p, 123, 2, 'value'))
+
+        self.assertEqual(self.executes()[-1], EXECUTE("""
+update alias
+set time_removed=now()
+where
+    time_removed is null
+    and base_id=%s and ctx=%s and value=%s
+""", (123, 2, 'value')))
+
+    def test_bad_ordering(self):
+        self.assertRaises(ValueError, datahog.set_context, 3, datahog.ALIAS,
+                {'base_ctx': 1, 'ordering': 7})
+
+
 if __name__ == '__main__':
     unittest.main()
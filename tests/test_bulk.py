@@ -0,0 +1,162 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+import hashlib
+import hmac
+import os
+import sys
+import unittest
+
+import datahog
+from datahog import error
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import base
+from pgmock import *
+
+
+class BulkTests(base.TestCase):
+    def setUp(self):
+        super(BulkTests, self).setUp()
+        datahog.set_context(1, datahog.NODE, {
+            'storage': datahog.storage.INT})
+        datahog.set_context(2, datahog.NODE, {
+            'base_ctx': 1, 'storage': datahog.storage.STR})
+        datahog.set_context(3, datahog.PROPERTY, {
+            'base_ctx': 1, 'storage': datahog.storage.INT})
+        datahog.set_context(4, datahog.ALIAS, {'base_ctx': 1})
+        datahog.set_context(5, datahog.NAME, {
+            'base_ctx': 1, 'search': datahog.search.PREFIX})
+        datahog.set_flag(1, 2)
+
+    def test_load_nodes(self):
+        add_fetch_result([(1001,), (1002,), (1003,)])
+        add_fetch_result([(123, 2, 4)])
+
+        self.assertEqual(datahog.bulk.load_nodes(self.p, [
+                (1, 7, None, None),
+                (2, 'a\tb', 123, [1]),
+                (2, 'c', 123, None)]),
+            [1001, 1002, 1003])
+
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE("""
+select nextval('node_ids')
+from generate_series(1, %s)
+""", (3,)),
+            FETCH_ALL,
+            COPY('node', ('id', 'ctx', 'flags', 'num', 'value'),
+                '1001\t1\t0\t7\t\\N\n'
+                '1002\t2\t1\t\\N\t\\\\x610962\n'
+                '1003\t2\t0\t\\N\t\\\\x63\n'),
+            EXECUTE("""
+select base_id, ctx, max(pos)
+from edge
+where
+    time_removed is null
+    and (base_id, ctx) in (
+        select * from unnest(%s::bigint[], %s::smallint[]))
+group by base_id, ctx
+""", ([123], [2])),
+            FETCH_ALL,
+            COPY('edge', ('base_id', 'ctx', 'child_id', 'pos'),
+                '123\t2\t1002\t5\n123\t2\t1003\t6\n'),
+            COMMIT])
+
+    def test_load_nodes_is_eager(self):
+        add_fetch_result([(1001,)])
+        datahog.bulk.load_nodes(self.p, [(1, 7, None, None)])
+        self.assertEqual(eventlog[-1], COMMIT)
+
+    def test_load_nodes_readonly(self):
+        self.p.readonly = True
+        self.assertRaises(error.ReadOnly,
+                datahog.bulk.load_nodes, self.p, [(1, 7, None, None)])
+        self.p.readonly = False
+
+    def test_load_nodes_missing_parent(self):
+        self.assertRaises(error.MissingParent, datahog.bulk.load_nodes,
+                self.p, [(2, 'x', None, None)])
+        self.assertEqual(eventlog, [])
+
+    def test_load_nodes_no_storage(self):
+        # set_context defaults storage to NULL, so only a hand-made entry
+        # can be missing it
+        datahog.context.META[6] = (datahog.NODE, {'storage': None})
+        self.assertRaises(error.BadContext, datahog.bulk.load_nodes,
+                self.p, [(6, None, None, None)])
+        self.assertEqual(eventlog, [])
+
+    def test_load_properties_in_chunks(self):
+        self.assertEqual(datahog.bulk.load_properties(self.p, [
+                (123, 3, 5, None),
+                (124, 3, 6, None),
+                (125, 3, 7, None)], chunk_size=2), 3)
+
+        columns = ('base_id', 'ctx', 'flags', 'num', 'value')
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            COPY('property', columns,
+                '123\t3\t0\t5\t\\N\n124\t3\t0\t6\t\\N\n'),
+            COMMIT,
+            GET_CURSOR,
+            COPY('property', columns, '125\t3\t0\t7\t\\N\n'),
+            COMMIT])
+
+    def test_load_properties_bad_context(self):
+        self.assertRaises(error.BadContext,
+                datahog.bulk.load_properties, self.p, [(123, 2, 5, None)])
+
+    def test_load_properties_no_storage(self):
+        datahog.context.META[6] = (datahog.PROPERTY,
+                {'base_ctx': 1, 'storage': None})
+        self.assertRaises(error.BadContext,
+                datahog.bulk.load_properties, self.p, [(123, 6, 5, None)])
+        self.assertEqual(eventlog, [])
+
+    def test_load_aliases(self):
+        add_fetch_result([])
+
+        self.assertEqual(datahog.bulk.load_aliases(self.p, [
+                (123, 4, u'first', None),
+                (123, 4, u'sec\tond', None)]), 2)
+
+        digests = [hmac.new('digest key', v, hashlib.sha1).digest()
+                for v in ('first', 'sec\tond')]
+        self.assertEqual(eventlog[:3], [
+            GET_CURSOR,
+            COPY('alias_lookup', ('hash', 'ctx', 'base_id', 'flags'),
+                ''.join('\\\\x%s\t4\t123\t0\n' % d.encode('hex')
+                    for d in digests)),
+            COMMIT])
+        self.assertEqual(eventlog[-2:], [
+            COPY('alias', ('base_id', 'ctx', 'value', 'flags', 'pos'),
+                '123\t4\tfirst\t0\t1\n123\t4\tsec\\tond\t0\t2\n'),
+            COMMIT])
+
+    def test_load_names(self):
+        add_fetch_result([(123, 5, 2)])
+
+        self.assertEqual(datahog.bulk.load_names(self.p, [
+                (123, 5, u'caf\xe9', None)]), 1)
+
+        self.assertEqual(eventlog[-5:], [
+            COPY('name', ('base_id', 'ctx', 'value', 'flags', 'pos'),
+                '123\t5\tcaf\xc3\xa9\t0\t3\n'),
+            COMMIT,
+            GET_CURSOR,
+            COPY('prefix_lookup', ('value', 'flags', 'ctx', 'base_id'),
+                'caf\xc3\xa9\t0\t5\t123\n'),
+            COMMIT])
+
+    def test_copy_failure_rolls_back(self):
+        query_fail(psycopg2.IntegrityError)
+        self.assertRaises(psycopg2.IntegrityError,
+                datahog.bulk.load_properties, self.p, [(123, 3, 5, None)])
+        self.assertEqual(eventlog, [GET_CURSOR, ROLLBACK])
+
+
+if __name__ == '__main__':
+    unittest.main()
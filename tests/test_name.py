@@ -215,7 +215,7 @@ where exists (
                         'flags': set([])},
                     {'base_id': 124, 'ctx': 3, 'value': 'value2',
                         'flags': set([])},
-                ], 'value2'))
+                ], ('value2', 124)))
 
         self.assertEqual(eventlog, [
             GET_CURSOR,
@@ -226,10 +226,10 @@ where
     time_removed is null
     and ctx=%s
     and value like %s || '%%'
-    and value > %s
-order by value
+    and (value, base_id) > (%s, %s)
+order by value, base_id
 limit %s
-""", (3, 'value', '', 100)),
+""", (3, 'value', '', 0, 100)),
             FETCH_ALL,
             COMMIT])
 
@@ -250,7 +250,7 @@ limit %s
                         'flags': set([])},
                     {'base_id': 125, 'ctx': 2, 'value': 'phancy',
                         'flags': set([])},
-                ], {dm: 125}))
+                ], {dm: (125, 'phancy')}))
 
         self.assertEqual(eventlog, [
             GET_CURSOR,
@@ -261,10 +261,10 @@ where
     time_removed is null
     and ctx=%s
     and code=%s
-    and base_id > %s
-order by base_id
+    and (base_id, value) > (%s, %s)
+order by base_id, value
 limit %s
-""", (2, dm, 0, 100)),
+""", (2, dm, 0, '', 100)),
             FETCH_ALL,
             COMMIT])
 
@@ -277,7 +277,7 @@ limit %s
         dm, dmalt = _dm('fancy')
 
         self.assertEqual(
-                datahog.name.search(self.p, 'fancy', 2, start={dm: 125}),
+                datahog.name.search(self.p, 'fancy', 2, start={dm: (125, 'phancy')}),
                 ([
                     {'base_id': 126, 'ctx': 2, 'value': 'fancy',
                         'flags': set([])},
@@ -285,7 +285,7 @@ limit %s
                         'flags': set([])},
                     {'base_id': 128, 'ctx': 2, 'value': 'phancy',
                         'flags': set([])},
-                ], {dm: 128}))
+                ], {dm: (128, 'phancy')}))
 
         self.assertEqual(eventlog, [
             GET_CURSOR,
@@ -296,10 +296,10 @@ where
     time_removed is null
     and ctx=%s
     and code=%s
-    and base_id > %s
-order by base_id
+    and (base_id, value) > (%s, %s)
+order by base_id, value
 limit %s
-""", (2, dm, 125, 100)),
+""", (2, dm, 125, 'phancy', 100)),
             FETCH_ALL,
             COMMIT])
 
@@ -317,7 +317,7 @@ limit %s
                         'flags': set([])},
                     {'base_id': 127, 'ctx': 2, 'value': 'fntf',
                         'flags': set([])},
-                ], {dm: 126, dmalt: 127}))
+                ], {dm: (126, 'ant'), dmalt: (127, 'fntf')}))
 
         self.assertEqual(eventlog, [
             GET_CURSOR,
@@ -328,10 +328,10 @@ where
     time_removed is null
     and ctx=%s
     and code=%s
-    and base_id > %s
-order by base_id
+    and (base_id, value) > (%s, %s)
+order by base_id, value
 limit %s
-""", (2, dm, 0, 100)),
+""", (2, dm, 0, '', 100)),
             FETCH_ALL,
             COMMIT,
             GET_CURSOR,
@@ -342,13 +342,46 @@ where
     time_removed is null
     and ctx=%s
     and code=%s
-    and base_id > %s
-order by base_id
+    and (base_id, value) > (%s, %s)
+order by base_id, value
 limit %s
-""", (2, dmalt, 0, 100)),
+""", (2, dmalt, 0, '', 100)),
             FETCH_ALL,
             COMMIT])
 
+    def test_search_phonetic_merge_order(self):
+        add_fetch_result([(7, 0, 'ant'), ((1 << 56) + 1, 0, 'ant')])
+        add_fetch_result([((1 << 56) + 2, 0, 'fntf')])
+
+        dm, dmalt = _dm('window')
+
+        self.assertEqual(
+                datahog.name.search(self.p, 'window', 2, limit=2),
+                ([
+                    {'base_id': 7, 'ctx': 2, 'value': 'ant',
+                        'flags': set([])},
+                    {'base_id': (1 << 56) + 1, 'ctx': 2, 'value': 'ant',
+                        'flags': set([])},
+                ], {dm: ((1 << 56) + 1, 'ant')}))
+
+    def test_count(self):
+        add_fetch_result([(3,)])
+
+        self.assertEqual(datahog.name.count(self.p, 123, 2), 3)
+        self.assertEqual(eventlog[1], EXECUTE("""
+select length
+from list_length
+where
+    anchor_id=%s
+    and ctx=%s
+    and forward=%s
+""", (123, 2, True)))
+
+    def test_count_bad_context(self):
+        self.assertRaises(error.BadContext,
+                datahog.name.count, self.p, 123, 1)
+        self.assertEqual(eventlog, [])
+
     def test_list(self):
         add_fetch_result([
             (0, 'foo', 0),
@@ -1353,5 +1386,58 @@ where
             TPC_COMMIT])
 
 
+
+class ShardedSearchTests(base.TestCase):
+    CONFIG = dict(base.TestCase.CONFIG,
+        shards=[dict(base.TestCase.CONFIG['shards'][0], shard=i)
+            for i in xrange(3)],
+        lookup_insertion_plans=[[(0, 1)], [(1, 1)], [(2, 1)]])
+
+    def setUp(self):
+        super(ShardedSearchTests, self).setUp()
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(3, datahog.NAME,
+                {'base_ctx': 1, 'search': datahog.search.PREFIX})
+
+    def test_search_prefix_equal_values(self):
+        # 3 shards make for pages of 20, and shard 0's run of equal values
+        # carries on past its first page
+        add_fetch_result([(i, 0, 'value1') for i in xrange(1, 21)])
+        add_fetch_result([(i, 0, 'value1') for i in xrange(101, 121)])
+        add_fetch_result([])
+        add_fetch_result([(i, 0, 'value1') for i in xrange(21, 26)])
+
+        names, token = datahog.name.search(self.p, 'value', 3, limit=30)
+        self.assertEqual([n['base_id'] for n in names],
+                range(1, 26) + range(101, 106))
+        self.assertEqual(token, ('value1', 105))
+
+        self.assertEqual([e.args for e in eventlog
+                if isinstance(e, EXECUTE)],
+            [(3, 'value', '', 0, 20)] * 3 + [(3, 'value', 'value1', 20, 20)])
+
+
+class SearchMergeTests(unittest.TestCase):
+    def test_merged(self):
+        merged = datahog.db.txn._merged(
+                [[1, 4, 7], [2, 3, 9], [], [5]], lambda x: x)
+        self.assertEqual(list(merged), [1, 2, 3, 4, 5, 7, 9])
+
+    def test_paged_stops_early(self):
+        fetched = []
+        def fetch_more(last):
+            fetched.append(last)
+            return {2: [4, 6], 6: [8]}.get(last, [])
+
+        streams = [datahog.db.txn._paged([0, 2], 2, fetch_more),
+                datahog.db.txn._paged([1, 3, 5], 3, fetch_more)]
+        merged = datahog.db.txn._merged(streams, lambda x: x)
+
+        self.assertEqual([next(merged) for i in xrange(4)], [0, 1, 2, 3])
+        self.assertEqual(fetched, [2])
+        self.assertEqual(list(merged), [4, 5, 6, 8])
+        self.assertEqual(fetched, [2, 5, 6])
+
+
 if __name__ == '__main__':
     unittest.main()
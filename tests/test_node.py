@@ -160,8 +160,34 @@ select id, ctx, flags, num, value
 from node
 where
     time_removed is null
-    and (id, ctx) in ((%s,%s), (%s,%s), (%s,%s), (%s,%s))
-""", (1234, 2, 1235, 2, 1236, 2, 1237, 3)),
+    and (id, ctx) in (select * from unnest(%s::bigint[], %s::smallint[]))
+""", ([1234, 1235, 1236, 1237], [2, 2, 2, 3])),
+            FETCH_ALL,
+            COMMIT])
+
+    def test_batch_get_chunked(self):
+        self.p.batch_size = 2
+        add_fetch_result([(1234, 2, 0, 3478, None), (1235, 2, 0, 3479, None)])
+        add_fetch_result([(1236, 2, 0, 3782, None)])
+
+        self.assertEqual(
+                [n['value'] for n in datahog.node.batch_get(self.p, [
+                    (1234, 2), (1235, 2), (1236, 2)])],
+                [3478, 3479, 3782])
+
+        sql = """
+select id, ctx, flags, num, value
+from node
+where
+    time_removed is null
+    and (id, ctx) in (select * from unnest(%s::bigint[], %s::smallint[]))
+"""
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE(sql, ([1234, 1235], [2, 2])),
+            FETCH_ALL,
+            GET_CURSOR,
+            EXECUTE(sql, ([1236], [2])),
             FETCH_ALL,
             COMMIT])
 
@@ -274,11 +300,28 @@ select id, ctx, flags, num, value
 from node
 where
     time_removed is null
-    and (id, ctx) in ((%s, %s),(%s, %s),(%s, %s))
-""", (1234, 2, 1235, 2, 1236, 2)),
+    and (id, ctx) in (select * from unnest(%s::bigint[], %s::smallint[]))
+""", ([1234, 1235, 1236], [2, 2, 2])),
             FETCH_ALL,
             COMMIT])
 
+    def test_count_children(self):
+        add_fetch_result([(3,)])
+
+        self.assertEqual(datahog.node.count_children(self.p, 1233, 2), 3)
+        self.assertEqual(eventlog[1], EXECUTE("""
+select length
+from list_length
+where
+    anchor_id=%s
+    and ctx=%s
+    and forward=%s
+""", (1233, 2, True)))
+
+    def test_count_children_bad_context(self):
+        self.assertRaises(error.BadContext,
+                datahog.node.count_children, self.p, 1233, 1)
+
     def test_update_success(self):
         add_fetch_result([None]) # for rowcount
 
@@ -873,35 +916,35 @@ update node
 set time_removed=now()
 where
     time_removed is null
-    and id in (%s)
+    and id=any(%s::bigint[])
 returning id
-""", (id,)),
+""", ([id],)),
             FETCH_ALL,
             EXECUTE("""
 update property
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
-""", (id,)),
+    and base_id=any(%s::bigint[])
+""", ([id],)),
             ROWCOUNT,
             EXECUTE("""
 update alias
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
+    and base_id=any(%s::bigint[])
 returning value, ctx
-""", (id,)),
+""", ([id],)),
             FETCH_ALL,
             EXECUTE("""
 update name
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
+    and base_id=any(%s::bigint[])
 returning base_id, ctx, value
-""", (id,)),
+""", ([id],)),
             FETCH_ALL,
             EXECUTE("""
 with forwardrels (base_id, ctx, forward, rel_id) as (
@@ -910,7 +953,7 @@ with forwardrels (base_id, ctx, forward, rel_id) as (
     where
         time_removed is null
         and forward=true
-        and base_id in (%s)
+        and base_id=any(%s::bigint[])
     returning base_id, ctx, forward, rel_id
 ),
 backwardrels (base_id, ctx, forward, rel_id) as (
@@ -919,22 +962,22 @@ backwardrels (base_id, ctx, forward, rel_id) as (
     where
         time_removed is null
         and forward=false
-        and rel_id in (%s)
+        and rel_id=any(%s::bigint[])
     returning base_id, ctx, forward, rel_id
 )
 select base_id, ctx, forward, rel_id from forwardrels
 UNION ALL
 select base_id, ctx, forward, rel_id from backwardrels
-""", (id, id)),
+""", ([id], [id])),
             FETCH_ALL,
             EXECUTE("""
 update edge
 set time_removed=now()
 where
     time_removed is null
-    and base_id in (%s)
+    and base_id=any(%s::bigint[])
 returning child_id
-""", (id,)),
+""", ([id],)),
             FETCH_ALL,
             TPC_PREPARE,
             RESET,
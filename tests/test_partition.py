@@ -0,0 +1,96 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+import os
+import sys
+import unittest
+
+import datahog
+from datahog import error
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import base
+from pgmock import *
+
+
+class PartitionTests(base.TestCase):
+    def setUp(self):
+        super(PartitionTests, self).setUp()
+        datahog.set_context(1, datahog.NODE, {})
+        datahog.set_context(2, datahog.ALIAS, {'base_ctx': 1})
+        datahog.set_context(3, datahog.RELATIONSHIP, {
+            'base_ctx': 1, 'rel_ctx': 1, 'partition': 'hot'})
+        datahog.set_context(4, datahog.RELATIONSHIP, {
+            'base_ctx': 1, 'rel_ctx': 1, 'partition': 'hot'})
+        datahog.set_context(5, datahog.NAME, {
+            'base_ctx': 1, 'search': datahog.search.PREFIX,
+            'partition': True})
+
+    def test_ctx_partition(self):
+        util = datahog.const.util
+        self.assertEqual(util.ctx_partition(2), None)
+        self.assertEqual(util.ctx_partition(3), 'relationship_part_hot')
+        self.assertEqual(util.ctx_partition(5), 'name_part_5')
+
+    def test_bad_partitions(self):
+        self.assertRaises(ValueError, datahog.set_context, 6, datahog.NODE,
+                {'partition': True})
+        self.assertRaises(ValueError, datahog.set_context, 7, datahog.ALIAS,
+                {'base_ctx': 1, 'partition': 'no; drop table alias'})
+
+    def test_create_partitions(self):
+        add_fetch_result([('name_part_5',)])
+        add_fetch_result([])
+        add_fetch_result([])
+        add_fetch_result([None, None])
+
+        self.assertEqual(datahog.partition.create_partitions(self.p),
+                {0: {'relationship_part_hot': 2}})
+
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE("""
+select c.relname
+from pg_inherits i
+join pg_class c on c.oid=i.inhrelid
+where i.inhparent=%s::regclass
+""", ('name',)),
+            FETCH_ALL,
+            EXECUTE("""
+select c.relname
+from pg_inherits i
+join pg_class c on c.oid=i.inhrelid
+where i.inhparent=%s::regclass
+""", ('relationship',)),
+            FETCH_ALL,
+            COMMIT,
+            GET_CURSOR,
+            EXECUTE("""
+create table relationship_part_hot (
+  like relationship including defaults including constraints
+)
+""", ()),
+            EXECUTE("""
+with moved as (
+    delete from relationship_default
+    where ctx=any(%s::smallint[])
+    returning *
+)
+insert into relationship_part_hot
+select * from moved
+""", ([3, 4],)),
+            ROWCOUNT,
+            EXECUTE("""
+alter table relationship attach partition relationship_part_hot for values in (3, 4)
+""", ()),
+            COMMIT])
+
+    def test_create_partitions_readonly(self):
+        self.p.readonly = True
+        self.assertRaises(error.ReadOnly,
+                datahog.partition.create_partitions, self.p)
+        self.p.readonly = False
+
+
+if __name__ == '__main__':
+    unittest.main()
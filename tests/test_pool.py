@@ -0,0 +1,1120 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+import copy
+import hashlib
+import os
+import sys
+import threading
+import time
+import unittest
+
+import psycopg2
+import psycopg2.extensions
+
+import datahog
+from datahog import error
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import base
+from pgmock import *
+
+
+class ThreadedPoolTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        self.p = datahog.ThreadedConnPool(copy.deepcopy(base.TestCase.CONFIG))
+        self.p.start()
+        self.assertTrue(self.p.wait_ready(1.0))
+
+    def tearDown(self):
+        self.p = None
+        reset()
+
+    def test_start(self):
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+        self.assertEqual(eventlog, [CONNECT, CONNECT])
+
+    def test_shared_between_threads(self):
+        def worker():
+            for i in xrange(20):
+                with self.p.get_by_shard(0, timeout=1.0) as conn:
+                    conn.cursor()
+
+        threads = [threading.Thread(target=worker) for i in xrange(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+        self.assertEqual(self.p._out, {})
+        self.assertEqual(eventlog.count(COMMIT), 160)
+
+    def test_checkout_blocks_until_put(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False)
+
+        def release():
+            time.sleep(0.01)
+            self.p.put(c1)
+        threading.Thread(target=release).start()
+
+        self.assertIs(self.p.get_by_shard(0, replace=False), c1)
+        self.p.put(c1)
+        self.p.put(c2)
+
+    def test_checkout_timeout(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False)
+
+        self.assertRaises(error.Timeout,
+                self.p.get_by_shard, 0, timeout=0.01)
+
+        self.p.put(c1)
+        self.p.put(c2)
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+
+
+class ElasticPoolTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        del conf['shards'][0]['count']
+        conf['shards'][0].update({'min': 1, 'max': 3})
+        conf['connection_backoff'] = lambda: iter(())
+        self.p = datahog.ThreadedConnPool(conf)
+        self.p.start()
+        self.assertTrue(self.p.wait_ready(1.0))
+
+    def tearDown(self):
+        self.p = None
+        reset()
+
+    def test_starts_at_min(self):
+        self.assertEqual(self.p._conns[0].qsize(), 1)
+        self.assertEqual(eventlog, [CONNECT])
+
+    def test_count_is_default_min_and_max(self):
+        p = datahog.ThreadedConnPool(copy.deepcopy(base.TestCase.CONFIG))
+        shard = p._dbconf['shards'][0]
+        self.assertEqual((shard['min'], shard['max']), (2, 2))
+
+    def test_min_over_max(self):
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        conf['shards'][0]['min'] = 3
+        self.assertRaises(Exception, datahog.ThreadedConnPool, conf)
+
+    def test_grows_on_demand(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False, timeout=1.0)
+        self.assertIsNot(c1, c2)
+        self.assertEqual(eventlog, [CONNECT, CONNECT])
+        self.assertEqual(self.p._sizes[0], 2)
+
+        self.p.put(c1)
+        self.p.put(c2)
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+
+    def test_stops_at_max(self):
+        conns = [self.p.get_by_shard(0, replace=False, timeout=1.0)
+                for i in xrange(3)]
+        self.assertRaises(error.Timeout,
+                self.p.get_by_shard, 0, replace=False, timeout=0.01)
+        self.assertEqual(eventlog, [CONNECT, CONNECT, CONNECT])
+
+        for conn in conns:
+            self.p.put(conn)
+
+    def test_failed_growth_frees_the_slot(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        connect_fail(True)
+        self.assertRaises(error.Timeout,
+                self.p.get_by_shard, 0, replace=False, timeout=0.05)
+        self.assertEqual(self.p._sizes[0], 1)
+
+        connect_fail(False)
+        c2 = self.p.get_by_shard(0, replace=False, timeout=1.0)
+        self.assertEqual(self.p._sizes[0], 2)
+
+        self.p.put(c1)
+        self.p.put(c2)
+
+    def test_reap_idle(self):
+        conns = [self.p.get_by_shard(0, replace=False, timeout=1.0)
+                for i in xrange(3)]
+        for conn in conns:
+            self.p.put(conn)
+        time.sleep(0.02)
+
+        # the most recently used connection is handed out again
+        self.assertIs(self.p.get_by_shard(0, replace=False), conns[-1])
+        self.p.put(conns[-1])
+
+        self.assertEqual(self.p.reap_idle(0.01), 2)
+        self.assertEqual(eventlog.count(CLOSE), 2)
+        self.assertEqual(self.p._sizes[0], 1)
+        self.assertIs(self.p.get_by_shard(0, replace=False), conns[-1])
+        self.p.put(conns[-1])
+
+        time.sleep(0.02)
+        # never drops below 'min'
+        self.assertEqual(self.p.reap_idle(0.01), 0)
+        self.assertEqual(self.p._sizes[0], 1)
+        self.assertEqual(self.p._conns[0].qsize(), 1)
+
+    def test_reap_idle_leaves_the_rest_queued(self):
+        conns = [self.p.get_by_shard(0, replace=False, timeout=1.0)
+                for i in xrange(3)]
+        for conn in conns:
+            self.p.put(conn)
+        time.sleep(0.02)
+        self.p.put(self.p.get_by_shard(0, replace=False))
+
+        queued = []
+        shrink = self.p._shrink
+        def _shrink(shard):
+            queued.append(len(self.p._conns[shard].queue))
+            return shrink(shard)
+        self.p._shrink = _shrink
+
+        self.assertEqual(self.p.reap_idle(0.01), 2)
+        self.assertEqual(queued, [3, 3])
+        self.assertEqual(self.p._conns[0].qsize(), 1)
+
+class StartupPool(datahog.ThreadedConnPool):
+    def __init__(self, *args, **kwargs):
+        super(StartupPool, self).__init__(*args, **kwargs)
+        self.attempts = []
+        self.gates = {}
+        self.failing = set()
+        self.lock = threading.Lock()
+        self.active = self.most_active = 0
+
+    def _try_conn(self, info):
+        with self.lock:
+            self.attempts.append(info['shard'])
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        try:
+            if info['shard'] in self.gates:
+                self.gates[info['shard']].wait()
+            time.sleep(0.005)
+            if info['shard'] in self.failing:
+                return None
+            return super(StartupPool, self)._try_conn(info)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class StartupTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+
+    def tearDown(self):
+        reset()
+
+    def pool(self, **extra):
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        shard = conf['shards'][0]
+        conf['shards'] = [dict(shard, shard=i) for i in xrange(3)]
+        conf['connection_backoff'] = lambda: iter(())
+        conf.update(extra)
+        return StartupPool(conf)
+
+    def test_bounded_concurrency(self):
+        p = self.pool(connection_concurrency=2)
+        p.start()
+        self.assertTrue(p.wait_ready(1.0))
+        self.assertEqual(p.most_active, 2)
+        self.assertEqual(len(p.attempts), 6)
+
+    def test_first_connections_first(self):
+        p = self.pool(connection_concurrency=1)
+        p.start()
+        self.assertTrue(p.wait_ready(1.0))
+        self.assertEqual(p.attempts, [0, 1, 2, 0, 1, 2])
+
+    def test_per_shard_failure(self):
+        p = self.pool()
+        p.failing.add(2)
+        p.start()
+        self.assertEqual(p.wait_ready(1.0, per_shard=True),
+                {0: True, 1: True, 2: False})
+        self.assertFalse(p.wait_ready(1.0))
+
+    def test_ready_once_grown_to_min(self):
+        p = self.pool()
+        p.failing.add(2)
+        p.start()
+        self.assertFalse(p.wait_ready(1.0, per_shard=True)[2])
+
+        p.failing.discard(2)
+        c1 = p.get_by_shard(2, replace=False, timeout=1.0)
+        # one connection is still short of the shard's 'min' of 2
+        self.assertFalse(p.wait_ready(0, per_shard=True)[2])
+
+        c2 = p.get_by_shard(2, replace=False, timeout=1.0)
+        p.put(c1)
+        p.put(c2)
+        self.assertTrue(p.wait_ready(0))
+
+    def test_per_shard_slow_shard(self):
+        p = self.pool()
+        p.gates[1] = threading.Event()
+        p.start()
+        self.assertEqual(p.wait_ready(0.05, per_shard=True),
+                {0: True, 1: False, 2: True})
+        self.assertFalse(p.wait_ready(0.01))
+
+        p.gates[1].set()
+        self.assertTrue(p.wait_ready(1.0))
+        self.assertEqual(p.wait_ready(0, per_shard=True),
+                {0: True, 1: True, 2: True})
+
+
+class StatsTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        self.events = []
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        conf['stats_callback'] = lambda *args: self.events.append(args)
+        conf['connection_backoff'] = lambda: iter(())
+        self.p = datahog.ThreadedConnPool(conf)
+        self.p.start()
+        self.assertTrue(self.p.wait_ready(1.0))
+
+    def tearDown(self):
+        self.p = None
+        reset()
+
+    def test_initial(self):
+        self.assertEqual(self.p.stats(), {0: {
+            'checkouts': 0,
+            'in_use': 0,
+            'size': 2,
+            'idle': 2,
+            'wait_time': 0.0,
+            'wait_histogram': [(b, 0) for b in datahog.pool.WAIT_BUCKETS] + [
+                (None, 0)],
+            'held_time': 0.0,
+            'timeouts': 0,
+            'query_timeouts': 0,
+            'connect_failures': 0,
+            'down': False,
+            'down_count': 0,
+        }})
+
+    def test_checkouts(self):
+        with self.p.get_by_shard(0):
+            stats = self.p.stats()[0]
+            self.assertEqual(stats['checkouts'], 1)
+            self.assertEqual(stats['in_use'], 1)
+            self.assertEqual(stats['idle'], 1)
+            time.sleep(0.01)
+
+        stats = self.p.stats()[0]
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['idle'], 2)
+        self.assertEqual(stats['wait_histogram'][0], (0.001, 1))
+        self.assertTrue(stats['held_time'] >= 0.01)
+
+        self.assertEqual([e[:2] for e in self.events],
+                [(0, 'checkout'), (0, 'checkin')])
+        self.assertTrue(self.events[1][2] >= 0.01)
+
+    def test_timeouts(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False)
+        self.assertRaises(error.Timeout, self.p.get_by_shard, 0, timeout=0.02)
+
+        stats = self.p.stats()[0]
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(self.events[-1], (0, 'timeout', None))
+
+        self.p.put(c1)
+        self.p.put(c2)
+
+    def test_connect_failures(self):
+        connect_fail(True)
+        self.p._start_conn(self.p._shards[0], self.p._ev())
+        time.sleep(0.02)
+
+        self.assertEqual(self.p.stats()[0]['connect_failures'], 1)
+        self.assertEqual(self.events, [(0, 'connect_failure', None)])
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        self.events = []
+        self.p = self.pool()
+        reset()
+
+    def tearDown(self):
+        # let the probes finish before other tests look at the eventlog
+        connect_fail(False)
+        self.wait_up()
+        time.sleep(0.01)
+        self.p = None
+        reset()
+
+    def pool(self, ready=True, **extra):
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        conf['connection_backoff'] = lambda: iter(())
+        conf['circuit_breaker_threshold'] = 2
+        conf['circuit_breaker_reset'] = 0.01
+        conf['stats_callback'] = lambda *args: self.events.append(args[:2])
+        conf.update(extra)
+        p = datahog.ThreadedConnPool(conf)
+        p.start()
+        self.assertEqual(p.wait_ready(1.0), ready)
+        return p
+
+    def fail_query(self, p=None):
+        query_fail(psycopg2.OperationalError)
+        try:
+            with (p or self.p).get_by_shard(0) as conn:
+                conn.cursor().execute("select 1")
+        except psycopg2.OperationalError:
+            pass
+        else:
+            self.fail("query didn't fail")
+        query_fail(None)
+
+    def wait_up(self):
+        for i in xrange(100):
+            if not self.p.shard_down(0):
+                return
+            time.sleep(0.005)
+        self.fail("shard never came back up")
+
+    def test_trips_after_consecutive_failures(self):
+        self.fail_query()
+        self.assertFalse(self.p.shard_down(0))
+        self.fail_query()
+        self.assertTrue(self.p.shard_down(0))
+
+        self.assertRaises(error.ShardDown, self.p.get_by_shard, 0)
+        self.assertIn((0, 'shard_down'), self.events)
+        self.assertEqual(self.p.stats()[0]['down_count'], 1)
+
+    def test_success_resets_the_count(self):
+        self.fail_query()
+        with self.p.get_by_shard(0):
+            pass
+        self.fail_query()
+        self.assertFalse(self.p.shard_down(0))
+
+    def test_checkout_timeouts_dont_count(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False)
+        for i in xrange(2):
+            self.assertRaises(error.Timeout,
+                    self.p.get_by_shard, 0, timeout=0.001)
+        self.assertFalse(self.p.shard_down(0))
+
+        self.p.put(c1)
+        self.p.put(c2)
+
+    def test_query_errors_dont_count(self):
+        for klass in (psycopg2.extensions.TransactionRollbackError,
+                psycopg2.extensions.QueryCanceledError):
+            query_fail(klass)
+            for i in xrange(2):
+                try:
+                    with self.p.get_by_shard(0) as conn:
+                        conn.cursor().execute("select 1")
+                except klass:
+                    pass
+            query_fail(None)
+        self.assertFalse(self.p.shard_down(0))
+
+    def test_hung_queries_count(self):
+        # the queries run until the deadline has them canceled
+        query_fail(psycopg2.extensions.QueryCanceledError)
+        for i in xrange(2):
+            try:
+                with self.p.get_by_shard(0, timeout=0.005) as conn:
+                    time.sleep(0.01)
+                    conn.cursor().execute("select 1")
+            except error.Timeout:
+                pass
+            else:
+                self.fail("query didn't time out")
+        query_fail(None)
+
+        self.assertTrue(self.p.shard_down(0))
+        self.assertEqual(self.p.stats()[0]['query_timeouts'], 2)
+
+    def test_closed_connection_counts(self):
+        self.p = self.pool(circuit_breaker_threshold=1)
+        for closed in (0, 2):
+            try:
+                with self.p.get_by_shard(0) as conn:
+                    conn.closed = closed
+                    raise psycopg2.DatabaseError()
+            except psycopg2.DatabaseError:
+                pass
+            self.assertEqual(self.p.shard_down(0), bool(closed))
+
+    def test_closes_idle_connections(self):
+        connect_fail(True)
+        self.fail_query()
+        self.fail_query()
+
+        # one was idle, the other was in use when the shard went down
+        self.assertEqual(eventlog.count(CLOSE), 1)
+        self.assertEqual(self.p._sizes[0], 1)
+
+    def test_probes_until_back_up(self):
+        connect_fail(True)
+        self.fail_query()
+        self.fail_query()
+
+        time.sleep(0.05)
+        self.assertTrue(self.p.shard_down(0))
+        self.assertTrue(eventlog.count(CONNECT_FAIL) >= 2)
+
+        connect_fail(False)
+        self.wait_up()
+        self.assertIn((0, 'shard_up'), self.events)
+
+        time.sleep(0.01)
+        self.assertEqual(self.p._sizes[0], 2)
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+        with self.p.get_by_shard(0):
+            pass
+
+    def test_probe_respects_max(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False)
+        self.p._failure(0)
+        self.p._failure(0)
+        self.assertTrue(self.p.shard_down(0))
+
+        self.wait_up()
+        self.assertEqual(eventlog, [CONNECT, CLOSE])
+        self.assertEqual(self.p._sizes[0], 2)
+
+        self.p.put(c1)
+        self.p.put(c2)
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+
+    def test_ready_again_after_probe(self):
+        connect_fail(True)
+        p = self.pool(False)
+        self.assertEqual(p.wait_ready(per_shard=True), {0: False})
+        self.assertTrue(p.shard_down(0))
+
+        self.p = p
+        connect_fail(False)
+        self.wait_up()
+        self.assertEqual(p.wait_ready(per_shard=True), {0: True})
+
+    def test_disabled_by_default(self):
+        p = self.pool(circuit_breaker_threshold=None)
+        for i in xrange(5):
+            self.fail_query(p)
+        self.assertFalse(p.shard_down(0))
+
+    def test_dropped_connections_are_replaced(self):
+        conn = self.p.get_by_shard(0, replace=False)
+        conn.closed = 2
+        self.p.put(conn)
+        time.sleep(0.01)
+
+        self.assertEqual(eventlog, [CONNECT])
+        self.assertEqual(self.p._sizes[0], 2)
+        self.assertNotIn(conn, [self.p._conns[0].get() for i in xrange(2)])
+
+
+class DeadlineTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        self.p = datahog.ThreadedConnPool(copy.deepcopy(base.TestCase.CONFIG))
+        self.p.start()
+        self.assertTrue(self.p.wait_ready(1.0))
+        reset()
+
+    def tearDown(self):
+        self.p = None
+        reset()
+
+    def test_no_limit(self):
+        deadline = datahog.Deadline()
+        self.assertIs(deadline.remaining(), None)
+        self.assertFalse(deadline.expired())
+
+    def test_monotonic_clock(self):
+        # without the monotonic package, clock_gettime stands in for it
+        self.assertIsNot(datahog.pool.monotonic, time.time)
+        first = datahog.pool.monotonic()
+        time.sleep(0.01)
+        self.assertTrue(0.005 < datahog.pool.monotonic() - first < 1)
+
+    def test_remaining(self):
+        deadline = datahog.Deadline(0.02)
+        self.assertTrue(0 < deadline.remaining() <= 0.02)
+        time.sleep(0.03)
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertTrue(deadline.expired())
+
+    def test_coerce(self):
+        deadline = datahog.Deadline(1)
+        self.assertIs(datahog.Deadline.coerce(deadline), deadline)
+        self.assertIs(datahog.Deadline.coerce(None).expires, None)
+
+    def test_shared_between_checkouts(self):
+        c1 = self.p.get_by_shard(0, replace=False)
+        c2 = self.p.get_by_shard(0, replace=False)
+
+        deadline = datahog.Deadline(0.02)
+        start = time.time()
+        self.assertRaises(error.Timeout,
+                self.p.get_by_shard, 0, timeout=deadline)
+        self.assertTrue(time.time() - start >= 0.015)
+
+        # nothing left for the next hop, it fails without waiting
+        self.p.put(c1)
+        self.assertRaises(error.Timeout,
+                self.p.get_by_shard, 0, timeout=deadline)
+
+        self.p.put(c2)
+
+    def test_cancels_queries_at_deadline(self):
+        deadline = datahog.Deadline(0.01)
+        conn = self.p.get_by_shard(0, replace=False)
+        with deadline.watch(self.p, conn):
+            time.sleep(0.02)
+        self.assertEqual(eventlog, [CANCEL])
+        self.p.put(conn)
+
+    def test_canceled_query_is_a_timeout(self):
+        def f():
+            with datahog.Deadline(1):
+                raise psycopg2.extensions.QueryCanceledError()
+        self.assertRaises(error.Timeout, f)
+
+    def test_two_phase_commit_held_to_deadline(self):
+        deadline = datahog.Deadline(0.01)
+        tpc = datahog.db.txn.TwoPhaseCommit(self.p, 0, 'test', (), deadline)
+        conn = None
+        try:
+            with tpc as conn:
+                time.sleep(0.02)
+        finally:
+            self.p.put(conn)
+        self.assertIn(CANCEL, eventlog)
+
+    def test_api_call_with_deadline(self):
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(2, datahog.NODE, {
+            'base_ctx': 1, 'storage': datahog.storage.INT
+        })
+        try:
+            add_fetch_result([(34789, 2, 0)])
+            add_fetch_result([(34789, 2, 0, 4781, None)])
+            nodes, pos = datahog.node.get_children(
+                    self.p, 1234, 2, timeout=datahog.Deadline(1.0))
+            self.assertEqual([n['value'] for n in nodes], [4781])
+        finally:
+            datahog.context.META.clear()
+
+
+class SessionTests(base.TestCase):
+    def setUp(self):
+        super(SessionTests, self).setUp()
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(2, datahog.NODE, {
+            'base_ctx': 1, 'storage': datahog.storage.INT
+        })
+        datahog.set_context(3, datahog.RELATIONSHIP, {
+            'base_ctx': 1, 'rel_ctx': 2})
+
+    def test_one_checkout(self):
+        with self.p.session() as session:
+            for i in xrange(3):
+                add_fetch_result([(0, 4781)])
+                datahog.node.get(session, 34789, 2)
+            self.assertEqual(self.p._conns[0].qsize(), 1)
+
+        self.assertEqual(self.p.stats()[0]['checkouts'], 1)
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+
+    def test_reads_commit_at_the_end(self):
+        with self.p.session() as session:
+            add_fetch_result([(0, 4781)])
+            datahog.node.get(session, 34789, 2)
+            add_fetch_result([(0, 4782)])
+            datahog.node.get(session, 34790, 2)
+            self.assertNotIn(COMMIT, eventlog)
+
+        self.assertEqual(eventlog[-1], COMMIT)
+        self.assertEqual(eventlog.count(COMMIT), 1)
+
+    def test_writes_commit_right_away(self):
+        with self.p.session() as session:
+            add_fetch_result([()])
+            self.assertTrue(datahog.node.update(session, 34789, 2, 7))
+            self.assertEqual(eventlog[-1], COMMIT)
+
+    def test_failed_call_rolls_back(self):
+        with self.p.session() as session:
+            query_fail(psycopg2.OperationalError)
+            self.assertRaises(psycopg2.OperationalError,
+                    datahog.node.get, session, 34789, 2)
+            self.assertEqual(eventlog[-1], ROLLBACK)
+
+            query_fail(None)
+            add_fetch_result([(0, 4781)])
+            self.assertEqual(
+                    datahog.node.get(session, 34789, 2)['value'], 4781)
+
+    def test_breaker_accounting(self):
+        self.p._dbconf['circuit_breaker_threshold'] = 5
+        breaker = self.p._breakers[0]
+        with self.p.session() as session:
+            query_fail(psycopg2.OperationalError)
+            self.assertRaises(psycopg2.OperationalError,
+                    datahog.node.update, session, 34789, 2, 7)
+            self.assertEqual(breaker.failures, 1)
+
+            query_fail(psycopg2.extensions.TransactionRollbackError)
+            self.assertRaises(psycopg2.extensions.TransactionRollbackError,
+                    datahog.node.update, session, 34789, 2, 7)
+            self.assertEqual(breaker.failures, 1)
+
+            query_fail(None)
+            add_fetch_result([()])
+            self.assertTrue(datahog.node.update(session, 34789, 2, 7))
+            self.assertEqual(breaker.failures, 0)
+
+    def test_rolls_back_on_exception(self):
+        class Oops(Exception):
+            pass
+
+        def f():
+            with self.p.session() as session:
+                add_fetch_result([(0, 4781)])
+                datahog.node.get(session, 34789, 2)
+                raise Oops()
+
+        self.assertRaises(Oops, f)
+        self.assertEqual(eventlog[-1], ROLLBACK)
+        self.assertNotIn(COMMIT, eventlog)
+
+    def test_lends_pinned_connection(self):
+        with self.p.session() as session:
+            with session.get_read_by_shard(0) as pinned:
+                pass
+            conn = session.get_by_shard(0, replace=False)
+            self.assertIs(conn, pinned)
+            self.assertEqual(eventlog, [COMMIT])
+
+            # while it's lent out, the pool provides another
+            other = session.get_by_shard(0, replace=False)
+            self.assertIsNot(other, conn)
+            session.put(other)
+            session.put(conn)
+            self.assertEqual(self.p._conns[0].qsize(), 1)
+
+    def test_two_phase_commits(self):
+        with self.p.session() as session:
+            add_fetch_result([(1,)])
+            add_fetch_result([(1,)])
+            self.assertTrue(datahog.relationship.create(session, 3, 123, 456))
+            self.assertEqual(eventlog.count(TPC_COMMIT), 1)
+
+        self.assertEqual(self.p.stats()[0]['checkouts'], 1)
+
+
+class FanOutTests(base.TestCase):
+    def run_group(self, log):
+        def func(key, value, deadline):
+            log.append(('start', key))
+            self.p._pause(1)
+            log.append(('end', key))
+            if value is None:
+                raise ValueError(key)
+            return value * 2
+        return func
+
+    def test_runs_concurrently(self):
+        log = []
+        self.assertEqual(
+                self.p.fan_out(self.run_group(log), {1: 10, 2: 20}),
+                {1: 20, 2: 40})
+        self.assertEqual([event for event, key in log[:2]],
+                ['start', 'start'])
+
+    def test_shares_deadline(self):
+        deadlines = []
+        deadline = datahog.Deadline(5)
+        self.p.fan_out(lambda k, v, d: deadlines.append(d),
+                {1: None, 2: None, 3: None}, deadline)
+        self.assertEqual(deadlines, [deadline] * 3)
+
+    def test_failure_waits_for_the_rest(self):
+        log = []
+        self.assertRaises(ValueError, self.p.fan_out, self.run_group(log),
+                {1: None, 2: 20, 3: 30})
+        self.assertEqual(sorted(log), [('end', 1), ('end', 2), ('end', 3),
+            ('start', 1), ('start', 2), ('start', 3)])
+
+    def test_session_runs_in_turn(self):
+        log = []
+        with self.p.session() as session:
+            self.assertEqual(
+                    session.fan_out(self.run_group(log), {1: 10, 2: 20}),
+                    {1: 20, 2: 40})
+        self.assertEqual([event for event, key in log],
+                ['start', 'end', 'start', 'end'])
+
+
+class HedgedTests(base.TestCase):
+    def lookup(self, log, results, slow=()):
+        def func(key, deadline):
+            log.append(('start', key))
+            if key in slow:
+                self.p._pause(50)
+            log.append(('end', key))
+            return results.get(key)
+        return func
+
+    def test_one_at_a_time(self):
+        log = []
+        self.assertEqual(self.p.hedged(self.lookup(log, {2: 'b', 3: 'c'}),
+                [1, 2, 3]), (2, 'b'))
+        self.assertEqual(log,
+                [('start', 1), ('end', 1), ('start', 2), ('end', 2)])
+
+    def test_all_at_once(self):
+        log = []
+        self.assertEqual(self.p.hedged(
+                self.lookup(log, {1: 'a', 2: 'b'}, slow=[1]), [1, 2], 0),
+            (2, 'b'))
+        self.assertNotIn(('end', 1), log)
+
+    def test_hedges_slow_calls(self):
+        log = []
+        start = time.time()
+        self.assertEqual(self.p.hedged(
+                self.lookup(log, {1: 'a', 3: 'c'}, slow=[1]), [1, 2, 3],
+                0.005), (3, 'c'))
+        self.assertTrue(time.time() - start < 0.04)
+        self.assertEqual(log[:2], [('start', 1), ('start', 2)])
+
+    def test_no_hedge_when_fast(self):
+        log = []
+        self.assertEqual(self.p.hedged(self.lookup(log, {1: 'a'}), [1, 2],
+                0.02), (1, 'a'))
+        self.assertNotIn(('start', 2), log)
+
+    def test_miss(self):
+        log = []
+        self.assertEqual(self.p.hedged(self.lookup(log, {}, slow=[2]),
+                [1, 2, 3], 0), (None, None))
+        self.assertEqual(len(log), 6)
+
+    def test_failure(self):
+        def func(key, deadline):
+            raise error.ShardDown(key)
+        self.assertRaises(error.ShardDown, self.p.hedged, func, [1, 2], 0)
+
+    def test_deadline(self):
+        start = time.time()
+        self.assertRaises(error.Timeout, self.p.hedged,
+                lambda k, d: self.p._pause(200), [1, 2], 0, 0.01)
+        self.assertTrue(time.time() - start < 0.1)
+
+
+class ThreadedHedgedTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        self.p = datahog.ThreadedConnPool(copy.deepcopy(base.TestCase.CONFIG))
+
+    def tearDown(self):
+        self.p = None
+        reset()
+
+    def test_misses_finish(self):
+        for i in xrange(2000):
+            self.assertEqual(self.p.hedged(lambda k, d: None, [1, 2], 0,
+                    timeout=1.0), (None, None))
+
+    def test_first_hit(self):
+        def func(key, deadline):
+            if key == 1:
+                time.sleep(0.1)
+            return key
+        start = time.time()
+        self.assertEqual(self.p.hedged(func, [1, 2], 0.005), (2, 2))
+        self.assertTrue(time.time() - start < 0.08)
+
+    def test_deadline(self):
+        self.assertRaises(error.Timeout, self.p.hedged,
+                lambda k, d: time.sleep(0.1), [1, 2], 0, 0.01)
+
+
+class RoutingPoolTests(unittest.TestCase):
+    def setUp(self):
+        reset()
+        self.primary = datahog.ThreadedConnPool(
+                copy.deepcopy(base.TestCase.CONFIG))
+        self.replica = datahog.ThreadedConnPool(
+                copy.deepcopy(base.TestCase.CONFIG), readonly=True)
+        self.p = datahog.RoutingConnPool(self.primary, [self.replica])
+        self.p.start()
+        self.assertTrue(self.p.wait_ready(1.0))
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(2, datahog.NODE, {
+            'base_ctx': 1, 'storage': datahog.storage.INT
+        })
+        reset()
+
+    def tearDown(self):
+        self.p = self.primary = self.replica = None
+        datahog.context.META.clear()
+        datahog.flag.META.clear()
+        reset()
+
+    def checkouts(self):
+        return (self.primary.stats()[0]['checkouts'],
+                self.replica.stats()[0]['checkouts'])
+
+    def test_reads_go_to_replica(self):
+        add_fetch_result([(0, 4781)])
+        self.assertEqual(datahog.node.get(self.p, 34789, 2)['value'], 4781)
+        self.assertEqual(self.checkouts(), (0, 1))
+
+    def test_writes_go_to_primary(self):
+        add_fetch_result([()])
+        self.assertTrue(datahog.node.update(self.p, 34789, 2, 7))
+        self.assertEqual(self.checkouts(), (1, 0))
+
+    def test_uncovered_shard_reads_from_primary(self):
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        conf['shards'][0]['shard'] = 1
+        other = datahog.ThreadedConnPool(conf, readonly=True)
+        other.start()
+        other.wait_ready(1.0)
+        p = datahog.RoutingConnPool(self.primary, [other])
+
+        add_fetch_result([(0, 4781)])
+        datahog.node.get(p, 34789, 2)
+        self.assertEqual(self.checkouts(), (1, 0))
+
+    def test_put_back_to_owner(self):
+        conn = self.p.get_read_by_shard(0, replace=False)
+        self.assertEqual(self.replica._conns[0].qsize(), 1)
+        self.p.put(conn)
+        self.assertEqual(self.replica._conns[0].qsize(), 2)
+        self.assertEqual(self.primary._conns[0].qsize(), 2)
+
+    def test_down_replica_is_skipped(self):
+        self.replica._breakers[0].down_since = time.time()
+        add_fetch_result([(0, 4781)])
+        datahog.node.get(self.p, 34789, 2)
+        self.assertEqual(self.checkouts(), (1, 0))
+
+    def test_primary_attributes(self):
+        self.assertFalse(self.p.readonly)
+        self.assertEqual(self.p.shardbits, 8)
+        self.assertEqual(self.p.shard_by_id(1 << 56), 1)
+
+
+class LookupRoutingTests(unittest.TestCase):
+    PLANS = [
+        [(0, 1)],
+        [(0, 1), (1, 1)],
+        [(0, 2), (1, 1), (2, 4)],
+    ]
+
+    def pool(self, plans):
+        conf = copy.deepcopy(base.TestCase.CONFIG)
+        conf['lookup_insertion_plans'] = copy.deepcopy(plans)
+        return datahog.ThreadedConnPool(conf)
+
+    def brute_force(self, p, num):
+        shards = []
+        for plan in p._dbconf['lookup_insertion_plans'][::-1]:
+            total = plan[-1][0]
+            shard = [s for partial, s in plan if num % total < partial][0]
+            if shard not in shards:
+                shards.append(shard)
+        return tuple(shards)
+
+    def digest(self, i):
+        return hashlib.sha1(str(i)).digest()
+
+    def test_hash_routes(self):
+        p = self.pool(self.PLANS)
+        self.assertEqual(p._hash_modulus, 14)
+        for i in xrange(200):
+            digest = self.digest(i)
+            self.assertEqual(p.shards_for_lookup_hash(digest),
+                    self.brute_force(p, datahog.pool._int_hash(digest)))
+
+    def test_hash_routes_without_table(self):
+        p = self.pool(self.PLANS + [[(0, 65521), (1, 1)]])
+        self.assertIs(p._hash_modulus, None)
+        for i in xrange(200):
+            digest = self.digest(i)
+            self.assertEqual(p.shards_for_lookup_hash(digest),
+                    self.brute_force(p, datahog.pool._int_hash(digest)))
+
+    def test_prefix_routes(self):
+        p = self.pool(self.PLANS)
+        for value in ['a', 'hello', '\xff\x00', u'\u2603'.encode('utf8')]:
+            self.assertEqual(p.shards_for_lookup_prefix(value),
+                    self.brute_force(p, ord(value[0])))
+
+    def test_write_shard_is_newest_plan(self):
+        p = self.pool(self.PLANS)
+        for i in xrange(50):
+            digest = self.digest(i)
+            self.assertEqual(p.shard_for_alias_write(digest),
+                    p.shards_for_lookup_hash(digest)[0])
+
+    def test_batch_grouping(self):
+        p = self.pool(self.PLANS)
+        digests = [self.digest(i) for i in xrange(50)]
+        groups = p.shards_for_lookup_hashes(digests)
+        for digest in digests:
+            self.assertEqual(
+                    sorted(s for s in groups if digest in groups[s]),
+                    sorted(p.shards_for_lookup_hash(digest)))
+
+        values = ['apple', 'banana', 'cherry', '\xe2\x98\x83']
+        groups = p.shards_for_lookup_prefixes(values)
+        for value in values:
+            self.assertEqual(
+                    sorted(s for s in groups if value in groups[s]),
+                    sorted(p.shards_for_lookup_prefix(value)))
+
+
+class PreparedStatementTests(base.TestCase):
+    def setUp(self):
+        reset()
+        conf = copy.deepcopy(self.CONFIG)
+        conf['prepare_statements'] = True
+        self.p = datahog.GreenhouseConnPool(conf)
+        self.p.start()
+        self.p.wait_ready()
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(2, datahog.NODE, {
+            'base_ctx': 1, 'storage': datahog.storage.INT
+        })
+
+    def test_prepared_on_connect(self):
+        prepares = [e for e in eventlog if isinstance(e, EXECUTE)]
+        self.assertEqual(len(prepares), 2 * len(datahog.db.query._statements))
+        self.assertIn(EXECUTE("""
+prepare select_node_num as
+select flags, num
+from node
+where
+    time_removed is null
+    and id=$1
+    and ctx=$2
+""", ()), prepares)
+        self.assertEqual(eventlog.count(COMMIT), 2)
+
+    def test_executes_by_name(self):
+        reset()
+        add_fetch_result([(0, 4781)])
+        self.assertEqual(datahog.node.get(self.p, 34789, 2)['value'], 4781)
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE("execute select_node_num (%s, %s)", (34789, 2)),
+            ROWCOUNT,
+            FETCH_ONE,
+            COMMIT])
+
+    def test_reset_prepares_again(self):
+        with self.p.get_by_shard(0) as conn:
+            reset()
+            datahog.db.query.reset(conn)
+        self.assertEqual(eventlog[:2], [RESET, GET_CURSOR])
+        self.assertEqual(eventlog.count(COMMIT), 2)
+
+
+    def test_prepare_failure_falls_back(self):
+        reset()
+        query_fail(psycopg2.ProgrammingError)
+        conf = copy.deepcopy(self.CONFIG)
+        conf['prepare_statements'] = True
+        self.p = datahog.GreenhouseConnPool(conf)
+        self.p.start()
+        ready = self.p.wait_ready(1)
+        query_fail(None)
+        self.assertTrue(ready)
+        self.assertEqual(eventlog.count(ROLLBACK), 2)
+        self.assertEqual(self.p.stats()[0]['connect_failures'], 0)
+
+        reset()
+        add_fetch_result([(0, 4781)])
+        self.assertEqual(datahog.node.get(self.p, 34789, 2)['value'], 4781)
+        self.assertEqual(eventlog[1], EXECUTE("""
+select flags, num
+from node
+where
+    time_removed is null
+    and id=%s
+    and ctx=%s
+""", (34789, 2)))
+
+
+class AutocommitReadTests(base.TestCase):
+    def setUp(self):
+        reset()
+        conf = copy.deepcopy(self.CONFIG)
+        conf['autocommit_reads'] = True
+        self.p = datahog.GreenhouseConnPool(conf)
+        self.p.start()
+        self.p.wait_ready()
+        datahog.set_context(1, datahog.NODE)
+        datahog.set_context(2, datahog.NODE, {
+            'base_ctx': 1, 'storage': datahog.storage.INT
+        })
+        reset()
+
+    def test_read_skips_commit(self):
+        add_fetch_result([(0, 4781)])
+        self.assertEqual(datahog.node.get(self.p, 34789, 2)['value'], 4781)
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE("""
+select flags, num
+from node
+where
+    time_removed is null
+    and id=%s
+    and ctx=%s
+""", (34789, 2)),
+            ROWCOUNT,
+            FETCH_ONE])
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+
+    def test_autocommit_only_while_checked_out(self):
+        with self.p.get_read_by_shard(0) as conn:
+            self.assertTrue(conn.autocommit)
+        self.assertFalse(conn.autocommit)
+
+        with self.p.get_by_shard(0) as conn:
+            self.assertFalse(conn.autocommit)
+
+    def test_failed_read_skips_rollback(self):
+        query_fail(psycopg2.OperationalError)
+        self.assertRaises(psycopg2.OperationalError,
+                datahog.node.get, self.p, 34789, 2)
+        self.assertNotIn(ROLLBACK, eventlog)
+        self.assertEqual(self.p._conns[0].qsize(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
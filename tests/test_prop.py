@@ -278,8 +278,8 @@ from property
 where
     time_removed is null
     and base_id=%s
-    and ctx in (%s, %s, %s)
-""", (123, 2, 3, 4)),
+    and ctx=any(%s::smallint[])
+""", (123, [2, 3, 4])),
             FETCH_ALL,
             COMMIT])
 
@@ -0,0 +1,99 @@
+# vim: fileencoding=utf8:et:sw=4:ts=8:sts=4
+
+import os
+import sys
+import unittest
+
+import datahog
+from datahog import error
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import base
+from pgmock import *
+
+
+class PurgeTests(base.TestCase):
+    def test_purge_shard_in_batches(self):
+        add_fetch_result([None, None])
+        add_fetch_result([None])
+
+        progress = []
+        self.assertEqual(datahog.purge.purge_shard(self.p, 0, 86400,
+                batch_size=2, pause=0, tables=['relationship'],
+                progress=lambda *args: progress.append(args)),
+            {'relationship': 3})
+
+        self.assertEqual(progress, [(0, 'relationship', 2),
+            (0, 'relationship', 3)])
+
+        sql = """
+delete from relationship
+using (
+    select tableoid, ctid
+    from relationship
+    where time_removed < now() - %s * interval '1 second'
+    limit %s
+) as doomed
+where relationship.tableoid=doomed.tableoid and relationship.ctid=doomed.ctid
+"""
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE(sql, (86400, 2)),
+            ROWCOUNT,
+            COMMIT,
+            GET_CURSOR,
+            EXECUTE(sql, (86400, 2)),
+            ROWCOUNT,
+            COMMIT])
+
+    def test_purge_archives(self):
+        add_fetch_result([])
+
+        self.assertEqual(datahog.purge.purge_shard(self.p, 0, 60,
+                archive=True, tables=['alias_lookup']),
+            {'alias_lookup': 0})
+
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE("""
+with purged as (
+delete from alias_lookup
+using (
+    select tableoid, ctid
+    from alias_lookup
+    where time_removed < now() - %s * interval '1 second'
+    limit %s
+) as doomed
+where alias_lookup.tableoid=doomed.tableoid and alias_lookup.ctid=doomed.ctid
+    returning alias_lookup.*
+)
+insert into alias_lookup_archive
+select * from purged
+""", (60, 1000)),
+            ROWCOUNT,
+            COMMIT])
+
+    def test_purge_every_table_and_shard(self):
+        for tbl in datahog.purge.TABLES:
+            add_fetch_result([])
+
+        self.assertEqual(datahog.purge.purge(self.p, 60), {
+            0: dict((tbl, 0) for tbl in datahog.purge.TABLES)})
+        self.assertEqual(
+                len([ev for ev in eventlog if ev == COMMIT]),
+                len(datahog.purge.TABLES))
+
+    def test_purge_unknown_table(self):
+        self.assertRaises(ValueError, datahog.purge.purge_shard,
+                self.p, 0, 60, tables=['list_length'])
+        self.assertEqual(eventlog, [])
+
+    def test_purge_readonly(self):
+        self.p.readonly = True
+        self.assertRaises(error.ReadOnly, datahog.purge.purge, self.p, 60)
+        self.p.readonly = False
+
+
+if __name__ == '__main__':
+    unittest.main()
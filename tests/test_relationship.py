@@ -36,15 +36,14 @@ class RelationshipTests(base.TestCase):
             GET_CURSOR,
             EXECUTE("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %s, %s, %s, %s, (
-    select count(*)
-    from relationship
+select %s, %s, %s, %s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and base_id=%s
+        anchor_id=%s
         and ctx=%s
         and forward=%s
-), %s
+), 0), %s
 where exists (
     select 1
     from node
@@ -61,15 +60,14 @@ returning 1
             GET_CURSOR,
             EXECUTE("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %s, %s, %s, %s, (
-    select count(*)
-    from relationship
+select %s, %s, %s, %s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and rel_id=%s
+        anchor_id=%s
         and ctx=%s
         and forward=%s
-), %s
+), 0), %s
 where exists (
     select 1
     from node
@@ -95,15 +93,14 @@ returning 1
             GET_CURSOR,
             EXECUTE("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %s, %s, %s, %s, (
-    select count(*)
-    from relationship
+select %s, %s, %s, %s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and base_id=%s
+        anchor_id=%s
         and ctx=%s
         and forward=%s
-), %s
+), 0), %s
 where exists (
     select 1
     from node
@@ -129,15 +126,14 @@ returning 1
             GET_CURSOR,
             EXECUTE("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %s, %s, %s, %s, (
-    select count(*)
-    from relationship
+select %s, %s, %s, %s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and base_id=%s
+        anchor_id=%s
         and ctx=%s
         and forward=%s
-), %s
+), 0), %s
 where exists (
     select 1
     from node
@@ -154,15 +150,14 @@ returning 1
             GET_CURSOR,
             EXECUTE("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %s, %s, %s, %s, (
-    select count(*)
-    from relationship
+select %s, %s, %s, %s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and rel_id=%s
+        anchor_id=%s
         and ctx=%s
         and forward=%s
-), %s
+), 0), %s
 where exists (
     select 1
     from node
@@ -189,15 +184,14 @@ returning 1
             GET_CURSOR,
             EXECUTE_FAILURE("""
 insert into relationship (base_id, rel_id, ctx, forward, pos, flags)
-select %s, %s, %s, %s, (
-    select count(*)
-    from relationship
+select %s, %s, %s, %s, coalesce((
+    select length
+    from list_length
     where
-        time_removed is null
-        and base_id=%s
+        anchor_id=%s
         and ctx=%s
         and forward=%s
-), %s
+), 0), %s
 where exists (
     select 1
     from node
@@ -298,14 +292,80 @@ where
     time_removed is null
     and base_id=%s
     and ctx=%s
-    and forward=%s
+    and forward=true
     and pos >= %s
 order by pos asc
 limit %s
-""", (123, 3, True, 0, 100)),
+""", (123, 3, 0, 100)),
             FETCH_ALL,
             COMMIT])
 
+    def test_iter_forwards(self):
+        add_fetch_result([(456, 0, 0), (457, 0, 1)])
+        add_fetch_result([(458, 0, 2), (459, 0, 3)])
+        add_fetch_result([(460, 0, 4)])
+
+        rels = datahog.relationship.iter_relationships(
+                self.p, 123, 3, page_size=2)
+        self.assertEqual(eventlog, [])
+        self.assertEqual([r['rel_id'] for r in rels],
+                [456, 457, 458, 459, 460])
+
+        sql = """
+select rel_id, flags, pos
+from relationship
+where
+    time_removed is null
+    and base_id=%s
+    and ctx=%s
+    and forward=true
+    and pos >= %s
+order by pos asc
+limit %s
+"""
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE(sql, (123, 3, 0, 2)),
+            FETCH_ALL,
+            COMMIT,
+            GET_CURSOR,
+            EXECUTE(sql, (123, 3, 2, 2)),
+            FETCH_ALL,
+            COMMIT,
+            GET_CURSOR,
+            EXECUTE(sql, (123, 3, 4, 2)),
+            FETCH_ALL,
+            COMMIT])
+
+    def test_count(self):
+        add_fetch_result([(4,)])
+
+        self.assertEqual(datahog.relationship.count(self.p, 456, 3, False), 4)
+
+        self.assertEqual(eventlog, [
+            GET_CURSOR,
+            EXECUTE("""
+select length
+from list_length
+where
+    anchor_id=%s
+    and ctx=%s
+    and forward=%s
+""", (456, 3, False)),
+            ROWCOUNT,
+            FETCH_ONE,
+            COMMIT])
+
+    def test_count_empty(self):
+        add_fetch_result([])
+
+        self.assertEqual(datahog.relationship.count(self.p, 123, 3), 0)
+
+    def test_count_bad_context(self):
+        self.assertRaises(error.BadContext,
+                datahog.relationship.count, self.p, 123, 1)
+        self.assertEqual(eventlog, [])
+
     def test_list_reverse(self):
         add_fetch_result([(123, 0, 0), (124, 0, 1), (125, 0, 2), (126, 0, 3)])
 
@@ -327,11 +387,11 @@ where
     time_removed is null
     and rel_id=%s
     and ctx=%s
-    and forward=%s
+    and forward=false
     and pos >= %s
 order by pos asc
 limit %s
-""", (456, 3, False, 0, 100)),
+""", (456, 3, 0, 100)),
             FETCH_ALL,
             COMMIT])
 
@@ -351,12 +411,12 @@ where
     time_removed is null
     and base_id=%s
     and ctx=%s
-    and forward=%s
+    and forward=true
     and pos >= %s
     and rel_id=%s
 order by pos asc
 limit %s
-""", (123, 3, True, 0, 456, 1)),
+""", (123, 3, 0, 456, 1)),
             FETCH_ALL,
             COMMIT])
 
@@ -376,12 +436,12 @@ where
     time_removed is null
     and base_id=%s
     and ctx=%s
-    and forward=%s
+    and forward=true
     and pos >= %s
     and rel_id=%s
 order by pos asc
 limit %s
-""", (123, 3, True, 0, 456, 1)),
+""", (123, 3, 0, 456, 1)),
             FETCH_ALL,
             COMMIT])
 